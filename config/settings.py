@@ -74,6 +74,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "admin_interface",
     "colorfield",
     "django.contrib.admin",
@@ -142,6 +143,8 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
     ],
+    "DEFAULT_PAGINATION_CLASS": "postcards.pagination.StableCursorPagination",
+    "PAGE_SIZE": 100,
 }
 
 # STATIC
@@ -165,6 +168,26 @@ MEDIA_ROOT = str(BASE_DIR / "media")
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = "/media/"
 
+# VECTOR TILES
+# ------------------------------------------------------------------------------
+# Map tiles are cached on disk here and cleared whenever their data changes.
+TILE_CACHE_DIR = env("TILE_CACHE_DIR", default=str(BASE_DIR / "tilecache"))
+
+# TABLES
+# ------------------------------------------------------------------------------
+# The browse tables ("items", "documents") to page with
+# postcards.pagination.KeysetPaginator rather than counting and offsetting rows.
+KEYSET_PAGINATED_TABLES = env.list("KEYSET_PAGINATED_TABLES", default=[])
+
+# GEOCODING
+# ------------------------------------------------------------------------------
+# The backend that `manage.py geocode` looks addresses up with, and its options.
+# Use postcards.geocoding.GazetteerBackend with {"path": ...} to work offline.
+GEOCODING_BACKEND = env(
+    "GEOCODING_BACKEND", default="postcards.geocoding.NominatimBackend"
+)
+GEOCODING_OPTIONS = env.json("GEOCODING_OPTIONS", default={})
+
 
 # TEMPLATES
 # ------------------------------------------------------------------------------
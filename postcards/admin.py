@@ -9,6 +9,7 @@ from import_export.admin import ExportMixin
 from .filters import DuplicateFilter
 from .models import (
     Censor,
+    Geocode,
     Image,
     Location,
     Object,
@@ -38,7 +39,7 @@ class CustomAdminFileWidget(AdminFileWidget):
             result.append(
                 f"""<a href="{value.url}" target="_blank">
                       <img 
-                        src="{value.url}" alt="{value}" 
+                        src="{value.instance.medium["jpg"]}" alt="{value}" 
                         width="500" height="500"
                         style="object-fit: cover;"
                       />
@@ -118,7 +119,9 @@ class ImageAdmin(admin.ModelAdmin):
     )
 
     def image_thumbnail(self, obj):
-        return format_html('<img src="{}" width="50" height="50" />', obj.image.url)
+        return format_html(
+            '<img src="{}" width="50" height="50" />', obj.thumbnail["jpg"]
+        )
 
     image_thumbnail.short_description = "Image Thumbnail"
 
@@ -280,6 +283,15 @@ class PostmarkAdmin(ExportMixin, admin.ModelAdmin):
     list_display = ("location", "date")
 
 
+class GeocodeAdmin(admin.ModelAdmin):
+    """Addresses looked up by postcards.geocoding. Setting a pending or failed
+    address to found, with coordinates, places everyone at that address."""
+
+    list_display = ("address", "status", "latitude", "longitude", "backend")
+    list_filter = ("status", "backend")
+    search_fields = ("address",)
+
+
 class PrimarySourceAdmin(admin.ModelAdmin):
     model = PrimarySource
     list_display = (
@@ -301,3 +313,4 @@ admin.site.register(PrimarySource, PrimarySourceAdmin)
 admin.site.register(Object, ObjectAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Postmark, PostmarkAdmin)
+admin.site.register(Geocode, GeocodeAdmin)
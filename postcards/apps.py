@@ -5,3 +5,6 @@ class PostcardsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "postcards"
     verbose_name = "Postal Items"
+
+    def ready(self):
+        from postcards import signals  # noqa: F401
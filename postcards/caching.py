@@ -0,0 +1,56 @@
+"""Helpers for building versioned cache keys.
+
+Cached data is grouped into namespaces (e.g. ``routes``). Every namespace has a
+version counter stored in the cache, and each key built for that namespace embeds
+the current version. Bumping the counter when the underlying rows change orphans
+all of the old keys at once, so we never need to track or delete them
+individually; they simply expire.
+"""
+
+import time
+
+from django.core.cache import cache
+
+
+def _version_key(namespace):
+    return f"cache_version_{namespace}"
+
+
+def get_cache_version(namespace):
+    """Return the current version number for a cache namespace."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed with a timestamp rather than 1 so that a counter that was evicted
+        # from the cache does not come back with a version we've already used.
+        cache.add(key, int(time.time()), None)
+        version = cache.get(key)
+    return version
+
+
+def next_cache_version(namespace):
+    """Bump the version of a cache namespace and return the new version, or None
+    if it had no version yet.
+
+    The counter is incremented atomically, so of several callers starting from
+    the same version exactly one gets that version plus one.
+    """
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        # The counter doesn't exist yet, so there is nothing to invalidate.
+        get_cache_version(namespace)
+        return None
+
+
+def bump_cache_version(*namespaces):
+    """Invalidate everything cached under the given namespaces."""
+    for namespace in namespaces:
+        next_cache_version(namespace)
+
+
+def versioned_key(namespace, *parts):
+    """Build a cache key for ``namespace`` that embeds its current version."""
+    return ":".join(
+        [namespace, str(get_cache_version(namespace)), *(str(p) for p in parts)]
+    )
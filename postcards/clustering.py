@@ -0,0 +1,197 @@
+"""Zoom-aware clustering of the people on the map.
+
+Many people share a town, so drawing one marker per person piles thousands of
+markers on top of each other. Instead we keep a hierarchical grid index: at every
+zoom level the world is split into cells ``GRID`` times smaller than a map tile, and
+each cell records how many people fall inside it, the sum of their coordinates (for
+the cluster's centre) and a few representative person IDs. A cell at zoom ``z``
+covers exactly four cells at ``z + 1``, so representatives can be recomputed from a
+cell's children without going back to the database.
+
+The index is built once and kept in the cache. When a person or location changes,
+only the affected people are moved between cells (see ``postcards.signals``), and
+the result is stored as the next version of the index. Concurrent updates each
+start from the same copy, so only the first to claim the next version stores
+its copy; the index is then rebuilt from the database rather than losing the
+other updates.
+"""
+
+import bisect
+
+from django.core.cache import cache
+from django.db.models.functions import Coalesce
+
+from postcards.caching import get_cache_version, next_cache_version
+from postcards.models import Person
+from postcards.tiles import project
+
+MAX_CLUSTER_ZOOM = 16
+# Cells per tile side, i.e. clusters are 32px across on 256px tiles.
+GRID = 8
+# How many person IDs are kept for each cluster.
+REPRESENTATIVES = 5
+
+CACHE_NAMESPACE = "clusters"
+# Copies of the index orphaned by concurrent updates expire after a day.
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _index_key(version):
+    return f"{CACHE_NAMESPACE}:{version}:index"
+
+
+class ClusterIndex:
+    def __init__(self):
+        # person_id -> (latitude, longitude)
+        self.points = {}
+        # One {cell: [count, latitude sum, longitude sum, ids]} mapping per zoom.
+        self.levels = [{} for _ in range(MAX_CLUSTER_ZOOM + 1)]
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        for person_id, latitude, longitude in get_person_coordinates():
+            index.add(person_id, latitude, longitude)
+        return index
+
+    @staticmethod
+    def _cells(latitude, longitude):
+        """The cell containing a point at every zoom level, from 0 upwards."""
+        x, y = project(latitude, longitude)
+        return [
+            (int(x * GRID * 2**zoom), int(y * GRID * 2**zoom))
+            for zoom in range(MAX_CLUSTER_ZOOM + 1)
+        ]
+
+    def add(self, person_id, latitude, longitude):
+        self.remove(person_id)
+        latitude, longitude = float(latitude), float(longitude)
+        self.points[person_id] = (latitude, longitude)
+        for zoom, cell in enumerate(self._cells(latitude, longitude)):
+            entry = self.levels[zoom].setdefault(cell, [0, 0.0, 0.0, []])
+            entry[0] += 1
+            entry[1] += latitude
+            entry[2] += longitude
+            bisect.insort(entry[3], person_id)
+            # The finest level keeps every ID so coarser levels can be rebuilt.
+            if zoom < MAX_CLUSTER_ZOOM:
+                del entry[3][REPRESENTATIVES:]
+
+    def remove(self, person_id):
+        if person_id not in self.points:
+            return
+        latitude, longitude = self.points.pop(person_id)
+        cells = self._cells(latitude, longitude)
+        # Work from the finest level up, so children are current when a parent
+        # needs to pick new representatives.
+        for zoom in reversed(range(MAX_CLUSTER_ZOOM + 1)):
+            cell = cells[zoom]
+            entry = self.levels[zoom][cell]
+            entry[0] -= 1
+            if not entry[0]:
+                del self.levels[zoom][cell]
+                continue
+            entry[1] -= latitude
+            entry[2] -= longitude
+            if person_id in entry[3]:
+                entry[3].remove(person_id)
+                if zoom < MAX_CLUSTER_ZOOM:
+                    entry[3] = self._representatives(zoom + 1, cell)
+
+    def _representatives(self, zoom, parent):
+        x, y = parent
+        ids = []
+        for child in [(2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1)]:
+            if child in self.levels[zoom]:
+                ids.extend(self.levels[zoom][child][3])
+        return sorted(ids)[:REPRESENTATIVES]
+
+    def clusters(self, zoom, west, south, east, north):
+        """Return the clusters within a bounding box at the given zoom."""
+        zoom = max(0, min(zoom, MAX_CLUSTER_ZOOM))
+        scale = GRID * 2**zoom
+        min_x, min_y = (int(v * scale) for v in project(north, west))
+        max_x, max_y = (int(v * scale) for v in project(south, east))
+        return [
+            {
+                "latitude": latitude / count,
+                "longitude": longitude / count,
+                "count": count,
+                "person_ids": ids[:REPRESENTATIVES],
+            }
+            for (x, y), (count, latitude, longitude, ids) in self.levels[zoom].items()
+            if min_x <= x <= max_x and min_y <= y <= max_y
+        ]
+
+
+def get_person_coordinates(**filters):
+    """(person_id, latitude, longitude) for people we can place on the map,
+    falling back to the coordinates of their town."""
+    return (
+        Person.objects.filter(**filters)
+        .annotate(
+            lat=Coalesce("latitude", "location__latitude"),
+            lon=Coalesce("longitude", "location__longitude"),
+        )
+        .filter(lat__isnull=False, lon__isnull=False)
+        .values_list("person_id", "lat", "lon")
+    )
+
+
+def get_cluster_index():
+    key = _index_key(get_cache_version(CACHE_NAMESPACE))
+    index = cache.get(key)
+    if index is None:
+        index = ClusterIndex.build()
+        # Don't replace a copy an update stored meanwhile.
+        cache.add(key, index, CACHE_TIMEOUT)
+    return index
+
+
+def update_cluster_index(person_ids=(), location_ids=()):
+    """Move the given people, and those placed by the given locations, to their
+    current cells, in a new version of the index. The index is left to be
+    rebuilt if it hasn't been built yet, or if another update claims the next
+    version first."""
+    version = get_cache_version(CACHE_NAMESPACE)
+    index = cache.get(_index_key(version))
+    if index is not None:
+        person_ids = set(person_ids)
+        if location_ids:
+            person_ids.update(
+                Person.objects.filter(location__in=location_ids).values_list(
+                    "person_id", flat=True
+                )
+            )
+        for person_id in person_ids:
+            index.remove(person_id)
+        for person_id, latitude, longitude in get_person_coordinates(
+            person_id__in=person_ids
+        ):
+            index.add(person_id, latitude, longitude)
+    # Bumped even without an index, so that one being built from rows read
+    # before this change is stored under a version nobody reads.
+    if next_cache_version(CACHE_NAMESPACE) == version + 1 and index is not None:
+        cache.set(_index_key(version + 1), index, CACHE_TIMEOUT)
+        cache.delete(_index_key(version))
+
+
+def get_cluster_features(zoom, west, south, east, north):
+    """GeoJSON for the clusters in a bounding box."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [cluster["longitude"], cluster["latitude"]],
+                },
+                "properties": {
+                    "count": cluster["count"],
+                    "person_ids": cluster["person_ids"],
+                },
+            }
+            for cluster in get_cluster_index().clusters(zoom, west, south, east, north)
+        ],
+    }
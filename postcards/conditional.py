@@ -0,0 +1,191 @@
+"""Conditional GET support (ETag / Last-Modified) for pages and API endpoints.
+
+Validators are computed from the ``updated_at`` style timestamps and row counts of
+the rows a response is built from, using a single aggregate query. When the client
+already has the current version we answer 304 Not Modified before anything is
+serialized or rendered.
+"""
+
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from postcards.caching import get_cache_version
+
+
+def get_validators(queryset, timestamp_fields, count_fields=("pk",), extra=()):
+    """Return an ``(etag, last_modified)`` pair for the rows in ``queryset``.
+
+    ``timestamp_fields`` may follow relations (e.g. ``sender_name__updated_at``) so
+    that edits to related rows shown alongside the main rows change the validators
+    too. Counts catch deletions, which don't leave a newer timestamp behind.
+    ``last_modified`` is a UNIX timestamp, or None if nothing matched.
+    """
+    aggregates = {
+        f"modified_{i}": Max(field) for i, field in enumerate(timestamp_fields)
+    }
+    aggregates.update(
+        {
+            f"count_{i}": Count(field, distinct=True)
+            for i, field in enumerate(count_fields)
+        }
+    )
+    stats = queryset.aggregate(**aggregates)
+
+    timestamps = [
+        value
+        for key, value in stats.items()
+        if key.startswith("modified_") and value is not None
+    ]
+    if not timestamps:
+        return None, None
+    last_modified = timegm(max(timestamps).utctimetuple())
+
+    parts = [queryset.model._meta.label, *(stats[key] for key in sorted(stats))]
+    parts.extend(extra)
+    etag = hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(etag), last_modified
+
+
+def combine_validators(*validators):
+    """Combine ``(etag, last_modified)`` pairs from several ``get_validators``
+    calls into one, e.g. to aggregate each many-valued relation of a row in its
+    own query rather than joining them all together."""
+    modified = [last_modified for _, last_modified in validators if last_modified]
+    if not modified:
+        return None, None
+    parts = ":".join(str(etag) for etag, _ in validators)
+    return quote_etag(hashlib.md5(parts.encode()).hexdigest()), max(modified)
+
+
+def get_request_variant(request):
+    """Parts of the request, besides the data, that change a rendered page.
+
+    Pages embed a CSRF token and may differ for signed-in users, so a cached copy
+    is only valid for the same user and CSRF cookie.
+    """
+    return (
+        request.get_full_path(),
+        getattr(request.user, "pk", None),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+    )
+
+
+def set_validator_headers(response, etag, last_modified):
+    if etag and not response.has_header("ETag"):
+        response.headers["ETag"] = etag
+    if last_modified and not response.has_header("Last-Modified"):
+        response.headers["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """Return 304 if the client's copy is current, otherwise call ``get_response``
+    and attach the validators to its response."""
+    if request.method not in ("GET", "HEAD") or etag is None:
+        return get_response()
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+        if response.status_code == 200:
+            set_validator_headers(response, etag, last_modified)
+    return response
+
+
+def condition_on(validators_func):
+    """Decorate a view so it answers conditional GETs.
+
+    ``validators_func`` takes the view's arguments and returns an
+    ``(etag, last_modified)`` pair, usually from ``get_validators``.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            etag, last_modified = validators_func(request, *args, **kwargs)
+            return conditional_response(
+                request,
+                etag,
+                last_modified,
+                lambda: view(request, *args, **kwargs),
+            )
+
+        return inner
+
+    return decorator
+
+
+class ConditionalGetMixin:
+    """Answer conditional list and detail requests on a DRF viewset with 304
+    before serializing anything.
+
+    Set ``last_modified_fields`` to the timestamps of the model (first) and of any
+    related rows its serializer includes, and ``count_fields`` to the many-valued
+    relations it includes, whose rows can be removed without a newer timestamp.
+
+    Aggregating over every related row of a whole table is costly, so lists can
+    instead be validated on the model's own timestamp and row count plus the
+    versions of ``list_cache_namespaces``, the cache namespaces bumped whenever
+    the related rows change (see ``postcards.signals``). Those lists get an ETag
+    but no Last-Modified, which wouldn't change with the related rows.
+    """
+
+    last_modified_fields = ("updated_at",)
+    count_fields = ("pk",)
+    list_cache_namespaces = ()
+
+    def get_validators(self, queryset):
+        return get_validators(
+            queryset,
+            self.last_modified_fields,
+            self.count_fields,
+            extra=(
+                self.request.get_full_path(),
+                self.request.accepted_renderer.format,
+            ),
+        )
+
+    def get_list_validators(self, queryset):
+        if not self.list_cache_namespaces:
+            return self.get_validators(queryset)
+        etag, _ = get_validators(
+            queryset,
+            self.last_modified_fields[:1],
+            extra=(
+                self.request.get_full_path(),
+                self.request.accepted_renderer.format,
+                *(get_cache_version(name) for name in self.list_cache_namespaces),
+            ),
+        )
+        return etag, None
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators(
+            self.filter_queryset(self.get_queryset())
+        )
+        return conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+        etag, last_modified = self.get_validators(queryset)
+        return conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
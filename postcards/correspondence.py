@@ -0,0 +1,48 @@
+"""A person's correspondence, as listed on their page.
+
+The items a person sent and received are fetched in one query, joined to both
+correspondents, rather than as a UNION of the two relations, which can't follow
+the joins the listing renders for every row.
+"""
+
+from django.db.models import Case, CharField, Prefetch, Q, Value, When
+from django.shortcuts import get_object_or_404
+
+from postcards.models import Object, Person, PrimarySource
+
+SENT = "sent"
+RECEIVED = "received"
+
+
+def get_correspondence(person):
+    """The postal objects ``person`` sent or received, oldest first.
+
+    Each object is annotated with its ``direction`` from the person's point of
+    view, ``SENT`` or ``RECEIVED``; items sent to oneself count as sent.
+    """
+    return (
+        Object.objects.filter(Q(sender_name=person) | Q(addressee_name=person))
+        .select_related("sender_name", "addressee_name")
+        .defer("search_vector")
+        .annotate(
+            direction=Case(
+                When(sender_name=person, then=Value(SENT)),
+                default=Value(RECEIVED),
+                output_field=CharField(),
+            )
+        )
+        .order_by("date_of_correspondence", "pk")
+    )
+
+
+def get_correspondent(pk):
+    """The person shown on a person page, with their location and the primary
+    sources about them (as ``primary_sources``) fetched up front."""
+    queryset = Person.objects.select_related("location").prefetch_related(
+        Prefetch(
+            "person",
+            PrimarySource.objects.order_by("title", "pk"),
+            to_attr="primary_sources",
+        )
+    )
+    return get_object_or_404(queryset, pk=pk)
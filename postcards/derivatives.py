@@ -0,0 +1,72 @@
+"""Smaller copies of scanned images, for the pages that don't need a full scan.
+
+Each image gets a thumbnail for the browse tables and the admin, and a medium
+preview for object and document pages, as WebP and as JPEG for browsers without
+WebP. They're stored next to the original (``images/AR_12-Front_thumbnail.webp``)
+and their names kept in ``Image.derivatives`` along with the name of the file
+they were made from, so that a replaced file gets new ones.
+
+Derivatives are made when an image is saved (see ``postcards.signals``), when
+images are ingested, and by the ``generate_derivatives`` command for images that
+don't have them yet.
+"""
+
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+# The boxes each derivative is scaled down to fit, at twice the size they're
+# shown at for high-density screens.
+DERIVATIVE_SIZES = {
+    "thumbnail": (100, 100),
+    "medium": (1000, 1000),
+}
+
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 6}),
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+
+def derivative_name(name, size, extension):
+    stem, _ = os.path.splitext(name)
+    return f"{stem}_{size}.{extension}"
+
+
+def build_derivatives(name):
+    """Write the derivatives of the stored image ``name`` next to it, and return
+    them as ``{"source": name, size: {extension: name}}``."""
+    largest = max(DERIVATIVE_SIZES.values())
+    with default_storage.open(name) as f, PILImage.open(f) as original:
+        # Let JPEG decoding skip straight to a scale near the largest derivative.
+        original.draft("RGB", largest)
+        original = ImageOps.exif_transpose(original).convert("RGB")
+
+    derivatives = {"source": name}
+    for size, box in DERIVATIVE_SIZES.items():
+        image = original.copy()
+        image.thumbnail(box, PILImage.LANCZOS)
+        derivatives[size] = {}
+        for extension, (image_format, options) in DERIVATIVE_FORMATS.items():
+            content = io.BytesIO()
+            image.save(content, image_format, **options)
+            derivative = derivative_name(name, size, extension)
+            # Replace rather than add to earlier derivatives of the same file.
+            default_storage.delete(derivative)
+            derivatives[size][extension] = default_storage.save(
+                derivative, ContentFile(content.getvalue())
+            )
+    return derivatives
+
+
+def try_build_derivatives(name):
+    """``build_derivatives``, returning ``(derivatives, None)`` or ``(None, error
+    message)`` rather than raising, for use in a process pool."""
+    try:
+        return build_derivatives(name), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
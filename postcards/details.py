@@ -0,0 +1,60 @@
+"""Cached rendering of the postal object pages.
+
+An object's page shows its images, transcriptions, postmarks, censor and
+correspondents. The page body is rendered once with everything it needs fetched
+up front, and then cached per object until one of those rows changes. Edits to a
+single object, its images or transcriptions drop just that object's page.
+Edits to the people, places, postmarks, censors and collections that pages share
+bump the versioned ``object_pages`` namespace instead (see ``postcards.signals``).
+"""
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+
+from postcards.caching import versioned_key
+from postcards.models import Object, Postmark
+
+OBJECT_PAGE_TIMEOUT = 60 * 60 * 24
+
+
+def get_object_details_queryset():
+    return (
+        Object.objects.defer("search_vector")
+        .select_related(
+            "collection", "sender_name", "addressee_name", "regime_location"
+        )
+        .prefetch_related(
+            "images",
+            "transcriptions",
+            Prefetch("postmark", Postmark.objects.select_related("location")),
+        )
+    )
+
+
+def object_page_key(pk):
+    return versioned_key("object_pages", pk)
+
+
+def render_object_details(pk):
+    """The item ID and rendered body of an object's page, as a dict.
+
+    Raises ``Http404`` if there's no such object.
+    """
+    key = object_page_key(pk)
+    page = cache.get(key)
+    if page is None:
+        postal_object = get_object_or_404(get_object_details_queryset(), pk=pk)
+        page = {
+            "item_id": postal_object.item_id,
+            "content": render_to_string(
+                "postal/object_details_partial.html", {"object": postal_object}
+            ),
+        }
+        cache.set(key, page, OBJECT_PAGE_TIMEOUT)
+    return page
+
+
+def invalidate_object_pages(*pks):
+    cache.delete_many([object_page_key(pk) for pk in pks if pk is not None])
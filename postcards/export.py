@@ -0,0 +1,191 @@
+"""Streaming bulk export of postal objects as NDJSON or CSV.
+
+Objects are read with ``.iterator(chunk_size=...)`` so only one chunk, and the
+related rows prefetched for it, is in memory at a time. Each object is flattened
+into a single row with its sender, addressee, postmarks, censor, tags and
+transcriptions, and written out as soon as it's read.
+
+Under ASGI, Django reads a synchronous iterator into a list before sending any
+of it, so ``aiter_chunks`` reads the export a chunk at a time in a worker thread
+instead.
+"""
+
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from postcards.models import Object, Postmark
+
+CHUNK_SIZE = 500
+
+EXPORT_FIELDS = [
+    "id",
+    "item_id",
+    "collection",
+    "collection_location",
+    "letter_type",
+    "date_of_correspondence",
+    "sender",
+    "sender_town_city",
+    "sender_country",
+    "sender_latitude",
+    "sender_longitude",
+    "addressee",
+    "addressee_town_city",
+    "addressee_country",
+    "addressee_latitude",
+    "addressee_longitude",
+    "postmarks",
+    "regime_censor",
+    "censor",
+    "censor_town_city",
+    "regime_censor_date",
+    "return_to_sender",
+    "date_returned",
+    "reason_for_return_original",
+    "reason_for_return_translated",
+    "translated",
+    "other",
+    "tags",
+    "transcriptions",
+    "public_notes",
+]
+
+# Joins the values of many-valued fields in a CSV cell.
+CSV_SEPARATOR = "; "
+
+
+def get_export_queryset():
+    return (
+        Object.objects.select_related(
+            "collection",
+            "sender_name__location",
+            "addressee_name__location",
+            "regime_location__censor_location",
+        )
+        .prefetch_related(
+            Prefetch(
+                "postmark",
+                Postmark.objects.select_related("location").order_by("date"),
+            ),
+            "tags",
+            "transcriptions",
+        )
+        .order_by("pk")
+    )
+
+
+def _person_fields(prefix, person):
+    """Columns for a sender or addressee, placed at their town if they have no
+    coordinates of their own."""
+    location = person.location if person else None
+    latitude = person.latitude if person else None
+    longitude = person.longitude if person else None
+    if (latitude is None or longitude is None) and location:
+        latitude, longitude = location.latitude, location.longitude
+    return {
+        prefix: str(person) if person else None,
+        f"{prefix}_town_city": location.town_city if location else None,
+        f"{prefix}_country": location.country if location else None,
+        f"{prefix}_latitude": latitude,
+        f"{prefix}_longitude": longitude,
+    }
+
+
+def flatten_object(obj):
+    """Flatten a postal object and its related rows into one export row.
+
+    Many-valued fields (postmarks, tags and transcriptions) are lists.
+    """
+    censor = obj.regime_location
+    return {
+        "id": obj.pk,
+        "item_id": obj.item_id,
+        "collection": obj.collection.name if obj.collection else None,
+        "collection_location": obj.collection_location,
+        "letter_type": obj.letter_type,
+        "date_of_correspondence": obj.date_of_correspondence,
+        **_person_fields("sender", obj.sender_name),
+        **_person_fields("addressee", obj.addressee_name),
+        "postmarks": [str(postmark) for postmark in obj.postmark.all()],
+        "regime_censor": obj.regime_censor,
+        "censor": censor.censor_name if censor else None,
+        "censor_town_city": (
+            censor.censor_location.town_city
+            if censor and censor.censor_location
+            else None
+        ),
+        "regime_censor_date": obj.regime_censor_date,
+        "return_to_sender": obj.return_to_sender,
+        "date_returned": obj.date_returned,
+        "reason_for_return_original": obj.reason_for_return_original,
+        "reason_for_return_translated": obj.reason_for_return_translated,
+        "translated": obj.translated,
+        "other": obj.other,
+        "tags": [tag.name for tag in obj.tags.all()],
+        "transcriptions": [
+            transcription.transcription
+            for transcription in obj.transcriptions.all()
+            if transcription.transcription
+        ],
+        "public_notes": obj.public_notes,
+    }
+
+
+def iter_rows(queryset=None, chunk_size=CHUNK_SIZE):
+    if queryset is None:
+        queryset = get_export_queryset()
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield flatten_object(obj)
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+class _Echo:
+    """A file-like object whose ``write`` hands back the line it was given, so
+    ``csv.writer`` can be used to format one row at a time."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(
+            [
+                CSV_SEPARATOR.join(value) if isinstance(value, list) else value
+                for value in (row[field] for field in EXPORT_FIELDS)
+            ]
+        )
+
+
+async def aiter_chunks(lines, chunk_size=CHUNK_SIZE):
+    """Iterate over ``lines`` asynchronously, ``chunk_size`` lines at a time.
+
+    Each chunk is read on the thread the request's database connection belongs
+    to, so the cursor behind ``iter_rows`` stays on one connection throughout.
+    """
+    lines = iter(lines)
+    read_chunk = sync_to_async(lambda: "".join(islice(lines, chunk_size)))
+    try:
+        while chunk := await read_chunk():
+            yield chunk
+    finally:
+        # Close the generators, and with them the cursor, if the client leaves.
+        if hasattr(lines, "close"):
+            await sync_to_async(lines.close)()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+    "csv": (iter_csv, "text/csv"),
+}
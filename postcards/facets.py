@@ -0,0 +1,123 @@
+"""Facets for the Browse Items page.
+
+The postmark, city and province lists offered as filters only change when
+postmarks or locations do, so each list is cached under the versioned ``facets``
+namespace, which ``postcards.signals`` bumps on those saves.
+
+Facet counts describe the objects matching the current filters. They're
+computed in a single query and cached briefly per set of filter parameters.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import CharField, Count, F, Value
+from django.db.models.functions import Cast, ExtractYear
+from django.utils.http import urlencode
+
+from postcards.caching import versioned_key
+from postcards.models import Location, Object, Postmark
+
+FACET_TIMEOUT = 60 * 60 * 24
+FACET_COUNT_TIMEOUT = 60 * 5
+
+# The expression each facet counts objects by.
+COUNT_FACETS = {
+    "collection": F("collection__name"),
+    "letter_type": F("letter_type"),
+    "regime_censor": F("regime_censor"),
+    "other": F("other"),
+    "year": ExtractYear("date_of_correspondence"),
+    "tag": F("tags__name"),
+}
+
+
+def _cached(name, build):
+    key = versioned_key("facets", name)
+    values = cache.get(key)
+    if values is None:
+        values = build()
+        cache.set(key, values, FACET_TIMEOUT)
+    return values
+
+
+def get_postmarks():
+    """``(id, label)`` pairs for every postmark, for the postmark dropdown."""
+    return _cached(
+        "postmark_choices",
+        lambda: [
+            (postmark.pk, str(postmark))
+            for postmark in Postmark.objects.select_related("location").only(
+                "date", "location__town_city", "location__country"
+            )
+        ],
+    )
+
+
+def get_location_values(field_name):
+    """The distinct, sorted values of a ``Location`` field, e.g. ``town_city``."""
+    return _cached(
+        field_name,
+        lambda: list(
+            Location.objects.exclude(**{field_name: None})
+            .order_by(field_name)
+            .values_list(field_name, flat=True)
+            .distinct()
+        ),
+    )
+
+
+def count_facets(queryset):
+    """Count the objects in ``queryset`` by each of ``COUNT_FACETS``.
+
+    Each facet is a grouped count, and the counts are combined with UNION ALL so
+    they come back in one round trip. Returns ``{facet: [{"value", "count"}]}``
+    with the most common values first.
+    """
+    objects = Object.objects.filter(pk__in=queryset.order_by().values("pk"))
+    counts = [
+        objects.order_by()
+        .annotate(
+            facet=Value(facet, output_field=CharField()),
+            value=Cast(expression, output_field=CharField()),
+        )
+        .values("facet", "value")
+        .annotate(count=Count("pk"))
+        .values_list("facet", "value", "count")
+        for facet, expression in COUNT_FACETS.items()
+    ]
+
+    facets = {facet: [] for facet in COUNT_FACETS}
+    for facet, value, count in counts[0].union(*counts[1:], all=True):
+        if value is not None:
+            facets[facet].append({"value": value, "count": count})
+    for values in facets.values():
+        values.sort(key=lambda item: (-item["count"], item["value"]))
+    return facets
+
+
+def _param_values(data, name):
+    # Filtersets hold a QueryDict when bound to a request's parameters, but
+    # django-filter leaves them with a plain dict when there are none.
+    if hasattr(data, "getlist"):
+        return data.getlist(name)
+    value = data.get(name)
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def get_facet_counts(filterset):
+    """Facet counts for the objects matching a bound ``ObjectFilter``, cached on
+    its normalized parameters."""
+    params = sorted(
+        (name, value)
+        for name in filterset.filters
+        for value in _param_values(filterset.data, name)
+        if value
+    )
+    digest = hashlib.md5(urlencode(params).encode()).hexdigest()
+    key = versioned_key("facet_counts", digest)
+    facets = cache.get(key)
+    if facets is None:
+        facets = count_facets(filterset.qs)
+        cache.set(key, facets, FACET_COUNT_TIMEOUT)
+    return facets
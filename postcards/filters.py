@@ -1,33 +1,166 @@
+import calendar
+import re
+from datetime import date, datetime, timedelta
+
 import django_filters
 from dateutil.parser import parse
 from django.contrib.admin import SimpleListFilter
+from django.core.cache import cache
 from django.db.models import Count, Q
 from django.shortcuts import render
+from django_filters.constants import EMPTY_VALUES
 
-from postcards.models import Collection, Location, Object, PrimarySource
+from postcards.caching import versioned_key
+from postcards.models import (
+    Collection,
+    Location,
+    Object,
+    Person,
+    Postmark,
+    PrimarySource,
+)
+from postcards.search import search_objects
 
 
-def get_names(field_prefix):
-    """Get names from the Object model for a given field prefix (sender_name or addressee_name)."""
-    return (
-        Object.objects.exclude(
-            **{f"{field_prefix}__first_name": "NA", f"{field_prefix}__last_name": "NA"}
+def combine_all_names():
+    """All the distinct sender and addressee names, for the writer dropdown.
+
+    The list is cached and rebuilt after people or postal objects change.
+    """
+    key = versioned_key("writers", "names")
+    all_names = cache.get(key)
+    if all_names is None:
+        writers = Q(pk__in=Object.objects.values("sender_name")) | Q(
+            pk__in=Object.objects.values("addressee_name")
         )
-        .order_by(f"{field_prefix}__first_name", f"{field_prefix}__last_name")
-        .values_list(f"{field_prefix}__first_name", f"{field_prefix}__last_name")
+        all_names = [
+            " ".join(map(str, name))
+            for name in Person.objects.filter(writers)
+            .exclude(first_name="NA", last_name="NA")
+            .order_by("first_name", "last_name")
+            .values_list("first_name", "last_name")
+            .distinct()
+        ]
+        cache.set(key, all_names, 60 * 60 * 24)
+
+    return [(name, name) for name in all_names]
+
+
+PARTIAL_DATE = re.compile(r"^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?$")
+
+MONTH = re.compile(r"^\d{4}-\d{1,2}$")
+
+# dateutil fills in the parts of a date it wasn't given from its default, so a
+# date is parsed with two defaults that differ in every part, and the parts the
+# results disagree on weren't given.
+PARSE_DEFAULTS = (datetime(2000, 1, 1), datetime(2001, 2, 2))
+
+
+def _date_parts(value):
+    """The year, month and day given in ``value``, each None if it wasn't."""
+    match = PARTIAL_DATE.match(value)
+    if match is not None:
+        return tuple(int(part) if part else None for part in match.groups())
+    first, second = (parse(value, default=default) for default in PARSE_DEFAULTS)
+    return tuple(
+        getattr(first, part) if getattr(first, part) == getattr(second, part) else None
+        for part in ("year", "month", "day")
     )
 
 
-def combine_all_names():
-    """Combine all possible names from the Object senders and addressees for the dropdown."""
-    all_names = list(get_names("sender_name")) + list(get_names("addressee_name"))
-    all_names = [" ".join(map(str, name)) for name in all_names]
-    all_names = [
-        name for i, name in enumerate(all_names) if all_names.index(name) == i
-    ]  # Only add names that are not already in the list
-    all_names = [(name, name) for name in all_names]
+def parse_date_range(value):
+    """The dates a possibly partial date covers, as a half-open ``(start, end)``
+    range: "1940" is the whole year, "1940-05" or "May 1940" the month of May,
+    and a full date in any format dateutil understands (e.g. "05/12/1940") a
+    single day.
+
+    Returns None if ``value`` isn't a date, or leaves out its year, or gives a
+    day without a month.
+    """
+    try:
+        year, month, day = _date_parts(value.strip())
+        if year is None or (day and not month):
+            return None
+        if day:
+            start = date(year, month, day)
+            return start, start + timedelta(days=1)
+        if month:
+            start = date(year, month, 1)
+            days = calendar.monthrange(year, month)[1]
+            return start, start + timedelta(days=days)
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    except (ValueError, OverflowError):
+        return None
+
+
+def date_range_q(field_name, value, lookup_expr="exact"):
+    """A ``Q`` on the dates in ``field_name`` within (``exact``), on or after
+    (``gte``) or on or before (``lte``) the partial date ``value``, expressed as
+    plain comparisons so the field's index can be used. None if ``value`` isn't
+    a date."""
+    date_range = parse_date_range(value)
+    if date_range is None:
+        return None
+    start, end = date_range
+    if lookup_expr == "gte":
+        return Q(**{f"{field_name}__gte": start})
+    if lookup_expr == "lte":
+        return Q(**{f"{field_name}__lt": end})
+    return Q(**{f"{field_name}__gte": start, f"{field_name}__lt": end})
+
+
+def legacy_postmark_q(label):
+    """A ``Q`` on postmarks matching a label from ``Postmark.__str__``, as the
+    postmark dropdown used to submit before it sent IDs."""
+    location_name, _, day = label.partition(", dated ")
+    location_name = location_name.replace("Postmarked at ", "", 1)
+    town_city, _, country = location_name.partition(", ")
+    if country:
+        query = Q(location__town_city=town_city, location__country=country)
+    else:
+        # Labels leave out whichever of the town and country is missing.
+        query = Q(location__town_city=town_city) | Q(location__country=town_city)
+    if not day or day == "unknown date":
+        return query & Q(date__isnull=True)
+    try:
+        return query & Q(date=parse(day).date())
+    except (ValueError, OverflowError):
+        return Q(pk__in=[])
+
+
+class DateRangeFilter(django_filters.CharFilter):
+    """Filter a date field on a date that may be just a year or a year and month.
+
+    Values that aren't dates match nothing. Filters across a many-valued relation
+    (``distinct=True``) match through a subquery, so rows aren't repeated.
+    """
 
-    return all_names
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("distinct", False)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        query = self.get_query(value)
+        if query is None:
+            return qs.none()
+        if self.distinct:
+            return qs.filter(pk__in=qs.model.objects.filter(query).values("pk"))
+        return qs.filter(query)
+
+    def get_query(self, value):
+        return date_range_q(self.field_name, value, self.lookup_expr)
+
+
+class MonthFilter(DateRangeFilter):
+    """Filter a date field on a month given as YYYY-MM. Other values match
+    nothing."""
+
+    def get_query(self, value):
+        if MONTH.match(value.strip()) is None:
+            return None
+        return super().get_query(value)
 
 
 class TownCityFilter(django_filters.ModelChoiceFilter):
@@ -79,23 +212,67 @@ class ObjectFilter(django_filters.FilterSet):
             "query",
             "correspondence",
             "date",
+            "date_after",
+            "date_before",
+            "year",
+            "month",
+            "returned",
+            "returned_after",
+            "returned_before",
+            "postmarked",
+            "postmarked_after",
+            "postmarked_before",
             "collection",
             "town_city",
             "province_state",
             "postmark",
+            "postmark_location",
             "all_fields",
         ]
 
     correspondence = django_filters.ChoiceFilter(
-        choices=combine_all_names(),
         method="filter_query",
         label="Writer",
         empty_label="Select a writer",
     )
-    date = django_filters.CharFilter(
+    date = DateRangeFilter(
+        field_name="date_of_correspondence", label="Date of correspondence"
+    )
+    date_after = DateRangeFilter(
+        field_name="date_of_correspondence",
+        lookup_expr="gte",
+        label="Written on or after",
+    )
+    date_before = DateRangeFilter(
         field_name="date_of_correspondence",
-        lookup_expr="icontains",
-        label="Date of correspondence",
+        lookup_expr="lte",
+        label="Written on or before",
+    )
+    year = django_filters.NumberFilter(
+        field_name="date_of_correspondence", lookup_expr="year", label="Year"
+    )
+    month = MonthFilter(field_name="date_of_correspondence", label="Month (YYYY-MM)")
+    returned = DateRangeFilter(field_name="date_returned", label="Date returned")
+    returned_after = DateRangeFilter(
+        field_name="date_returned", lookup_expr="gte", label="Returned on or after"
+    )
+    returned_before = DateRangeFilter(
+        field_name="date_returned", lookup_expr="lte", label="Returned on or before"
+    )
+    postmarked = DateRangeFilter(
+        field_name="postmark__date", distinct=True, label="Postmark date"
+    )
+    postmarked_after = DateRangeFilter(
+        field_name="postmark__date",
+        lookup_expr="gte",
+        distinct=True,
+        label="Postmarked on or after",
+    )
+    postmarked_before = DateRangeFilter(
+        field_name="postmark__date",
+        lookup_expr="lte",
+        distinct=True,
+        label="Postmarked on or before",
     )
     collection = django_filters.ModelChoiceFilter(
         field_name="collection",
@@ -105,6 +282,9 @@ class ObjectFilter(django_filters.FilterSet):
     town_city = django_filters.CharFilter(method="filter_by_city")
     province_state = django_filters.CharFilter(method="filter_by_state")
     postmark = django_filters.CharFilter(method="filter_by_postmark")
+    postmark_location = django_filters.NumberFilter(
+        method="filter_by_postmark_location", label="Postmark location"
+    )
     query = django_filters.CharFilter(
         method="filter_query",
         label="Keyword search",
@@ -113,43 +293,42 @@ class ObjectFilter(django_filters.FilterSet):
         method="filter_by_all_fields", label="Keyword search"
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Look the names up per request, so the module can be imported without a
+        # database and the list includes writers added since the server started.
+        self.filters["correspondence"].extra["choices"] = combine_all_names()
+
     def filter_by_postmark(self, queryset, name, value):
-        if value:
-            # Check if ', dated ' is in the value string
-            if ", dated " in value:
-                # Split the value into location name and date
-                location_name, date = value.split(", dated ", 1)
-            else:
-                # Set location_name to value and date to "unknown date"
-                location_name, date = value, "unknown date"
-            # Remove the "Postmarked at " prefix from the location name
-            location_name = location_name.replace("Postmarked at ", "")
-            # Check if the location name contains a comma
-            if ", " in location_name:
-                # Split the location name into town_city and country
-                town_city, country = location_name.split(", ", 1)
-            else:
-                # Set town_city to location_name and country to an empty string
-                town_city, country = location_name, ""
-            # Create the query for town_city
-            queries = Q(postmark__location__town_city__icontains=town_city)
-            # If country is not an empty string, add a country query
-            if country:
-                queries &= Q(postmark__location__country__icontains=country)
-            # If the date is not "unknown date", parse it and add a date query
-            if date != "unknown date":
-                date = parse(date).date()
-                queries &= Q(postmark__date=date)
-            # Filter the queryset
-            return queryset.filter(queries)
-        return queryset
+        """Objects with any of the postmarks in a comma-separated list of IDs.
+
+        Older links pass a postmark's label instead ("Postmarked at Arnhem,
+        Netherlands, dated May. 10, 1940"), which is looked up with
+        ``legacy_postmark_q``.
+        """
+        if not value:
+            return queryset
+        ids = [part.strip() for part in value.split(",")]
+        if all(part.isdigit() for part in ids):
+            postmarks = Q(postmark__in=ids)
+        else:
+            postmarks = Q(
+                postmark__in=Postmark.objects.filter(legacy_postmark_q(value))
+            )
+        return queryset.filter(pk__in=Object.objects.filter(postmarks).values("pk"))
+
+    def filter_by_postmark_location(self, queryset, name, value):
+        return queryset.filter(
+            pk__in=Object.objects.filter(postmark__location_id=value).values("pk")
+        )
 
     def filter_by_date(self, queryset, value):
-        words = value.split(" ")
         queries = Q()
-        for word in words:
-            queries |= Q(date_of_correspondence__icontains=word)
-        return queryset.filter(queries)
+        for word in value.split(" "):
+            query = date_range_q("date_of_correspondence", word)
+            if query is not None:
+                queries |= query
+        return queryset.filter(queries) if queries else queryset.none()
 
     def filter_by_name(self, queryset, value):
         first_name, last_name = value.split(" ", 1)
@@ -196,25 +375,7 @@ class ObjectFilter(django_filters.FilterSet):
             queries |= Q(public_notes__icontains=word)
 
     def filter_by_all_fields(self, queryset, name, value):
-        words = value.split(" ")
-        queries = Q()
-        for word in words:
-            queries |= (
-                Q(sender_name__first_name__icontains=word)
-                | Q(sender_name__last_name__icontains=word)
-                | Q(addressee_name__first_name__icontains=word)
-                | Q(addressee_name__last_name__icontains=word)
-                | Q(date_of_correspondence__icontains=word)
-                | Q(collection__name__icontains=word)
-                | Q(sender_name__location__town_city__icontains=word)
-                | Q(sender_name__location__province_state__icontains=word)
-                | Q(addressee_name__location__town_city__icontains=word)
-                | Q(addressee_name__location__province_state__icontains=word)
-                | Q(postmark__location__town_city__icontains=word)
-                | Q(postmark__location__country__icontains=word)
-                | Q(public_notes__icontains=word)
-            )
-        return queryset.filter(queries)
+        return search_objects(queryset, value)
 
     def filter_query(self, queryset, name, value):
         if name == "postmark":
@@ -0,0 +1,54 @@
+"""A response cache for the htmx table partials.
+
+Each filter keystroke on the Browse Items and Documents pages requests the table
+partial again. The rendered partial only depends on the query string and on the
+rows it shows, so it's cached per normalized set of GET parameters under the
+versioned ``tables`` namespace, which ``postcards.signals`` bumps whenever one of
+those rows is saved or deleted. A popular browse state is then served from the
+cache without touching the database.
+"""
+
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import urlencode
+
+from postcards.caching import versioned_key
+
+FRAGMENT_TIMEOUT = 60 * 10
+
+
+def get_fragment_key(view_name, query):
+    """A cache key for the partial of ``view_name`` rendered for the ``query``
+    QueryDict, ignoring parameter order and empty parameters."""
+    params = sorted(
+        (name, value) for name, values in query.lists() for value in values if value
+    )
+    digest = hashlib.md5(urlencode(params).encode()).hexdigest()
+    return versioned_key("tables", view_name, digest)
+
+
+class FragmentCacheMixin:
+    """Cache the rendered htmx partial of a list view.
+
+    Full page loads render as usual; only htmx requests are cached, since their
+    response is the table alone.
+    """
+
+    fragment_timeout = FRAGMENT_TIMEOUT
+
+    def get(self, request, *args, **kwargs):
+        if not request.htmx:
+            return super().get(request, *args, **kwargs)
+
+        key = get_fragment_key(type(self).__name__, request.GET)
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            cache.set(key, response.content, self.fragment_timeout)
+        return response
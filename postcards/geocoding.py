@@ -0,0 +1,312 @@
+"""Geocoding the addresses of people and locations, away from the request.
+
+Saving a person or location without coordinates only queues its address as a
+pending ``Geocode`` (or takes the coordinates straight from one, if the address
+has been looked up before). People without a street address take their
+location's coordinates instead. The worker (``manage.py geocode``) resolves
+pending addresses in batches, no faster than the backend allows, and copies what
+it finds to the people and locations still missing coordinates.
+``manage.py geocode_backfill`` does the same for every address at once, with
+lookups spread over several threads.
+
+Backends are pluggable. ``GEOCODING_BACKEND`` in the settings names the class
+to use and ``GEOCODING_OPTIONS`` its keyword arguments. ``NominatimBackend``
+queries OpenStreetMap. ``GazetteerBackend`` reads places from a CSV file, which
+needs no network.
+"""
+
+import csv
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+
+from postcards.caching import bump_cache_version
+from postcards.clustering import update_cluster_index
+from postcards.models import Geocode, Location, Person
+from postcards.signals import CACHE_DEPENDENCIES, TILE_DEPENDENCIES
+from postcards.tiles import clear_tile_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "postcards.geocoding.NominatimBackend"
+
+BATCH_SIZE = 100
+
+# Lookups that fail this many times are given up on.
+MAX_ATTEMPTS = 3
+
+
+class GeocodingError(Exception):
+    """A lookup that failed, rather than found nothing, and may be retried."""
+
+
+def normalize_address(*parts):
+    """The parts of an address joined into the string it's looked up and cached
+    by: blank parts dropped, whitespace collapsed and lowercased."""
+    parts = [re.sub(r"\s+", " ", str(part)).strip() for part in parts if part]
+    return ", ".join(part for part in parts if part).casefold() or None
+
+
+def _coordinate(value):
+    return Decimal(str(round(float(value), 6)))
+
+
+class NominatimBackend:
+    """Look addresses up with OpenStreetMap's Nominatim."""
+
+    name = "nominatim"
+    # Nominatim's usage policy allows one request a second.
+    min_delay = 1.0
+
+    def __init__(self, user_agent="postcards", timeout=10):
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, address):
+        """The ``(latitude, longitude)`` of an address, or None if there's no
+        such place."""
+        try:
+            place = self.geolocator.geocode(address)
+        except GeopyError as e:
+            raise GeocodingError(str(e)) from e
+        if place is None:
+            return None
+        return place.latitude, place.longitude
+
+
+class GazetteerBackend:
+    """Look addresses up in a CSV file with ``address``, ``latitude`` and
+    ``longitude`` columns.
+
+    An address that isn't in the file is tried again without its first part,
+    and so on down to the town and country, so that people are placed by their
+    town when their street isn't listed.
+    """
+
+    name = "gazetteer"
+    min_delay = 0
+
+    def __init__(self, path):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            self.places = {
+                normalize_address(row["address"]): (
+                    float(row["latitude"]),
+                    float(row["longitude"]),
+                )
+                for row in csv.DictReader(f)
+            }
+
+    def geocode(self, address):
+        parts = address.split(", ")
+        for start in range(max(len(parts) - 1, 1)):
+            place = self.places.get(", ".join(parts[start:]))
+            if place is not None:
+                return place
+        return None
+
+
+def get_backend():
+    backend = getattr(settings, "GEOCODING_BACKEND", DEFAULT_BACKEND)
+    return import_string(backend)(**getattr(settings, "GEOCODING_OPTIONS", {}))
+
+
+def queue_geocode(record):
+    """Queue the address of a person or location without coordinates to be
+    looked up, or set its coordinates if they already have been (or if it's a
+    person without a street address, from their location)."""
+    address = record.geocode_address()
+    if address is None:
+        location = getattr(record, "location", None)
+        if location is not None:
+            record.latitude, record.longitude = location.latitude, location.longitude
+        return
+    geocode, _ = Geocode.objects.get_or_create(address=address)
+    if geocode.status == Geocode.FOUND:
+        record.latitude, record.longitude = geocode.latitude, geocode.longitude
+
+
+def missing_coordinates():
+    """The people and locations without coordinates, as ``(record, address)``
+    pairs."""
+    missing = Q(latitude=None) | Q(longitude=None)
+    records = [
+        *Location.objects.filter(missing),
+        *Person.objects.filter(missing).select_related("location"),
+    ]
+    return [
+        (record, address)
+        for record in records
+        if (address := record.geocode_address()) is not None
+    ]
+
+
+def queue_missing():
+    """Queue the addresses of the people and locations without coordinates that
+    haven't been looked up, e.g. those bulk loaded by ``postcards.importing``."""
+    addresses = {address for _, address in missing_coordinates()}
+    Geocode.objects.bulk_create(
+        [Geocode(address=address) for address in addresses],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+class RateLimiter:
+    """Space calls to ``wait``, from any number of threads, at least
+    ``interval`` seconds apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _look_up(geocode, backend, limiter):
+    limiter.wait()
+    try:
+        place = backend.geocode(geocode.address)
+    except GeocodingError as e:
+        logger.warning("Couldn't geocode %s: %s", geocode.address, e)
+        geocode.attempts += 1
+        if geocode.attempts >= MAX_ATTEMPTS:
+            geocode.status = Geocode.FAILED
+        return
+    geocode.backend = backend.name
+    if place is None:
+        geocode.status = Geocode.NOT_FOUND
+    else:
+        geocode.status = Geocode.FOUND
+        geocode.latitude, geocode.longitude = map(_coordinate, place)
+
+
+def resolve(geocodes, backend=None, workers=1, rate=None):
+    """Look up the addresses of ``geocodes`` over ``workers`` threads, making at
+    most ``rate`` requests a second (and never more than the backend allows),
+    and save the results."""
+    backend = backend or get_backend()
+    interval = max(1 / rate if rate else 0, backend.min_delay)
+    limiter = RateLimiter(interval)
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda geocode: _look_up(geocode, backend, limiter), geocodes))
+    Geocode.objects.bulk_update(
+        geocodes,
+        ["status", "latitude", "longitude", "backend", "attempts"],
+        batch_size=BATCH_SIZE,
+    )
+    return geocodes
+
+
+def resolve_pending(backend=None, batch_size=BATCH_SIZE):
+    """Look up a batch of pending addresses one at a time, and return the
+    ``Geocode``s resolved."""
+    geocodes = list(
+        Geocode.objects.filter(status=Geocode.PENDING).order_by("pk")[:batch_size]
+    )
+    return resolve(geocodes, backend)
+
+
+def _save_coordinates(model, records):
+    # bulk_update doesn't send post_save for postcards.signals to act on, nor set
+    # the auto_now fields that the API's conditional responses are validated on.
+    if records:
+        now = timezone.now()
+        for record in records:
+            record.updated_at = now
+        model.objects.bulk_update(
+            records, ["latitude", "longitude", "updated_at"], batch_size=BATCH_SIZE
+        )
+        bump_cache_version(*CACHE_DEPENDENCIES[model])
+        clear_tile_cache(*TILE_DEPENDENCIES[model])
+
+
+def _blank(field):
+    return Q(**{field: None}) | Q(**{field: ""})
+
+
+def inherit_location_coordinates():
+    """Give the people without coordinates or a street address those of their
+    location, and return them."""
+    people = list(
+        Person.objects.filter(Q(latitude=None) | Q(longitude=None))
+        .filter(_blank("house_number"), _blank("street"))
+        .filter(location__latitude__isnull=False, location__longitude__isnull=False)
+        .select_related("location")
+    )
+    for person in people:
+        person.latitude = person.location.latitude
+        person.longitude = person.location.longitude
+    _save_coordinates(Person, people)
+    update_cluster_index(person_ids=[person.pk for person in people])
+    return people
+
+
+def apply_geocodes():
+    """Copy the coordinates found for their addresses to the people and
+    locations without them, then those of locations to the people without a
+    street address, and return how many were updated."""
+    records = missing_coordinates()
+    found = Geocode.objects.filter(status=Geocode.FOUND).in_bulk(
+        {address for _, address in records}, field_name="address"
+    )
+    updated = {Location: [], Person: []}
+    for record, address in records:
+        if address in found:
+            record.latitude = found[address].latitude
+            record.longitude = found[address].longitude
+            updated[type(record)].append(record)
+
+    for model, changed in updated.items():
+        _save_coordinates(model, changed)
+    update_cluster_index(
+        person_ids=[person.pk for person in updated[Person]],
+        location_ids=[location.pk for location in updated[Location]],
+    )
+    updated[Person].extend(inherit_location_coordinates())
+    return sum(len(changed) for changed in updated.values())
+
+
+def run_worker(backend=None, batch_size=BATCH_SIZE):
+    """Queue, resolve and apply one batch of lookups, and return the number of
+    ``Geocode``s resolved."""
+    queue_missing()
+    geocodes = resolve_pending(backend, batch_size)
+    apply_geocodes()
+    return len(geocodes)
+
+
+def backfill(backend=None, workers=1, rate=None, retry=False):
+    """Look up every address of the people and locations without coordinates
+    that hasn't been looked up yet, once each (and those that failed or weren't
+    found, with ``retry``), then apply the results.
+
+    Returns the ``Geocode``s resolved and the number of records updated.
+    """
+    inherited = inherit_location_coordinates()
+    queue_missing()
+    addresses = {address for _, address in missing_coordinates()}
+    statuses = [Geocode.PENDING]
+    if retry:
+        statuses += [Geocode.FAILED, Geocode.NOT_FOUND]
+    geocodes = list(Geocode.objects.filter(address__in=addresses, status__in=statuses))
+    for geocode in geocodes:
+        geocode.status = Geocode.PENDING
+        geocode.attempts = 0
+    resolve(geocodes, backend, workers, rate)
+    return geocodes, len(inherited) + apply_geocodes()
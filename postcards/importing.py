@@ -0,0 +1,505 @@
+"""Bulk import of postal objects from the project spreadsheet.
+
+``ObjectImporter`` reads the locations, people, postmarks and existing objects
+it matches rows against into dictionaries once. It then resolves a sheet in a
+few passes over all of its rows (people, then objects, then postmarks) without
+further lookups, and writes what's new or changed with ``bulk_create`` and
+``bulk_update``.
+
+Rows are matched to objects by item number. Each object keeps a fingerprint of
+the row it was last imported from, so rows that haven't changed since are
+skipped without any writes, and re-importing the spreadsheet costs time in
+proportion to what was edited.
+
+Bulk writes don't send ``post_save``, so ``ObjectImporter.finish`` refreshes the
+caches, search vectors and cluster index that ``postcards.signals`` otherwise
+keeps current.
+"""
+
+import hashlib
+import json
+
+import pandas as pd
+from django.utils import timezone
+
+from postcards.caching import bump_cache_version
+from postcards.clustering import update_cluster_index
+from postcards.models import Collection, Location, Object, Person, Postmark
+from postcards.search import update_search_vectors
+from postcards.signals import CACHE_DEPENDENCIES
+from postcards.tiles import TILE_LAYERS, clear_tile_cache
+
+BATCH_SIZE = 500
+
+# Every postal object in the spreadsheet belongs to this collection.
+COLLECTION_NAME = "Tim Gale"
+
+LETTER_TYPES = {
+    "postcard": "Postcard",
+    "letter": "Letter",
+    "package": "Package",
+    "envelope": "Envelope",
+    "folded card": "Folded Card",
+    "envelope printed matter": 'Envelope ("printed matter")',
+    "letter sheet": "Letter Sheet",
+    "giro envelope": "Giro Envelope",
+    'envelope ("printed matter")': 'Envelope ("printed matter")',
+}
+
+OTHER_CHOICES = {
+    "red cross": "Red Cross",
+    "uberroller": "uberroller",
+    "pow": "pow",
+}
+
+# The spreadsheet columns describing a sender or addressee.
+PERSON_COLUMNS = {
+    "sender": {
+        "title": "sender title",
+        "first_name": "sender first name",
+        "last_name": "sender last name",
+        "house_number": "sender house number",
+        "street": "sender street",
+        "town_city": "sender town/city",
+        "province_state": "sender province/state",
+        "country": "sender country",
+        "entity_name": "entitiy",
+        "entity_type": "sender correspondence type",
+    },
+    "addressee": {
+        "title": "addressee title",
+        "first_name": "addressee first name",
+        "last_name": "addressee last name",
+        "house_number": "addressee house number",
+        "street": "addressee street",
+        "town_city": "addressee town/city",
+        "province_state": "addressee province/state",
+        "country": "addressee country",
+        "entity_name": "addressee entity",
+        "entity_type": "addresse correspondence type",
+    },
+}
+
+# The object fields set from a row.
+OBJECT_FIELDS = [
+    "item_id",
+    "collection_id",
+    "collection_location",
+    "check_sensitive_content",
+    "letter_enclosed",
+    "return_to_sender",
+    "date_returned",
+    "reason_for_return_original",
+    "reason_for_return_translated",
+    "regime_censor",
+    "addressee_name_id",
+    "sender_name_id",
+    "letter_type",
+    "translated",
+    "date_of_correspondence",
+    "other",
+    "public_notes",
+]
+
+# The object fields that take their values straight from a row's cells.
+ROW_FIELDS = [field for field in OBJECT_FIELDS if not field.endswith("_id")]
+
+# The object text columns that can't be NULL, stored as "" where a row leaves
+# them blank.
+REQUIRED_TEXT_FIELDS = ["item_id", "collection_location", "regime_censor", "translated"]
+
+PERSON_UPDATE_FIELDS = [
+    "entity_name",
+    "entity_type",
+    "title",
+    "house_number",
+    "street",
+    "location",
+]
+
+MISSING_TEXT = {"", "none", "nan", "nat"}
+
+
+def _text(series):
+    """Strip a column of text, with blank cells (and the "None"/"nan" text left
+    by earlier imports) as None."""
+    series = series.astype("string").str.strip()
+    missing = series.isna() | series.str.lower().isin(MISSING_TEXT)
+    return series.astype(object).where(~missing, None)
+
+
+def _lower(series):
+    return _text(series.astype("string").str.lower())
+
+
+def _yes(series):
+    return series.astype("string").str.strip().str.lower().eq("yes").fillna(False)
+
+
+def _date(series):
+    series = _text(series)
+    series = series.where(~series.isin(["NA", "No"]), None)
+    dates = pd.to_datetime(series, errors="coerce", format="mixed")
+    return dates.dt.date.astype(object).where(dates.notna(), None)
+
+
+def _not_na(series):
+    """Values containing "NA" mean there's nothing recorded."""
+    series = _text(series)
+    return series.where(~series.astype("string").str.contains("NA").fillna(False))
+
+
+def prepare_rows(df):
+    """Normalize the columns of a sheet (with lowercase headers) in whole-column
+    operations, and return its rows as dicts."""
+    rows = pd.DataFrame(index=df.index)
+    rows["item_id"] = _text(df["item number"])
+    rows["collection_location"] = _text(df["location in collection"])
+    rows["check_sensitive_content"] = _yes(df["sensitive"])
+    rows["letter_enclosed"] = _yes(df["letter enclosed (yes/no)"])
+    rows["return_to_sender"] = _yes(df["return to sender"])
+    rows["date_returned"] = _date(df["date returned to sender"])
+    rows["date_of_correspondence"] = _date(df["date of correspondence"])
+    rows["reason_for_return_original"] = _not_na(
+        df["reason for return (original language)"]
+    )
+    rows["reason_for_return_translated"] = _not_na(df["reason for return (english)"])
+    rows["translated"] = _lower(df["translated"])
+    rows["regime_censor"] = _lower(df["censor"])
+    rows["letter_type"] = _lower(df["type (postcard/letter/package)"]).map(LETTER_TYPES)
+    rows["other"] = _lower(df["other- rc, uberroller, pow"]).map(OTHER_CHOICES)
+    rows["public_notes"] = _text(df["notes"])
+    for role, columns in PERSON_COLUMNS.items():
+        for field, column in columns.items():
+            clean = _lower if field == "entity_type" else _text
+            rows[f"{role}_{field}"] = clean(df[column])
+    for n in (1, 2):
+        rows[f"postmark_{n}_location"] = _text(df[f"postmark {n} location"])
+        rows[f"postmark_{n}_date"] = _date(df[f"postmark {n} date"])
+    rows = rows.astype(object).where(rows.notna(), None)
+    return rows.to_dict("records")
+
+
+def row_fingerprint(row):
+    """A hash of a prepared row's values."""
+    content = json.dumps(row, sort_keys=True, default=str)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def _blank(value):
+    """A stored value as it would be read from a normalized cell."""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in MISSING_TEXT:
+            return None
+    return value
+
+
+class ObjectImporter:
+    """Load postal objects, their correspondents and postmarks from sheets of the
+    project spreadsheet.
+
+    Call ``import_frame`` for each sheet, then ``finish``. With ``dry_run``,
+    nothing is written; ``changes`` still lists what would be.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.counts = dict.fromkeys(
+            [
+                "new objects",
+                "updated objects",
+                "unchanged objects",
+                "new people",
+                "updated people",
+                "new postmarks",
+            ],
+            0,
+        )
+        # (item number, None for a new object or {field: (old, new)}) pairs.
+        self.changes = []
+        self.object_ids = set()
+        self.person_ids = set()
+        self.collection = Collection.objects.filter(name=COLLECTION_NAME).first()
+        if self.collection is None:
+            self.collection = Collection(name=COLLECTION_NAME)
+            if not dry_run:
+                self.collection.save()
+        self._load_locations()
+        self._load_people()
+        self.postmarks = {
+            (postmark.location_id, postmark.date, postmark.ordered_by_arrival): postmark
+            for postmark in Postmark.objects.order_by("-pk")
+        }
+        self._load_objects()
+
+    def _load_locations(self):
+        self.locations_by_place = {}
+        self.locations_by_town = {}
+        for location in Location.objects.order_by("-pk"):
+            # Iterating newest first leaves the oldest match for each key.
+            town, province = location.town_city, location.province_state
+            self.locations_by_place[(town, province, location.country)] = location
+            self.locations_by_place[(town, province)] = location
+            self.locations_by_town[town] = location
+
+    def _load_people(self):
+        self.people_by_name = {}
+        self.entities = {}
+        for person in Person.objects.order_by("-pk"):
+            name = (_blank(person.first_name), _blank(person.last_name))
+            if name == (None, None):
+                self.entities[_blank(person.entity_name)] = person
+            else:
+                self.people_by_name[name] = person
+
+    def _load_objects(self):
+        # The spreadsheet repeats a few item numbers, so the nth row with an item
+        # number is matched to the nth oldest object with it.
+        self.objects = {}
+        self.objects_by_fingerprint = {}
+        self.item_rows = {}
+        for pk, item_id, fingerprint in Object.objects.order_by("pk").values_list(
+            "pk", "item_id", "import_fingerprint"
+        ):
+            item_id = _blank(item_id)
+            if item_id is None:
+                self.objects_by_fingerprint[fingerprint] = pk
+            else:
+                self.objects.setdefault(item_id, []).append((pk, fingerprint))
+
+    def find_location(self, *place):
+        if place[0] is None:
+            return None
+        return self.locations_by_place.get(place)
+
+    def find_object(self, item_id, fingerprint):
+        """The pk and fingerprint of the object a row was imported into, or
+        ``(None, None)`` for a row not imported before. Rows without an item
+        number can only be recognized while they're unchanged."""
+        if item_id is None:
+            return self.objects_by_fingerprint.get(fingerprint), fingerprint
+        occurrence = self.item_rows.get(item_id, 0)
+        self.item_rows[item_id] = occurrence + 1
+        matches = self.objects.get(item_id, [])
+        return matches[occurrence] if occurrence < len(matches) else (None, None)
+
+    def resolve_person(self, row, role):
+        """The existing or new person a row names as its sender or addressee, or
+        None, and the ``{field: (old, new)}`` changes the row makes to them."""
+        values = {field: row[f"{role}_{field}"] for field in PERSON_COLUMNS[role]}
+        place = [values.pop("town_city"), values.pop("province_state")]
+        country = values.pop("country")
+        # Senders are placed by town, province and country; addressees, as they
+        # always have been, by town and province only.
+        if role == "sender":
+            place.append(country)
+        values["location"] = self.find_location(*place)
+        values["entity_type"] = values["entity_type"] or "person"
+        name = (values["first_name"], values["last_name"])
+
+        if name == (None, None):
+            if values["entity_name"] is None:
+                return None, {}
+            person = self.entities.get(values["entity_name"])
+        else:
+            person = self.people_by_name.get(name)
+
+        changes = {}
+        if person is None:
+            person = Person(**values)
+            self.new_people.append(person)
+            if name == (None, None):
+                self.entities[values["entity_name"]] = person
+            else:
+                self.people_by_name[name] = person
+        elif person.pk is not None:
+            location = values["location"]
+            changes = {
+                field: (getattr(person, field), values[field])
+                for field in PERSON_UPDATE_FIELDS
+                if field != "location" and getattr(person, field) != values[field]
+            }
+            if person.location_id != (location.pk if location else None):
+                changes["location"] = (person.location_id, location)
+            for field in changes:
+                setattr(person, field, values[field])
+            if changes:
+                self.updated_people[person.pk] = person
+        return person, changes
+
+    def import_frame(self, df):
+        """Import the rows of one sheet, or a chunk of one."""
+        pending = []
+        for row in prepare_rows(df):
+            fingerprint = row_fingerprint(row)
+            pk, previous = self.find_object(row["item_id"], fingerprint)
+            if pk is not None and previous == fingerprint:
+                self.counts["unchanged objects"] += 1
+            else:
+                pending.append((row, fingerprint, pk))
+        if not pending:
+            return
+
+        self.new_people = []
+        self.updated_people = {}
+        self.new_postmarks = []
+        people = [
+            (self.resolve_person(row, "sender"), self.resolve_person(row, "addressee"))
+            for row, _, _ in pending
+        ]
+        if not self.dry_run:
+            Person.objects.bulk_create(self.new_people, batch_size=BATCH_SIZE)
+            # bulk_update doesn't set auto_now fields, which the API's
+            # conditional responses are validated on.
+            now = timezone.now()
+            for person in self.updated_people.values():
+                person.updated_at = now
+            Person.objects.bulk_update(
+                self.updated_people.values(),
+                PERSON_UPDATE_FIELDS + ["updated_at"],
+                batch_size=BATCH_SIZE,
+            )
+        self.counts["new people"] += len(self.new_people)
+        self.counts["updated people"] += len(self.updated_people)
+        self.person_ids.update(person.pk for person in self.new_people)
+        self.person_ids.update(self.updated_people)
+
+        objects = self._write_objects(pending, people)
+        self._link_postmarks(pending, objects)
+
+    def _write_objects(self, pending, people):
+        """Create or update the object of each pending row, and return them."""
+        new_objects = []
+        updated_objects = []
+        objects = []
+        for (row, fingerprint, pk), (sender, addressee) in zip(pending, people):
+            values = {field: row[field] for field in OBJECT_FIELDS if field in row}
+            for field in REQUIRED_TEXT_FIELDS:
+                if values[field] is None:
+                    values[field] = ""
+            obj = Object(
+                pk=pk,
+                collection=self.collection,
+                sender_name=sender[0],
+                addressee_name=addressee[0],
+                import_fingerprint=fingerprint,
+                **values,
+            )
+            (new_objects if pk is None else updated_objects).append(obj)
+            objects.append(obj)
+        self._record_changes(pending, people, objects)
+
+        if not self.dry_run:
+            Object.objects.bulk_create(new_objects, batch_size=BATCH_SIZE)
+            now = timezone.now()
+            for obj in updated_objects:
+                obj.updated_at = now
+            Object.objects.bulk_update(
+                updated_objects,
+                [field for field in OBJECT_FIELDS if field != "item_id"]
+                + ["import_fingerprint", "updated_at"],
+                batch_size=BATCH_SIZE,
+            )
+        for obj, (row, fingerprint, pk) in zip(objects, pending):
+            if pk is None and obj.pk is not None:
+                if row["item_id"] is None:
+                    self.objects_by_fingerprint[fingerprint] = obj.pk
+                else:
+                    self.objects.setdefault(row["item_id"], []).append(
+                        (obj.pk, fingerprint)
+                    )
+        self.counts["new objects"] += len(new_objects)
+        self.counts["updated objects"] += len(updated_objects)
+        self.object_ids.update(obj.pk for obj in objects if obj.pk is not None)
+        return objects
+
+    def _record_changes(self, pending, people, objects):
+        """Describe how each pending row changes its object, for ``changes``."""
+        existing = (
+            Object.objects.select_related("sender_name", "addressee_name")
+            .prefetch_related("postmark__location")
+            .in_bulk([pk for _, _, pk in pending if pk is not None])
+        )
+        for (row, _, pk), (sender, addressee), obj in zip(pending, people, objects):
+            if pk is None:
+                self.changes.append((row["item_id"], None))
+                continue
+            old = existing[pk]
+            changes = {
+                field: (getattr(old, field), getattr(obj, field))
+                for field in ROW_FIELDS
+                if getattr(old, field) != getattr(obj, field)
+            }
+            for field, person in [
+                ("sender_name", sender),
+                ("addressee_name", addressee),
+            ]:
+                old_person = getattr(old, field)
+                if (old_person and old_person.pk) != (person[0] and person[0].pk):
+                    changes[field] = (old_person, person[0])
+                changes.update(
+                    {f"{field} {key}": value for key, value in person[1].items()}
+                )
+            old_postmarks = sorted(str(postmark) for postmark in old.postmark.all())
+            new_postmarks = sorted(str(postmark) for postmark in self._postmarks(row))
+            if old_postmarks != new_postmarks:
+                changes["postmarks"] = (old_postmarks, new_postmarks)
+            self.changes.append((row["item_id"], changes))
+
+    def _postmarks(self, row):
+        """The postmarks a row names. Those not seen before are added to
+        ``new_postmarks`` to be created."""
+        postmarks = []
+        for n in (1, 2):
+            location = self.locations_by_town.get(row[f"postmark_{n}_location"])
+            if row[f"postmark_{n}_location"] is None or location is None:
+                continue
+            key = (location.pk, row[f"postmark_{n}_date"], n)
+            if key not in self.postmarks:
+                self.postmarks[key] = Postmark(
+                    location=location, date=key[1], ordered_by_arrival=n
+                )
+                self.new_postmarks.append(self.postmarks[key])
+            postmarks.append(self.postmarks[key])
+        return postmarks
+
+    def _link_postmarks(self, pending, objects):
+        """Set the postmarks of each pending row's object to those it names."""
+        links = [
+            (obj, postmark)
+            for (row, _, _), obj in zip(pending, objects)
+            for postmark in self._postmarks(row)
+        ]
+        self.counts["new postmarks"] += len(self.new_postmarks)
+        if self.dry_run:
+            return
+
+        Postmark.objects.bulk_create(self.new_postmarks, batch_size=BATCH_SIZE)
+        # The spreadsheet is the record of an imported object's postmarks, so a
+        # changed row's replace those linked before.
+        Through = Object.postmark.through
+        Through.objects.filter(
+            object_id__in=[pk for _, _, pk in pending if pk is not None]
+        ).delete()
+        Through.objects.bulk_create(
+            [
+                Through(object_id=obj.pk, postmark_id=postmark.pk)
+                for obj, postmark in links
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def finish(self):
+        """Bring the data derived from postal objects up to date with the import,
+        and return the counts of what was loaded."""
+        if self.dry_run or not (self.object_ids or self.person_ids):
+            return self.counts
+        bump_cache_version(
+            *{namespace for deps in CACHE_DEPENDENCIES.values() for namespace in deps}
+        )
+        clear_tile_cache(*TILE_LAYERS)
+        update_search_vectors(Object.objects.filter(pk__in=self.object_ids))
+        update_cluster_index(person_ids=self.person_ids)
+        return self.counts
@@ -0,0 +1,224 @@
+"""Attaching a directory of scanned images to postal objects or primary sources.
+
+``ImageIngester`` works out which files belong to which records from their names
+and looks the records up in one query. Files are then hashed and checked to be
+readable images in a process pool, and copied into the media directory and
+scaled down (see ``postcards.derivatives``) the same way. The ``Image`` rows are
+inserted together at the end.
+
+Each image keeps the SHA-256 hash of its file. A file whose content is already
+attached to a record is skipped, so a directory can be ingested again after new
+scans are added to it. Images attached before hashes were kept are recognized by
+their file name.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.conf import settings
+from PIL import Image as PILImage
+
+from postcards.caching import bump_cache_version
+from postcards.derivatives import try_build_derivatives
+from postcards.details import invalidate_object_pages
+from postcards.models import Image, Object, PrimarySource
+from postcards.signals import CACHE_DEPENDENCIES
+
+BATCH_SIZE = 500
+
+# Where Image.image stores its files, relative to MEDIA_ROOT.
+UPLOAD_TO = "images"
+
+OBJECT_IMAGE_EXTENSIONS = {".jpg", ".png"}
+
+# The item numbers of the primary sources with scanned images.
+DOCUMENT_ITEM_ID = re.compile(r"^(XVIII|XLIV)\d+")
+
+
+def object_image_target(filename):
+    """The item number and caption of a postal object's image from its file name,
+    e.g. ``AR_12-Front.jpg``, or None if it isn't one."""
+    stem, extension = os.path.splitext(filename)
+    if extension not in OBJECT_IMAGE_EXTENSIONS:
+        return None
+    # The last part of the name is the caption, and the rest the item number.
+    parts = re.split("_|-", stem)
+    caption = parts[-1].strip()
+    if caption not in ("Front", "Reverse"):
+        caption = None
+    return "_".join(parts[:-1]).strip(), caption
+
+
+def document_image_target(filename):
+    """The item number and caption of a primary source's image from its file
+    name, or None if it isn't one."""
+    match = DOCUMENT_ITEM_ID.match(filename)
+    if match is None:
+        return None
+    return match.group(0), filename
+
+
+def hash_image(path):
+    """The SHA-256 hash of an image file, and an error message if it can't be
+    read as an image."""
+    with open(path, "rb") as f:
+        content_hash = hashlib.file_digest(f, "sha256").hexdigest()
+    try:
+        with PILImage.open(path) as image:
+            image.verify()
+    except Exception as e:
+        return content_hash, str(e) or type(e).__name__
+    return content_hash, None
+
+
+def copy_image(path, media_root, content_hash):
+    """Copy an image file into the media directory, and return its storage name.
+
+    A different file already stored under the same name is kept, and this one is
+    stored with its hash in its name instead.
+    """
+    path = Path(path)
+    name = f"{UPLOAD_TO}/{path.name}"
+    destination = Path(media_root, name)
+    if destination.exists():
+        if hash_image(destination)[0] == content_hash:
+            return name
+        name = f"{UPLOAD_TO}/{path.stem}_{content_hash[:12]}{path.suffix}"
+        destination = Path(media_root, name)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(path, destination)
+    return name
+
+
+def process_map(function, *iterables, workers=None):
+    """``map`` over a pool of ``workers`` processes (one per CPU by default), or
+    in this process if ``workers`` is 1, and return the results as a list."""
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return list(map(function, *iterables))
+    # Workers set Django up themselves where they aren't forked.
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        return list(pool.map(function, *iterables, chunksize=16))
+
+
+class ImageIngester:
+    """Attach images to the postal objects (``field="postcard"``) or primary
+    sources (``field="primary_source"``) named by their file names.
+
+    ``target`` turns a file name into an item number and caption, or None for
+    files to leave alone. File work is spread over ``workers`` processes, as with
+    ``process_map``.
+    """
+
+    models = {"postcard": Object, "primary_source": PrimarySource}
+
+    def __init__(self, field, target, workers=None):
+        self.field = field
+        self.model = self.models[field]
+        self.target = target
+        self.workers = workers
+        self.counts = dict.fromkeys(["images", "files", "already ingested"], 0)
+        # (file name, message) pairs for the files that couldn't be attached.
+        self.problems = []
+
+    def _find_records(self, item_ids):
+        records = {}
+        for pk, item_id in (
+            self.model.objects.filter(item_id__in=item_ids)
+            .order_by("pk")
+            .values_list("pk", "item_id")
+        ):
+            records.setdefault(item_id, []).append(pk)
+        return records
+
+    def ingest(self, directory):
+        """Attach the images in ``directory``, and return the counts of what was
+        done."""
+        files = []
+        for filename in sorted(os.listdir(directory)):
+            target = self.target(filename)
+            if target is not None:
+                files.append((os.path.join(directory, filename), *target))
+        records = self._find_records({item_id for _, item_id, _ in files})
+        matched = []
+        for path, item_id, caption in files:
+            if item_id in records:
+                matched.append((path, records[item_id], caption))
+            else:
+                self.problems.append(
+                    (os.path.basename(path), f"No record with item ID {item_id}")
+                )
+
+        hashes = process_map(
+            hash_image, [path for path, _, _ in matched], workers=self.workers
+        )
+        ingested = set(
+            Image.objects.filter(
+                content_hash__in=[content_hash for content_hash, _ in hashes]
+            ).values_list("content_hash", f"{self.field}_id")
+        )
+        # Images attached before hashes were kept have none, so they're matched
+        # on their file name instead.
+        unhashed = {
+            (os.path.basename(name), pk)
+            for name, pk in Image.objects.filter(
+                content_hash="",
+                **{f"{self.field}_id__in": {pk for _, pks, _ in matched for pk in pks}},
+            ).values_list("image", f"{self.field}_id")
+        }
+        pending = []
+        for (path, pks, caption), (content_hash, error) in zip(matched, hashes):
+            if error:
+                self.problems.append((os.path.basename(path), error))
+                continue
+            pks = [
+                pk
+                for pk in pks
+                if (content_hash, pk) not in ingested
+                and (os.path.basename(path), pk) not in unhashed
+            ]
+            ingested.update((content_hash, pk) for pk in pks)
+            if pks:
+                pending.append((path, pks, caption, content_hash))
+            else:
+                self.counts["already ingested"] += 1
+
+        names = process_map(
+            copy_image,
+            [path for path, _, _, _ in pending],
+            [settings.MEDIA_ROOT] * len(pending),
+            [content_hash for _, _, _, content_hash in pending],
+            workers=self.workers,
+        )
+        derivatives = process_map(try_build_derivatives, names, workers=self.workers)
+        images = []
+        for (path, pks, caption, content_hash), name, (derivative, error) in zip(
+            pending, names, derivatives
+        ):
+            if error:
+                # The image is still attached, and is shown full size.
+                self.problems.append((os.path.basename(path), error))
+            images.extend(
+                Image(
+                    image=name,
+                    image_caption=caption,
+                    content_hash=content_hash,
+                    derivatives=derivative or {},
+                    **{f"{self.field}_id": pk},
+                )
+                for pk in pks
+            )
+        Image.objects.bulk_create(images, batch_size=BATCH_SIZE)
+        self.counts["images"] += len(images)
+        self.counts["files"] += len(pending)
+
+        # bulk_create doesn't send post_save for postcards.signals to act on.
+        if images:
+            bump_cache_version(*CACHE_DEPENDENCIES[Image])
+            invalidate_object_pages(*{image.postcard_id for image in images})
+        return self.counts
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from postcards.export import CHUNK_SIZE, EXPORT_FORMATS, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Export every postal object as NDJSON or CSV, streaming it row by row."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=EXPORT_FORMATS, default="ndjson", help="output format"
+        )
+        parser.add_argument(
+            "--output", type=str, help="file to write to (defaults to stdout)"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="number of objects read from the database at a time",
+        )
+
+    def handle(self, *args, **options):
+        serialize, _ = EXPORT_FORMATS[options["format"]]
+        lines = serialize(iter_rows(chunk_size=options["chunk_size"]))
+
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(lines)
+            self.stderr.write(
+                self.style.SUCCESS(f"Exported postal objects to {options['output']}.")
+            )
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from postcards.caching import bump_cache_version
+from postcards.derivatives import try_build_derivatives
+from postcards.details import invalidate_object_pages
+from postcards.ingestion import process_map
+from postcards.models import Image
+from postcards.signals import CACHE_DEPENDENCIES
+
+
+class Command(BaseCommand):
+    help = "Make the thumbnails and previews of images that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="remake the derivatives of every image",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="number of processes to scale images with (default: one per CPU)",
+        )
+
+    def handle(self, *args, **options):
+        images = [
+            image
+            for image in Image.objects.exclude(image="")
+            .exclude(image=None)
+            .only("image", "derivatives", "postcard_id", "updated_at")
+            if options["all"] or not image.has_derivatives
+        ]
+        results = process_map(
+            try_build_derivatives,
+            [image.image.name for image in images],
+            workers=options["workers"],
+        )
+        updated = []
+        now = timezone.now()
+        for image, (derivatives, error) in zip(images, results):
+            if error:
+                self.stdout.write(self.style.ERROR(f"{image.image}: {error}"))
+            else:
+                image.derivatives = derivatives
+                image.updated_at = now
+                updated.append(image)
+        Image.objects.bulk_update(
+            updated, ["derivatives", "updated_at"], batch_size=500
+        )
+
+        if updated:
+            bump_cache_version(*CACHE_DEPENDENCIES[Image])
+            invalidate_object_pages(*{image.postcard_id for image in updated})
+        self.stdout.write(
+            self.style.SUCCESS(f"Made derivatives of {len(updated)} images.")
+        )
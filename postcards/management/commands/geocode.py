@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from postcards.geocoding import BATCH_SIZE, run_worker
+
+
+class Command(BaseCommand):
+    help = "Look up the coordinates of the people and locations queued for geocoding."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="number of addresses to look up at a time",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="keep running, checking the queue again when it's empty",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="seconds to wait when the queue is empty, with --watch",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            resolved = run_worker(batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Looked up {resolved} addresses."))
+            if resolved < options["batch_size"]:
+                if not options["watch"]:
+                    break
+                time.sleep(options["interval"])
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from postcards.geocoding import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Look up the coordinates of every person and location without them, once "
+        "per distinct address, and place people without a street address at "
+        "their location."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="number of lookups to make at once",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="most requests to make a second (never more than the backend allows)",
+        )
+        parser.add_argument(
+            "--retry",
+            action="store_true",
+            help="look up again the addresses that failed or weren't found before",
+        )
+
+    def handle(self, *args, **options):
+        geocodes, updated = backfill(
+            workers=options["workers"], rate=options["rate"], retry=options["retry"]
+        )
+        found = sum(geocode.latitude is not None for geocode in geocodes)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Looked up {len(geocodes)} addresses and found {found}; "
+                f"updated {updated} people and locations."
+            )
+        )
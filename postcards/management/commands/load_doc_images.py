@@ -1,11 +1,7 @@
-import os
-import re
-
-from dateutil.parser import parse
-from django.core.files import File
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from postcards.models import Image, PrimarySource
+from postcards.ingestion import ImageIngester, document_image_target
 
 
 class Command(BaseCommand):
@@ -16,47 +12,23 @@ class Command(BaseCommand):
             help="The path to the local images",
             default="static/upload",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="number of processes to hash and copy files with (default: one per CPU)",
+        )
 
     def handle(self, *args, **options):
-        filepath = options["filepath"]
-
-        for prefix in ["XVIII", "XLIV"]:
-            self.stdout.write(
-                self.style.SUCCESS(f"Processing item ")
-                + self.style.WARNING(f"{prefix}")
+        ingester = ImageIngester(
+            "primary_source", document_image_target, options["workers"]
+        )
+        with transaction.atomic():
+            counts = ingester.ingest(options["filepath"])
+        for filename, problem in ingester.problems:
+            self.stdout.write(self.style.ERROR(f"{filename}: {problem}"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Added {counts['images']} images from {counts['files']} files; "
+                f"{counts['already ingested']} files were already ingested."
             )
-            files = os.listdir(filepath)
-
-            item_files = [f for f in files if re.match(f"^{prefix}\d+", f)]
-            for item_file in item_files:
-                try:
-                    item_id = re.match(f"^{prefix}\d+", item_file).group(0)
-                    primary_source = PrimarySource.objects.get(item_id=item_id)
-
-                    with open(os.path.join(filepath, item_file), "rb") as f:
-                        image = Image.objects.create(
-                            primary_source=primary_source,
-                            image=File(f),
-                            image_caption=item_file,
-                        )
-                        image.save()
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Successfully updated image for PrimarySource "
-                            )
-                            + self.style.WARNING(f"{item_id}")
-                            + self.style.SUCCESS(" for image ")
-                            + self.style.WARNING(f"{item_file}")
-                        )
-                except PrimarySource.DoesNotExist:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f"No PrimarySource found with item_id {item_id}"
-                        )
-                    )
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f"An error occurred while processing item_id {item_id} and file {item_file}: {str(e)}"
-                        )
-                    )
+        )
@@ -10,6 +10,7 @@ from django.db import transaction
 from taggit.models import Tag
 
 from postcards.models import Collection, Image, Language, Person, PrimarySource
+from postcards.spreadsheets import read_records
 
 logger = logging.getLogger(__name__)
 
@@ -47,15 +48,7 @@ class Command(BaseCommand):
             )
 
     def load_data(self, file_path, sheet_name=None):
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        # strip white space; lowercase columns names and replace spaces with underscores
-        df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
-
-        # handle whitespace in data
-        df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
-        df = df.applymap(lambda x: None if str(x).strip() == "\xa0" else x)
-
-        for index, row in df.iterrows():
+        for _, row_number, row in read_records(file_path, sheet_name, underscores=True):
             item_id = row["item_number"]
             title = row["title"]
             document_type = str(row["type"]).lower()
@@ -64,7 +57,7 @@ class Command(BaseCommand):
             if pd.isnull(date):
                 date = None
             number_of_pages = row["number_of_pages"]
-            if number_of_pages == "":
+            if number_of_pages in ("", None):
                 number_of_pages = 0
             translated = row["translated_(yes/no)"]
             medium = row["medium"]
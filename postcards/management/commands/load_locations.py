@@ -2,14 +2,13 @@ import logging
 import math
 from datetime import datetime
 
-import numpy as np
-import pandas as pd
 from dateutil.parser import parse
 from django.core.exceptions import MultipleObjectsReturned, ValidationError
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from postcards.models import Location
+from postcards.spreadsheets import read_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -44,31 +43,12 @@ class Command(BaseCommand):
                     f"Loading data from file {file_path} and sheet {sheet_name}"
                 )
             )
-            xls = pd.ExcelFile(file_path)
-            dfs = {}
-
-            if sheet_name:
-                df = pd.read_excel(xls, sheet_name=sheet_name, dtype=str)
-                df = df.replace({np.nan: None})
-                df.columns = df.columns.str.strip()
-                df.columns = df.columns.str.lower()
-                dfs = {sheet_name: df}
-            else:
-                sheet_names = xls.sheet_names
-                dfs = {}
-                for sheet_name in sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name, dtype=str)
-                    df = df.replace({np.nan: None})
-                    df.columns = df.columns.str.strip()
-                    df.columns = df.columns.str.lower()
-                    dfs[sheet_name] = df
-
-            for sheet_name, df in dfs.items():
-                for index, row in df.iterrows():
+            for chunk in read_chunks(file_path, sheet_name):
+                for row_number, row in chunk.records():
                     try:
                         self.stdout.write(
                             self.style.SUCCESS(
-                                f"Processing row {index + 2} of sheet {sheet_name}"
+                                f"Processing row {row_number} of sheet {chunk.sheet_name}"
                             )
                         )
 
@@ -145,7 +125,7 @@ class Command(BaseCommand):
                     except Exception as e:
                         self.stdout.write(
                             self.style.ERROR(
-                                f"Error processing row {index + 2} of sheet {sheet_name}: {str(e)}"
+                                f"Error processing row {row_number} of sheet {chunk.sheet_name}: {str(e)}"
                             )
                         )
                         raise
@@ -153,7 +133,6 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f"Error loading data: {str(e)}"))
             raise
         finally:
-            xls.close()
             self.stdout.write(
                 self.style.SUCCESS(
                     f"Finished loading data from file {file_path} and sheet {sheet_name}"
@@ -1,23 +1,10 @@
 import logging
-import math
-from datetime import datetime
 
-import numpy as np
-import pandas as pd
-from dateutil.parser import parse
-from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from postcards.models import (
-    Collection,
-    Language,
-    Location,
-    Object,
-    Person,
-    Postmark,
-    Transcription,
-)
+from postcards.importing import ObjectImporter
+from postcards.spreadsheets import read_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -30,14 +17,20 @@ class Command(BaseCommand):
             "--filepath", type=str, help="filepath of excel file to load"
         )
         parser.add_argument("--sheetname", type=str, help="name of sheet to load")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="list the objects that would be added or changed, without saving",
+        )
 
     def handle(self, *args, **options):
         file_path = options.get("filepath", None)
         sheet_name = options.get("sheetname", None)
+        dry_run = options.get("dry_run", False)
 
         try:
             with transaction.atomic():
-                self.load_data(file_path, sheet_name)
+                self.load_data(file_path, sheet_name, dry_run)
                 self.stdout.write(self.style.SUCCESS("Successfully loaded data."))
         except Exception as e:
             logger.exception(f"Error loading Objects data: {str(e)}")
@@ -45,503 +38,47 @@ class Command(BaseCommand):
                 self.style.ERROR("Error loading Objects data. Check logs for details.")
             )
 
-    def load_data(self, file_path, sheet_name=None):
+    def load_data(self, file_path, sheet_name=None, dry_run=False):
         try:
             self.stdout.write(
                 self.style.SUCCESS(
                     f"Loading data from file {file_path} and sheet {sheet_name}"
                 )
             )
-            xls = pd.ExcelFile(file_path)
-            dfs = {}
-
-            if sheet_name:
-                df = pd.read_excel(xls, sheet_name=sheet_name, dtype=str)
-                df = df.replace({np.nan: None})
-                df.columns = df.columns.str.strip()
-                df.columns = df.columns.str.lower()
-                dfs = {sheet_name: df}
-            else:
-                sheet_names = xls.sheet_names
-                dfs = {}
-                for sheet_name in sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name, dtype=str)
-                    df = df.replace({np.nan: None})
-                    df.columns = df.columns.str.strip()
-                    df.columns = df.columns.str.lower()
-                    dfs[sheet_name] = df
-
-            for sheet_name, df in dfs.items():
-                for index, row in df.iterrows():
-                    try:
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Processing row {index + 2} of sheet {sheet_name}"
-                            )
-                        )
-
-                        # Extract data from the row
-                        addressee_correspodnence_type = str(
-                            row["addresse correspondence type"]
-                        ).lower()
-                        sender_correspondence_type = str(
-                            row["sender correspondence type"]
-                        ).lower()
-                        item_number = str(row["item number"])
-                        collection_location = str(row["location in collection"])
-                        sensitive_content = str(row["sensitive"]).lower() == "yes"
-                        letter_enclosed = (
-                            str(row["letter enclosed (yes/no)"]).lower() == "yes"
-                        )
-                        return_to_sender = str(row["return to sender"]).lower() == "yes"
-
-                        # Check for NaT and 'NA' before converting to datetime
-                        date_returned = row["date returned to sender"]
-                        if pd.notna(date_returned) and date_returned not in [
-                            "NA",
-                            "No",
-                        ]:
-                            try:
-                                date_returned = pd.to_datetime(
-                                    date_returned, errors="coerce"
-                                )
-                            except (ValueError, TypeError):
-                                date_returned = None
-                        else:
-                            date_returned = None
-
-                        date_of_correspondence = row["date of correspondence"]
-                        if pd.notna(
-                            date_of_correspondence
-                        ) and date_of_correspondence not in ["NA", "No"]:
-                            try:
-                                date_of_correspondence = pd.to_datetime(
-                                    date_of_correspondence, errors="coerce"
-                                )
-                            except (ValueError, TypeError):
-                                date_of_correspondence = None
-                        else:
-                            date_of_correspondence = None
-
-                        reason_for_return_original = str(
-                            row["reason for return (original language)"]
-                        )
-                        reason_for_return_translated = str(
-                            row["reason for return (english)"]
-                        )
-                        translated = str(row["translated"]).lower()
-                        # if reason_for_return_original or reason_for_return_translated includes the string "NA"
-                        # then set the value to None
-                        if "NA" in reason_for_return_original:
-                            reason_for_return_original = None
-                        if "NA" in reason_for_return_translated:
-                            reason_for_return_translated = None
-
-                        regime_censor = str(row["censor"]).lower()
-
-                        # Create or update Persons
-                        addressee_title = str(row["addressee title"])
-                        addressee_first_name = str(row["addressee first name"])
-                        addressee_last_name = str(row["addressee last name"])
-                        addressee_house_number = str(row["addressee house number"])
-                        addressee_street = str(row["addressee street"])
-                        addressee_town_city = str(row["addressee town/city"])
-                        addressee_province_state = str(row["addressee province/state"])
-                        addressee_country = str(row["addressee country"])
-                        addressee_entity_name = str(row["addressee entity"])
-
-                        sender_title = str(row["sender title"])
-                        sender_first_name = str(row["sender first name"])
-                        sender_last_name = str(row["sender last name"])
-                        sender_house_number = str(row["sender house number"])
-                        sender_street = str(row["sender street"])
-                        sender_town_city = str(row["sender town/city"])
-                        sender_province_state = str(row["sender province/state"])
-                        sender_country = str(row["sender country"])
-                        sender_entity_name = str(row["entitiy"])
-
-                        postmark_1_date = row["postmark 1 date"]
-                        postmark_1_location_name = row["postmark 1 location"]
-                        postmark_2_date = row["postmark 2 date"]
-                        postmark_2_location_name = row["postmark 2 location"]
-
-                        # Now, we create the Location data in the model. This data comes from
-                        # the following fields:
-                        # addressee_province_state = str(row["addressee province/state"])
-                        # addressee_country = str(row["addressee country"])
-                        # sender_province_state = str(row["sender province/state"])
-                        # sender_country = str(row["sender country"])
-                        # postmark_1_location_name = row["postmark 1 location"]
-                        # postmark_2_location_name = row["postmark 2 location"]
-                        # From these fields, we can create the Location data. We need to
-                        # check if the Location already exists. If it does, we use that
-                        # Location. If it doesn't, we create a new Location.
-
-                        addressee_location = Location.objects.filter(
-                            town_city=addressee_town_city,
-                            province_state=addressee_province_state,
-                            country=addressee_country,
-                        ).first()
-
-                        sender_location = Location.objects.filter(
-                            town_city=sender_town_city,
-                            province_state=sender_province_state,
-                            country=sender_country,
-                        ).first()
-
-                        # print the postmark being processed
-                        self.stdout.write(
-                            self.style.NOTICE(
-                                f"Processing POSTMARK 1 LOCATION ${postmark_1_location_name} for row {index + 2} of sheet {sheet_name}"
-                            )
-                        )
-
-                        postmark_1_location = Location.objects.filter(
-                            town_city=postmark_1_location_name
-                        ).first()
-
-                        if postmark_1_location_name is not None:
-                            postmark_1_location = Location.objects.filter(
-                                town_city=postmark_2_location_name
-                            ).first()
-                        else:
-                            postmark_1_location = None
-
-                        # print the postmark being processed
-                        self.stdout.write(
-                            self.style.NOTICE(
-                                f"Processing POSTMARK 2 LOCATION ${postmark_2_location_name} for row {index + 2} of sheet {sheet_name}"
-                            )
-                        )
-
-                        if postmark_2_location_name is not None:
-                            postmark_2_location = Location.objects.filter(
-                                town_city=postmark_2_location_name
-                            ).first()
-                        else:
-                            postmark_2_location = None
-
-                        addressee = None
-                        if (
-                            addressee_first_name == "None"
-                            and addressee_last_name == "None"
-                            and addressee_entity_name
-                        ):
-                            addressee = Person.objects.create(
-                                entity_name=addressee_entity_name,
-                                entity_type=addressee_correspodnence_type,
-                                title=addressee_title,
-                                house_number=addressee_house_number,
-                                street=addressee_street,
-                                location=Location.objects.filter(
-                                    town_city=addressee_town_city,
-                                    province_state=addressee_province_state,
-                                ).first(),
-                            )
-                        elif (
-                            addressee_first_name != "None"
-                            or addressee_last_name != "None"
-                        ):
-                            addressee = Person.objects.filter(
-                                first_name=addressee_first_name,
-                                last_name=addressee_last_name,
-                            ).first()
-
-                        if not addressee and addressee_entity_name:
-                            addressee = Person.objects.create(
-                                first_name=addressee_first_name
-                                if addressee_first_name != "None"
-                                else None,
-                                last_name=addressee_last_name
-                                if addressee_last_name != "None"
-                                else None,
-                                entity_name=addressee_entity_name,
-                                entity_type=addressee_correspodnence_type,
-                                title=addressee_title,
-                                house_number=addressee_house_number,
-                                street=addressee_street,
-                                location=Location.objects.filter(
-                                    town_city=addressee_town_city,
-                                    province_state=addressee_province_state,
-                                ).first(),
-                            )
-                        elif addressee:
-                            addressee.entity_name = addressee_entity_name
-                            addressee.entity_type = addressee_correspodnence_type
-                            addressee.title = addressee_title
-                            addressee.house_number = addressee_house_number
-                            addressee.street = addressee_street
-                            addressee.location = Location.objects.filter(
-                                town_city=addressee_town_city,
-                                province_state=addressee_province_state,
-                            ).first()
-                            addressee.save()
-
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f"Creating addressee {addressee_first_name} {addressee_last_name}"
-                                )
-                            )
-
-                        sender = None
-                        if (
-                            sender_first_name == "None"
-                            and sender_last_name == "None"
-                            and sender_entity_name
-                        ):
-                            sender = Person.objects.create(
-                                entity_name=sender_entity_name,
-                                entity_type=sender_correspondence_type,
-                                title=sender_title,
-                                house_number=sender_house_number,
-                                street=sender_street,
-                                location=Location.objects.filter(
-                                    town_city=sender_town_city,
-                                    province_state=sender_province_state,
-                                    country=sender_country,
-                                ).first(),
-                            )
-                        elif sender_first_name != "None" or sender_last_name != "None":
-                            sender = Person.objects.filter(
-                                first_name=sender_first_name, last_name=sender_last_name
-                            ).first()
-
-                        if not sender and sender_entity_name:
-                            sender = Person.objects.create(
-                                first_name=sender_first_name
-                                if sender_first_name != "None"
-                                else None,
-                                last_name=sender_last_name
-                                if sender_last_name != "None"
-                                else None,
-                                entity_name=sender_entity_name,
-                                entity_type=sender_correspondence_type,
-                                title=sender_title,
-                                house_number=sender_house_number,
-                                street=sender_street,
-                                location=Location.objects.filter(
-                                    town_city=sender_town_city,
-                                    province_state=sender_province_state,
-                                    country=sender_country,
-                                ).first(),
-                            )
-                        elif sender:
-                            sender.entity_name = sender_entity_name
-                            sender.entity_type = sender_correspondence_type
-                            sender.title = sender_title
-                            sender.house_number = sender_house_number
-                            sender.street = sender_street
-                            sender.location = Location.objects.filter(
-                                town_city=sender_town_city,
-                                province_state=sender_province_state,
-                                country=sender_country,
-                            ).first()
-                            sender.save()
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f"Creating sender {sender_first_name} {sender_last_name}"
-                                )
-                            )
-
-                        letter_type_mapping = {
-                            "postcard": "Postcard",
-                            "letter": "Letter",
-                            "package": "Package",
-                            "envelope": "Envelope",
-                            "folded card": "Folded Card",
-                            "envelope printed matter": 'Envelope ("printed matter")',
-                            "letter sheet": "Letter Sheet",
-                            "giro envelope": "Giro Envelope",
-                            'envelope ("printed matter")': 'Envelope ("printed matter")',
-                        }
-                        letter_type = letter_type_mapping.get(
-                            str(row["type (postcard/letter/package)"]).lower()
-                        )
-
-                        other_choices_mapping = {
-                            "red cross": "Red Cross",
-                            "uberroller": "uberroller",
-                            "pow": "pow",
-                        }
-                        other = other_choices_mapping.get(
-                            str(row["other- rc, uberroller, pow"]).lower()
-                        )
-
-                        public_notes = str(row["notes"])
-                        if pd.isna(public_notes) or public_notes.lower() == "nan":
-                            public_notes = None
-
-                        collection, _ = Collection.objects.get_or_create(
-                            name="Tim Gale"
-                        )  # Default to "Tim Gale"
-
-                        # Create or update Objects instance
-                        obj, _ = Object.objects.get_or_create(
-                            item_id=item_number,
-                            collection=collection,
-                            collection_location=collection_location,
-                            check_sensitive_content=sensitive_content,
-                            letter_enclosed=letter_enclosed,
-                            return_to_sender=return_to_sender,
-                            date_returned=date_returned,
-                            reason_for_return_original=reason_for_return_original,
-                            reason_for_return_translated=reason_for_return_translated,
-                            regime_censor=regime_censor,
-                            addressee_name=addressee,
-                            sender_name=sender,
-                            letter_type=letter_type,
-                            translated=translated,
-                            date_of_correspondence=date_of_correspondence,
-                            other=other,
-                            public_notes=public_notes,
-                        )
-
-                        try:
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f"Processing postmarks for row {index + 2} of sheet {sheet_name}"
-                                )
-                            )
-                            # Create or update the postmarks
-                            if postmark_1_location_name:
-                                postmark_1_location = (
-                                    Location.objects.filter(
-                                        town_city=postmark_1_location_name
-                                    ).first()
-                                    if postmark_1_location_name
-                                    else None
-                                )
-
-                            if postmark_2_location_name:
-                                postmark_2_location = (
-                                    Location.objects.filter(
-                                        town_city=postmark_2_location_name
-                                    ).first()
-                                    if postmark_2_location_name
-                                    else None
-                                )
-
-                            print(
-                                f"|- Initial postmark_1_date: {postmark_1_date} (type: {type(postmark_1_date)})\n",
-                                f"|- Initial postmark_1_location: {postmark_1_location} (type: {type(postmark_1_location)})\n",
-                                f"|- Initial postmark_2_date: {postmark_2_date} (type: {type(postmark_2_date)})\n",
-                                f"|- Initial postmark_2_location: {postmark_2_location} (type: {type(postmark_2_location)})",
-                            )
-                            # Create or update postmarks and associate them with the object
-                            if postmark_1_location:
-                                try:
-                                    self.stdout.write(
-                                        self.style.SUCCESS(
-                                            f"Processing Postmark 1 for row {index + 2} of sheet {sheet_name}"
-                                        )
-                                    )
-                                    # Convert the date string to a datetime object
-                                    if isinstance(postmark_1_date, str):
-                                        postmark_1_date = datetime.strptime(
-                                            postmark_1_date, "%Y-%m-%d %H:%M:%S"
-                                        ).date()
-                                    elif isinstance(
-                                        postmark_1_date, (float, int)
-                                    ) and not math.isnan(postmark_1_date):
-                                        # Convert the float or int to a date
-                                        postmark_1_date = datetime.fromtimestamp(
-                                            postmark_1_date
-                                        ).date()
-                                    else:
-                                        postmark_1_date = None
-                                except (ValueError, ValidationError) as e:
-                                    print(
-                                        f"Error processing Postmark 1 Date '{postmark_1_date}': {e}"
-                                    )
-                                    postmark_1_date = None
-
-                                print(
-                                    f"|-> Final postmark_1_date: {postmark_1_date} (type: {type(postmark_1_date)})"
-                                )
-                                postmark_1, _ = Postmark.objects.get_or_create(
-                                    date=postmark_1_date,
-                                    location=postmark_1_location,
-                                    ordered_by_arrival=1,
-                                )
-
-                            if postmark_2_location:
-                                try:
-                                    self.stdout.write(
-                                        self.style.SUCCESS(
-                                            f"Processing Postmark 2 for row {index + 2} of sheet {sheet_name}"
-                                        )
-                                    )
-                                    # Convert the date string to a datetime object
-                                    if isinstance(postmark_2_date, str):
-                                        postmark_2_date = datetime.strptime(
-                                            postmark_2_date, "%Y-%m-%d %H:%M:%S"
-                                        ).date()
-                                    elif isinstance(
-                                        postmark_2_date, (float, int)
-                                    ) and not math.isnan(postmark_2_date):
-                                        # Convert the float or int to a date
-                                        postmark_2_date = datetime.fromtimestamp(
-                                            postmark_2_date
-                                        ).date()
-                                    else:
-                                        postmark_2_date = None
-                                except (ValueError, ValidationError) as e:
-                                    print(
-                                        f"Error processing Postmark 2 Date '{postmark_2_date}': {e}"
-                                    )
-                                    postmark_2_date = None
-
-                                print(
-                                    f"Final postmark_2_date: {postmark_2_date} (type: {type(postmark_2_date)})"
-                                )
-                                postmark_2, _ = Postmark.objects.get_or_create(
-                                    date=postmark_2_date,
-                                    location=postmark_2_location,
-                                    ordered_by_arrival=2,
-                                )
-
-                            # Now that the postmarks exist, we can associate them with
-                            # the postal object. We need to do this after the postmarks
-                            # are created because the postmark needs to exist before
-                            # we can associate it with the postal object.
-                            try:
-                                # we look up the postmark by date and location
-                                if postmark_1_location:
-                                    postmark_1 = Postmark.objects.filter(
-                                        date=postmark_1_date,
-                                        location=postmark_1_location,
-                                    )
-                                    for postmark in postmark_1:
-                                        obj.postmark.add(postmark)
-
-                                if postmark_2_location:
-                                    postmark_2 = Postmark.objects.filter(
-                                        date=postmark_2_date,
-                                        location=postmark_2_location,
-                                    )
-                                    for postmark in postmark_2:
-                                        obj.postmark.add(postmark)
-
-                            except Postmark.DoesNotExist as e:
-                                print(
-                                    f"Error associating postmark with postal object: {e}"
-                                )
-                                raise e
-
-                        except Exception as e:
-                            logger.exception(
-                                "Error processing postmarks for row %s: %s",
-                                index + 2,
-                                str(e),
-                            )
-                            raise e
+            importer = ObjectImporter(dry_run=dry_run)
+            for chunk in read_chunks(file_path, sheet_name):
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Processing {len(chunk.rows)} rows of sheet "
+                        f"{chunk.sheet_name} from row {chunk.first_row}"
+                    )
+                )
+                importer.import_frame(chunk.frame())
 
-                    except Exception as e:
-                        logger.exception(
-                            "Error processing row %s: %s", index + 2, str(e)
-                        )
-                        raise e
+            counts = importer.finish()
+            if dry_run:
+                self.report_changes(importer.changes)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    ", ".join(f"{count} {name}" for name, count in counts.items())
+                )
+            )
 
         except Exception as e:
             logger.exception("Error reading Excel file: %s", str(e))
             raise e
+
+    def report_changes(self, changes):
+        for item_id, fields in changes:
+            if fields is None:
+                self.stdout.write(f"+ {item_id} (new)")
+            elif fields:
+                described = "; ".join(
+                    f"{field}: {old!r} -> {new!r}"
+                    for field, (old, new) in fields.items()
+                )
+                self.stdout.write(f"~ {item_id}: {described}")
+            else:
+                # The row changed only in ways that don't alter what's stored,
+                # such as the formatting of a date.
+                self.stdout.write(f"~ {item_id}: no changes to stored values")
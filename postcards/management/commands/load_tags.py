@@ -7,6 +7,7 @@ from django.db import transaction
 from taggit.models import Tag
 
 from postcards.models import Object
+from postcards.spreadsheets import read_records
 
 logger = logging.getLogger(__name__)
 
@@ -35,10 +36,7 @@ class Command(BaseCommand):
             )
 
     def load_data(self, file_path, sheet_name=None):
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
-
-        for index, row in df.iterrows():
+        for _, row_number, row in read_records(file_path, sheet_name, underscores=True):
             item_id = row["item_number"]
             keywords = row["key_words"]
 
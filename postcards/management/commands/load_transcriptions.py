@@ -6,6 +6,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from postcards.models import Language, Object, Transcription
+from postcards.spreadsheets import read_records
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +35,7 @@ class Command(BaseCommand):
             )
 
     def load_data(self, file_path, sheet_name=None):
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        # strip white space; lowercase columns names and replace spaces with underscores
-        df.columns = df.columns.str.strip().str.lower().str.replace(" ", "_")
-
-        for index, row in df.iterrows():
+        for _, row_number, row in read_records(file_path, sheet_name, underscores=True):
             item_id = row["item_number"]
             transcription = row["transcription"]
             translation = row["translation"]
@@ -1,12 +1,9 @@
 import logging
-import os
-import re
 
-from dateutil.parser import parse
-from django.core.files import File
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from postcards.models import Image, Object
+from postcards.ingestion import ImageIngester, object_image_target
 
 logger = logging.getLogger(__name__)
 
@@ -21,49 +18,21 @@ class Command(BaseCommand):
             help="The path to the local images",
             default="static/upload",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="number of processes to hash and copy files with (default: one per CPU)",
+        )
 
     def handle(self, *args, **options):
-        filepath = options["filepath"]
-        for filename in os.listdir(filepath):
-            if filename.endswith(".jpg") or filename.endswith(".png"):
-                parts = re.split(
-                    "_|-", os.path.splitext(filename)[0]
-                )  # Split the string on either an underscore or a dash
-                item_id = "_".join(
-                    parts[:-1]
-                ).strip()  # Join the parts of the item_id back into a string
-                caption = parts[-1].strip()  # The last part is the caption
-                try:
-                    obj = Object.objects.filter(item_id=item_id)
-                    with open(os.path.join(filepath, filename), "rb") as f:
-                        for mail in obj:
-                            if caption == "Front":
-                                img = Image(
-                                    postcard=mail, image_caption="Front"
-                                )  # Set the image_caption field to 'Front'
-                            elif caption == "Reverse":
-                                img = Image(
-                                    postcard=mail, image_caption="Reverse"
-                                )  # Set the image_caption field to 'Reverse'
-                            else:
-                                img = Image(
-                                    postcard=mail
-                                )  # If neither 'Front' nor 'Reverse' is in the filename, don't set the image_caption field
-                            img.image.save(
-                                filename, File(f)
-                            )  # Save the image file to the Image instance
-                            img.save()  # Save the Image instance
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f"Successfully updated image for Object "
-                            )
-                            + self.style.WARNING(f"{item_id}")
-                            + self.style.SUCCESS(f" for image ")
-                            + self.style.WARNING(f"{filename}")
-                        )
-                except Object.DoesNotExist:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f"Object {item_id} does not exist for image {filename}"
-                        )
-                    )
+        ingester = ImageIngester("postcard", object_image_target, options["workers"])
+        with transaction.atomic():
+            counts = ingester.ingest(options["filepath"])
+        for filename, problem in ingester.problems:
+            self.stdout.write(self.style.ERROR(f"{filename}: {problem}"))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Added {counts['images']} images from {counts['files']} files; "
+                f"{counts['already ingested']} files were already ingested."
+            )
+        )
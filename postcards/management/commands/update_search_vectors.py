@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from postcards.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the keyword search index for every postal object."
+
+    def handle(self, *args, **options):
+        count = update_search_vectors()
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated the search vectors of {count} objects.")
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from postcards.search import update_search_vectors
+
+
+def fill_search_vectors(apps, schema_editor):
+    update_search_vectors(apps.get_model("postcards", "Object").objects.all())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0070_alter_transcription_postal_object"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="object",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="object",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="postcards_o_search__f10d94_gin"
+            ),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0071_object_search_vector"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="object",
+            name="date_of_correspondence",
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="object",
+            name="date_returned",
+            field=models.DateField(
+                blank=True,
+                db_index=True,
+                help_text="Insert the date as YYYY-MM-DD or use the date picker. Leave blank if unknown.",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="postmark",
+            name="date",
+            field=models.DateField(
+                blank=True,
+                db_index=True,
+                help_text="Insert the date as YYYY-MM-DD or use the date picker. Leave blank if unknown.",
+                null=True,
+            ),
+        ),
+    ]
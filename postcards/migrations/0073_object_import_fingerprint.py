@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0072_date_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="object",
+            name="import_fingerprint",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=32
+            ),
+        ),
+    ]
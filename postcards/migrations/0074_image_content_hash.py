@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0073_object_import_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0074_image_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="derivatives",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.11 on 2026-10-18 19:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("postcards", "0076_geocode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
@@ -2,7 +2,8 @@ import logging
 
 # import settings
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.urls import reverse
 from django.utils.html import format_html
@@ -38,14 +39,47 @@ class Image(models.Model):
         null=True,
         blank=True,
     )
+    # The SHA-256 hash of the image file, so that postcards.ingestion can skip
+    # files that are already attached.
+    content_hash = models.CharField(
+        max_length=64, blank=True, default="", db_index=True, editable=False
+    )
+    # The names of the smaller copies of the image made by postcards.derivatives.
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.image_id)
 
+    @property
+    def has_derivatives(self):
+        return bool(self.image) and self.derivatives.get("source") == self.image.name
+
+    def derivative_urls(self, size):
+        """The URLs of a derivative of the image as ``{"webp": url, "jpg": url}``.
+        Images without derivatives have just the original's URL, as ``jpg``."""
+        if not self.image:
+            return {}
+        if not self.has_derivatives:
+            return {"jpg": self.image.url}
+        return {
+            extension: self.image.storage.url(name)
+            for extension, name in self.derivatives[size].items()
+        }
+
+    @property
+    def thumbnail(self):
+        return self.derivative_urls("thumbnail")
+
+    @property
+    def medium(self):
+        return self.derivative_urls("medium")
+
     def image_preview(self):
         if self.image:
             return mark_safe(
-                '<img src="%s" style="width:100px; height:100px;" />' % self.image.url
+                '<img src="%s" style="width:100px; height:100px;" />'
+                % self.thumbnail["jpg"]
             )
         else:
             return "No image attached"
@@ -195,29 +229,31 @@ class Person(models.Model):
                 images.append(obj.images)
         return images
 
-    # On save, the following tries to derive the latlon from the town_city and country
-    # fields. If successful, it stores the latlon in the latlon field.
+    def geocode_address(self):
+        """The address to look up this person's coordinates by, or None if they
+        have no location. People without a street address are placed at their
+        location rather than looked up."""
+        from postcards.geocoding import normalize_address
+
+        if self.location is None or not normalize_address(
+            self.house_number, self.street
+        ):
+            return None
+        return normalize_address(
+            self.house_number,
+            self.street,
+            self.location.town_city,
+            self.location.country,
+        )
+
+    # People without coordinates are placed by geocoding their address. The
+    # lookup is queued rather than made here (see postcards.geocoding), unless
+    # the address has been looked up before.
     def save(self, *args, **kwargs):
         if self.latitude is None or self.longitude is None:
-            try:
-                from geopy.geocoders import Nominatim
-
-                geolocator = Nominatim(user_agent="postcards")
-                location_components = [
-                    self.house_number,
-                    self.street,
-                    self.location.town_city,
-                    self.location.country,
-                ]
-                location_string = " ".join(filter(None, location_components))
-                location = geolocator.geocode(location_string)
-                logger.info(f"Geocoding: {location_string}")
-
-                if location is not None:
-                    self.latitude = str(location.latitude)
-                    self.longitude = str(location.longitude)
-            except Exception as e:
-                logger.warning("Warning in geocoding a Person: " + str(e) + str(self))
+            from postcards.geocoding import queue_geocode
+
+            queue_geocode(self)
         super().save(*args, **kwargs)
 
 
@@ -278,25 +314,59 @@ class Location(models.Model):
         else:
             return "No location data provided"
 
-    # On save, the following tries to derive the latlon from the town_city and country
-    # fields. If successful, it stores the latlon in the latlon field.
+    def geocode_address(self):
+        """The address to look up this location's coordinates by."""
+        from postcards.geocoding import normalize_address
+
+        return normalize_address(self.town_city, self.country)
+
+    # Locations without coordinates are geocoded in the background, as with
+    # people.
     def save(self, *args, **kwargs):
         if self.latitude is None or self.longitude is None:
-            try:
-                from geopy.geocoders import Nominatim
-
-                geolocator = Nominatim(user_agent="postcards")
-                location_components = [self.town_city, self.country]
-                location_string = ", ".join(filter(None, location_components))
-                location = geolocator.geocode(location_string)
-
-                self.latitude = str(location.latitude)
-                self.longitude = str(location.longitude)
-            except Exception as e:
-                logger.warning("Warning in geocoding: " + str(e))
+            from postcards.geocoding import queue_geocode
+
+            queue_geocode(self)
         super().save(*args, **kwargs)
 
 
+class Geocode(models.Model):
+    """The coordinates found for an address, or a lookup of them waiting to be
+    made. Addresses are normalized (see ``postcards.geocoding``), so each is
+    looked up only once however many people and locations share it."""
+
+    PENDING = "pending"
+    FOUND = "found"
+    NOT_FOUND = "not found"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (FOUND, "Found"),
+        (NOT_FOUND, "Not found"),
+        (FAILED, "Failed"),
+    )
+
+    address = models.CharField(max_length=500, unique=True)
+    status = models.CharField(
+        max_length=20, choices=STATUSES, default=PENDING, db_index=True
+    )
+    latitude = models.DecimalField(
+        blank=True, null=True, max_digits=9, decimal_places=6
+    )
+    longitude = models.DecimalField(
+        blank=True, null=True, max_digits=9, decimal_places=6
+    )
+    # The name of the backend that answered the lookup.
+    backend = models.CharField(max_length=50, blank=True, default="")
+    # Lookups that fail (rather than find nothing) are retried a few times.
+    attempts = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.address
+
+
 class Postmark(models.Model):
     """
     A Postmark can contain multiple Dates and Locations,
@@ -308,6 +378,7 @@ class Postmark(models.Model):
     date = models.DateField(
         null=True,
         blank=True,
+        db_index=True,
         help_text="Insert the date as YYYY-MM-DD or use the date picker. Leave blank if unknown.",
     )
     ordered_by_arrival = models.IntegerField(
@@ -516,6 +587,7 @@ class Object(models.Model):
     date_returned = models.DateField(
         null=True,
         blank=True,
+        db_index=True,
         help_text="Insert the date as YYYY-MM-DD or use the date picker. Leave blank if unknown.",
     )
     reason_for_return_original = models.TextField(
@@ -569,6 +641,7 @@ class Object(models.Model):
     date_of_correspondence = models.DateField(
         null=True,
         blank=True,
+        db_index=True,
     )
     # related_images = models.ManyToManyField(
     #     Image, blank=True, verbose_name="Related images"
@@ -622,6 +695,13 @@ class Object(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name="date created", blank=False, null=False
     )
+    # Kept up to date by postcards.search, and used for the keyword search.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # A hash of the spreadsheet row last imported into this object, so that
+    # postcards.importing can skip rows that haven't changed.
+    import_fingerprint = models.CharField(
+        max_length=32, blank=True, default="", editable=False
+    )
 
     def __str__(self):
         sender_name = f"{self.sender_name.first_name or ''} {self.sender_name.last_name or ''}".strip()
@@ -649,63 +729,15 @@ class Object(models.Model):
 
     def calculate_route(self):
         """Calculate the route between the sender and the addressee."""
+        from postcards.routes import calculate_routes
 
-        cache_key = (
-            f"route_{self.sender_name.person_id}_{self.addressee_name.person_id}"
-        )
-        route = cache.get(cache_key)
-
-        if route is None:
-            route = []
-            if self.sender_name and self.sender_name.location:
-                route.append(
-                    {
-                        "type": "person",
-                        "type_description": "sender",
-                        "latitude": self.sender_name.location.latitude,
-                        "longitude": self.sender_name.location.longitude,
-                    }
-                )
-
-            if self.regime_location:
-                route.append(
-                    {
-                        "type": "censor",
-                        "latitude": self.regime_location.censor_location.latitude,
-                        "longitude": self.regime_location.censor_location.longitude,
-                    }
-                )
-
-            postmarks_sorted = self.postmark.order_by("date")
-            for postmark in postmarks_sorted:
-                if postmark.location:
-                    route.append(
-                        {
-                            "type": "postmark",
-                            "latitude": postmark.location.latitude,
-                            "longitude": postmark.location.longitude,
-                        }
-                    )
-
-            if self.addressee_name and self.addressee_name.location:
-                route.append(
-                    {
-                        "type": "person",
-                        "type_description": "addressee",
-                        "latitude": self.addressee_name.location.latitude,
-                        "longitude": self.addressee_name.location.longitude,
-                    }
-                )
-
-            # We cache the calculation for 15 minutes
-            cache.set(cache_key, route, 60 * 15)
-
-        return route
+        return calculate_routes([self])[self.pk]
 
     class Meta:
         verbose_name = "Postal Material"
         verbose_name_plural = "Postal Materials"
         ordering = ["-date_of_correspondence"]
+        indexes = [GinIndex(fields=["search_vector"])]
 
 
 class PrimarySource(models.Model):
@@ -0,0 +1,244 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import F, FloatField, Q, QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
+from django_tables2.rows import BoundRows
+from rest_framework.pagination import CursorPagination
+
+from postcards.caching import versioned_key
+
+
+class StableCursorPagination(CursorPagination):
+    """Cursor pagination for the API, ordered on the primary key.
+
+    The primary key is unique, never changes and is always indexed, so every page
+    is an index range scan that costs the same whether it's the first page or the
+    hundredth, and rows added while a client is paging can't shift results between
+    pages. Clients can ask for larger pages with ``?page_size=``.
+    """
+
+    ordering = "pk"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+
+class CustomPaginator(Paginator):
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if int(number) > 1:
+                # return the last page
+                return self.num_pages
+            elif int(number) < 1:
+                # return the first page
+                return 1
+            else:
+                raise
+
+
+def _expand_ordering(model, name, descending, prefix=""):
+    """Yield ``(path, descending)`` pairs for one ``order_by()`` term, expanding
+    relations into the related model's default ordering as the ORM does.
+
+    Raises ``ValueError`` for terms that can't be used as a keyset, such as those
+    crossing a many-valued relation.
+    """
+    if name == "pk":
+        yield prefix + "pk", descending
+        return
+    *relations, last = name.split(LOOKUP_SEP)
+    for relation in relations:
+        field = model._meta.get_field(relation)
+        if field.many_to_many or field.one_to_many:
+            raise ValueError(name)
+        model = field.related_model
+    field = model._meta.get_field(last)
+    if field.many_to_many or field.one_to_many:
+        raise ValueError(name)
+    if not field.is_relation:
+        yield prefix + name, descending
+        return
+    ordering = field.related_model._meta.ordering or ["pk"]
+    for term in ordering:
+        if not isinstance(term, str):
+            raise ValueError(name)
+        yield from _expand_ordering(
+            field.related_model,
+            term.lstrip("-"),
+            descending != term.startswith("-"),
+            f"{prefix}{name}{LOOKUP_SEP}",
+        )
+
+
+def get_keyset_ordering(queryset):
+    """The ``(path, descending)`` keys that ``queryset`` is ordered by, ending in
+    the primary key so that every row has a unique position, or None if its
+    ordering can't be used for keyset pagination."""
+    query = queryset.query
+    terms = query.order_by or (
+        query.get_meta().ordering if query.default_ordering else []
+    )
+    ordering = []
+    try:
+        for term in terms:
+            if not isinstance(term, str) or term == "?":
+                return None
+            name, descending = term.lstrip("-"), term.startswith("-")
+            if name in query.annotations:
+                # Computed floats, such as search ranks (float4 in Postgres),
+                # don't compare equal to themselves once read back as Python
+                # floats, so rows tied with a bookmark would be skipped.
+                if isinstance(query.annotations[name].output_field, FloatField):
+                    return None
+                ordering.append((name, descending))
+            else:
+                ordering.extend(_expand_ordering(queryset.model, name, descending))
+    except (FieldDoesNotExist, ValueError):
+        return None
+    if not ordering or ordering[-1][0] != "pk":
+        ordering.append(("pk", False))
+    return ordering
+
+
+def _seek(ordering, bookmark):
+    """A filter for the rows after ``bookmark`` in ``ordering``, where nulls sort
+    last in either direction."""
+    after = Q(pk__in=[])
+    equal = Q()
+    for (path, descending), value in zip(ordering, bookmark):
+        if value is not None:
+            lookup = "lt" if descending else "gt"
+            after |= equal & (
+                Q(**{f"{path}__{lookup}": value}) | Q(**{f"{path}__isnull": True})
+            )
+            equal &= Q(**{path: value})
+        else:
+            equal &= Q(**{f"{path}__isnull": True})
+    return after
+
+
+def _resolve(record, path):
+    value = record
+    for attr in path.split(LOOKUP_SEP):
+        if value is None:
+            return None
+        value = getattr(value, attr)
+    return value
+
+
+class KeysetPaginator(CustomPaginator):
+    """A page-numbered paginator for django-tables2 tables that seeks rather than
+    counting rows with OFFSET.
+
+    When a page is shown, the sort key (e.g. date and id) of its last row is
+    cached as a bookmark, and the next page is fetched with ``WHERE (date, id) >
+    bookmark`` so it's as cheap as the first. Jumping to a page without a nearby
+    bookmark falls back to OFFSET. The total count is cached briefly, so changing
+    pages doesn't count the whole filtered queryset every time.
+
+    Tables sorted in ways a keyset can't express (e.g. on a many-to-many column)
+    are paginated as usual.
+    """
+
+    count_timeout = 60
+    bookmark_timeout = 60 * 10
+    # How many pages back to look for a bookmark to seek from.
+    bookmark_window = 10
+
+    def __init__(self, object_list, per_page, *args, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        # django-tables2 hands us its rows; the queryset is underneath.
+        self.rows = object_list if isinstance(object_list, BoundRows) else None
+        data = object_list.data.data if self.rows is not None else object_list
+        self.queryset = data if isinstance(data, QuerySet) else None
+        self.ordering = None
+        if self.queryset is not None and self.rows is not None:
+            self.ordering = get_keyset_ordering(self.queryset)
+
+    def _query_key(self, queryset):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+        # Versioned like the tables' other caches, so counts and bookmarks don't
+        # outlive changes to the rows.
+        return versioned_key(
+            "tables", hashlib.md5(f"{sql}:{params}".encode()).hexdigest()
+        )
+
+    @cached_property
+    def count(self):
+        if self.queryset is None:
+            return super().count
+        key = self._query_key(self.queryset.order_by())
+        if key is None:
+            return 0
+        return cache.get_or_set(
+            f"table_count:{key}", self.queryset.count, self.count_timeout
+        )
+
+    def _bookmark_key(self, number):
+        return f"table_bookmark:{self._ordered_key}:{self.per_page}:{number}"
+
+    def _find_bookmark(self, number):
+        """The closest bookmark before page ``number``, and how many pages lie
+        between it and that page."""
+        pages = range(max(1, number - self.bookmark_window), number)
+        bookmarks = cache.get_many([self._bookmark_key(page) for page in pages])
+        for page in reversed(pages):
+            bookmark = bookmarks.get(self._bookmark_key(page))
+            if bookmark is not None:
+                return bookmark, number - page - 1
+        return None, number - 1
+
+    def page(self, number):
+        if self.ordering is None:
+            return super().page(number)
+        number = self.validate_number(number)
+        self._ordered_key = self._query_key(self.queryset)
+
+        queryset = self.queryset.order_by(
+            *(
+                F(path).desc(nulls_last=True)
+                if descending
+                else F(path).asc(nulls_last=True)
+                for path, descending in self.ordering
+            )
+        )
+        bookmark, pages_to_skip = self._find_bookmark(number)
+        if bookmark is not None:
+            queryset = queryset.filter(_seek(self.ordering, bookmark))
+        offset = pages_to_skip * self.per_page
+        limit = self.per_page
+        if number == self.num_pages:
+            limit += self.orphans
+        records = list(queryset[offset : offset + limit])
+
+        if records:
+            cache.set(
+                self._bookmark_key(number),
+                [_resolve(records[-1], path) for path, _ in self.ordering],
+                self.bookmark_timeout,
+            )
+        rows = BoundRows(records, self.rows.table, self.rows.pinned_data)
+        return self._get_page(rows, number, self)
+
+
+class KeysetPaginationMixin:
+    """Page a django-tables2 view with ``KeysetPaginator`` if its
+    ``keyset_table`` is listed in ``settings.KEYSET_PAGINATED_TABLES``, and with
+    ``CustomPaginator`` otherwise."""
+
+    keyset_table = None
+
+    @property
+    def paginator_class(self):
+        if self.keyset_table in getattr(settings, "KEYSET_PAGINATED_TABLES", ()):
+            return KeysetPaginator
+        return CustomPaginator
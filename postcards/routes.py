@@ -0,0 +1,242 @@
+"""Build the postal routes drawn on the map.
+
+A route follows a postal object from its sender, through the censor and each
+postmark in date order, to its addressee. Rather than serializing every Object
+through the API, the map asks for a single GeoJSON FeatureCollection that we
+build here from two flat queries and keep in the cache until the data changes.
+
+The API still exposes a route per Object; ``calculate_routes`` computes those for a
+whole page of objects at once so listing them costs a fixed number of queries.
+"""
+
+from django.core.cache import cache
+from django.db.models import F, Prefetch, prefetch_related_objects
+
+from postcards.caching import versioned_key
+from postcards.models import Object, Postmark
+
+ROUTES_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _coordinates(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return [float(longitude), float(latitude)]
+
+
+def _full_name(*parts):
+    return " ".join(filter(None, parts)) or "Unknown"
+
+
+def get_postmark_coordinates():
+    """Map each Object id to the coordinates of its postmarks, ordered by date."""
+    through = Object.postmark.through
+    postmark_rows = (
+        through.objects.filter(
+            postmark__location__latitude__isnull=False,
+            postmark__location__longitude__isnull=False,
+        )
+        .order_by("object_id", F("postmark__date").asc(nulls_last=True), "pk")
+        .values_list(
+            "object_id",
+            "postmark__location__latitude",
+            "postmark__location__longitude",
+        )
+    )
+    postmarks = {}
+    for object_id, latitude, longitude in postmark_rows:
+        postmarks.setdefault(object_id, []).append(_coordinates(latitude, longitude))
+    return postmarks
+
+
+def build_route_features():
+    """Build a GeoJSON FeatureCollection with a LineString for every postal object
+    that has a locatable sender and addressee."""
+    rows = Object.objects.order_by("id").values(
+        "id",
+        "item_id",
+        "letter_type",
+        "date_of_correspondence",
+        "sender_name__first_name",
+        "sender_name__last_name",
+        "sender_name__latitude",
+        "sender_name__longitude",
+        "sender_name__location__latitude",
+        "sender_name__location__longitude",
+        "addressee_name__first_name",
+        "addressee_name__last_name",
+        "addressee_name__latitude",
+        "addressee_name__longitude",
+        "addressee_name__location__latitude",
+        "addressee_name__location__longitude",
+        "regime_location__censor_location__latitude",
+        "regime_location__censor_location__longitude",
+    )
+    postmarks = get_postmark_coordinates()
+
+    features = []
+    for row in rows:
+        # People carry their own (street level) coordinates; fall back to the
+        # coordinates of their town when those are missing.
+        sender = _coordinates(
+            row["sender_name__latitude"], row["sender_name__longitude"]
+        ) or _coordinates(
+            row["sender_name__location__latitude"],
+            row["sender_name__location__longitude"],
+        )
+        addressee = _coordinates(
+            row["addressee_name__latitude"], row["addressee_name__longitude"]
+        ) or _coordinates(
+            row["addressee_name__location__latitude"],
+            row["addressee_name__location__longitude"],
+        )
+        if sender is None or addressee is None:
+            continue
+
+        stops = [sender]
+        censor = _coordinates(
+            row["regime_location__censor_location__latitude"],
+            row["regime_location__censor_location__longitude"],
+        )
+        if censor:
+            stops.append(censor)
+        stops.extend(postmarks.get(row["id"], []))
+        stops.append(addressee)
+
+        # Drop consecutive duplicate points, e.g. a postmark in the sender's town.
+        coordinates = [
+            stop for i, stop in enumerate(stops) if i == 0 or stop != stops[i - 1]
+        ]
+        if len(coordinates) < 2:
+            continue
+
+        sender_name = _full_name(
+            row["sender_name__first_name"], row["sender_name__last_name"]
+        )
+        addressee_name = _full_name(
+            row["addressee_name__first_name"], row["addressee_name__last_name"]
+        )
+        date_of_correspondence = row["date_of_correspondence"]
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+                "properties": {
+                    "id": row["id"],
+                    "item_id": row["item_id"],
+                    "letter_type": row["letter_type"],
+                    "date_of_correspondence": date_of_correspondence.isoformat()
+                    if date_of_correspondence
+                    else None,
+                    "name": f"{sender_name} to {addressee_name}",
+                },
+            }
+        )
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def get_route_features():
+    """Return the cached route FeatureCollection, building it if necessary."""
+    cache_key = versioned_key("routes", "features")
+    features = cache.get(cache_key)
+    if features is None:
+        features = build_route_features()
+        cache.set(cache_key, features, ROUTES_CACHE_TIMEOUT)
+    return features
+
+
+def _postmark_sort_key(postmark):
+    # Match ``order_by("date")`` on PostgreSQL, which sorts undated postmarks last.
+    return (postmark.date is None, postmark.date, postmark.pk)
+
+
+def build_route(postal_object):
+    """Calculate the route of a single postal object from its related rows."""
+    route = []
+    sender = postal_object.sender_name
+    if sender and sender.location:
+        route.append(
+            {
+                "type": "person",
+                "type_description": "sender",
+                "latitude": sender.location.latitude,
+                "longitude": sender.location.longitude,
+            }
+        )
+
+    censor = postal_object.regime_location
+    if censor and censor.censor_location:
+        route.append(
+            {
+                "type": "censor",
+                "latitude": censor.censor_location.latitude,
+                "longitude": censor.censor_location.longitude,
+            }
+        )
+
+    for postmark in sorted(postal_object.postmark.all(), key=_postmark_sort_key):
+        if postmark.location:
+            route.append(
+                {
+                    "type": "postmark",
+                    "latitude": postmark.location.latitude,
+                    "longitude": postmark.location.longitude,
+                }
+            )
+
+    addressee = postal_object.addressee_name
+    if addressee and addressee.location:
+        route.append(
+            {
+                "type": "person",
+                "type_description": "addressee",
+                "latitude": addressee.location.latitude,
+                "longitude": addressee.location.longitude,
+            }
+        )
+
+    return route
+
+
+def calculate_routes(postal_objects):
+    """Calculate the routes for a batch of postal objects.
+
+    Routes are read from the cache in a single round trip. Anything missing is
+    built after loading the locations, censors and postmarks for all of the
+    remaining objects at once, then written back in a single round trip. Relations
+    that were already loaded with ``select_related`` or ``prefetch_related`` are
+    reused rather than queried again.
+
+    Returns a dictionary mapping each object's primary key to its route.
+    """
+    postal_objects = list(postal_objects)
+    key_prefix = versioned_key("routes", "object")
+    cache_keys = {obj.pk: f"{key_prefix}:{obj.pk}" for obj in postal_objects}
+    cached_routes = cache.get_many(list(cache_keys.values()))
+
+    routes = {}
+    missing = []
+    for obj in postal_objects:
+        route = cached_routes.get(cache_keys[obj.pk])
+        if route is None:
+            missing.append(obj)
+        else:
+            routes[obj.pk] = route
+
+    if missing:
+        prefetch_related_objects(
+            missing,
+            "sender_name__location",
+            "addressee_name__location",
+            "regime_location__censor_location",
+            Prefetch("postmark", queryset=Postmark.objects.select_related("location")),
+        )
+        new_routes = {obj.pk: build_route(obj) for obj in missing}
+        cache.set_many(
+            {cache_keys[pk]: route for pk, route in new_routes.items()},
+            ROUTES_CACHE_TIMEOUT,
+        )
+        routes.update(new_routes)
+
+    return routes
@@ -0,0 +1,143 @@
+"""Full-text keyword search over postal objects.
+
+Each object keeps a ``search_vector`` combining the text a researcher might search
+for, weighted so that names rank above places, and places above transcriptions
+and notes. The column has a GIN index, so a keyword search is a single index
+lookup rather than a scan over every joined table.
+
+The vectors are filled in by the migration that adds the column, and rebuilt
+whenever an object or a row whose text it includes changes (see
+``postcards.signals``). ``manage.py update_search_vectors`` rebuilds them all.
+"""
+
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, Q, TextField, Value
+
+from postcards.models import Censor, Collection, Location, Object, Person, Postmark
+
+# The "simple" configuration doesn't stem words, which suits a collection that
+# mixes Dutch, German and English and is mostly searched for names and places.
+SEARCH_CONFIG = "simple"
+
+BATCH_SIZE = 500
+
+# The postal objects whose search text includes a given row of each model.
+RELATED_OBJECTS = {
+    Person: lambda pk: Q(sender_name=pk) | Q(addressee_name=pk),
+    Location: lambda pk: (
+        Q(sender_name__location=pk)
+        | Q(addressee_name__location=pk)
+        | Q(postmark__location=pk)
+        | Q(regime_location__censor_location=pk)
+    ),
+    Postmark: lambda pk: Q(postmark=pk),
+    Censor: lambda pk: Q(regime_location=pk),
+    Collection: lambda pk: Q(collection=pk),
+}
+
+
+def _person_text(person):
+    if person is None:
+        return []
+    return [person.title, person.first_name, person.last_name, person.entity_name]
+
+
+def _location_text(location):
+    if location is None:
+        return []
+    return [location.town_city, location.province_state, location.country]
+
+
+def get_search_text(obj):
+    """The text to index for an object, grouped by weight."""
+    people = [obj.sender_name, obj.addressee_name]
+    censor = obj.regime_location
+    return {
+        "A": [obj.item_id, *(text for p in people for text in _person_text(p))],
+        "B": [
+            obj.collection.name if obj.collection else None,
+            obj.date_of_correspondence,
+            *(
+                text
+                for p in people
+                if p is not None
+                for text in _location_text(p.location)
+            ),
+            *(
+                text
+                for postmark in obj.postmark.all()
+                for text in _location_text(postmark.location)
+            ),
+            censor.censor_name if censor else None,
+        ],
+        "C": [
+            obj.public_notes,
+            *(t.transcription for t in obj.transcriptions.all()),
+        ],
+    }
+
+
+def build_search_vector(obj):
+    vector = None
+    for weight, parts in get_search_text(obj).items():
+        text = " ".join(str(part) for part in parts if part)
+        part = SearchVector(
+            Value(text, output_field=TextField()), config=SEARCH_CONFIG, weight=weight
+        )
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def update_search_vectors(queryset=None, batch_size=BATCH_SIZE):
+    """Rebuild the search vectors of the objects in ``queryset`` (default: all),
+    writing ``batch_size`` of them in each UPDATE.
+
+    Only fields and relations are read, so the migration that adds
+    ``search_vector`` can pass a queryset of its historical model.
+    """
+    if queryset is None:
+        queryset = Object.objects.all()
+    queryset = queryset.select_related(
+        "collection",
+        "sender_name__location",
+        "addressee_name__location",
+        "regime_location",
+    ).prefetch_related("postmark__location", "transcriptions")
+    count = 0
+    batch = []
+    for obj in queryset.order_by().distinct().iterator(chunk_size=batch_size):
+        obj.search_vector = build_search_vector(obj)
+        batch.append(obj)
+        if len(batch) == batch_size:
+            count += queryset.model.objects.bulk_update(batch, ["search_vector"])
+            batch = []
+    if batch:
+        count += queryset.model.objects.bulk_update(batch, ["search_vector"])
+    return count
+
+
+def update_related_search_vectors(instance):
+    """Rebuild the vectors of the objects that include ``instance``'s text."""
+    related = RELATED_OBJECTS.get(type(instance))
+    if related:
+        update_search_vectors(Object.objects.filter(related(instance.pk)))
+
+
+def search_objects(queryset, value):
+    """Filter ``queryset`` to objects matching any of the words in ``value``,
+    best matches first. Words also match as prefixes, so "Arn" finds Arnhem."""
+    words = re.findall(r"\w+", value.lower())
+    if not words:
+        return queryset
+    query = SearchQuery(
+        " | ".join(f"{word}:*" for word in words),
+        search_type="raw",
+        config=SEARCH_CONFIG,
+    )
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(search_rank=SearchRank(F("search_vector"), query))
+        .order_by("-search_rank", "pk")
+    )
@@ -1,7 +1,110 @@
+from django.core.exceptions import FieldDoesNotExist
 from django.db.models import Prefetch, Q
 from rest_framework import routers, serializers, viewsets
 
+from postcards.conditional import ConditionalGetMixin
 from postcards.models import Censor, Image, Location, Object, Person, Postmark
+from postcards.routes import calculate_routes
+
+
+def get_requested_fields(request):
+    """Return the set of field names asked for with ``?fields=a,b``, if any."""
+    if request is None or request.method != "GET":
+        return None
+    fields = request.query_params.get("fields")
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(",") if field.strip()}
+
+
+def flatten_select_related(tree, prefix=""):
+    """Turn the nested dict Django keeps for ``select_related`` back into paths."""
+    paths = []
+    for name, subtree in tree.items():
+        path = f"{prefix}{name}"
+        paths.extend(flatten_select_related(subtree, f"{path}__") or [path])
+    return paths
+
+
+class SparseFieldsetMixin:
+    """Let API clients trim a serializer's output with ``?fields=a,b``.
+
+    ``restrict_queryset`` applies the same selection to the SQL so that columns and
+    relations the client didn't ask for aren't fetched either. Fields that don't
+    map onto a model field (e.g. a SerializerMethodField) should list the model
+    fields they read in ``sparse_field_sources``; if we can't tell what a field
+    needs, the queryset is left as it is.
+    """
+
+    sparse_field_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get("request"))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def restrict_queryset(cls, queryset, requested):
+        model = queryset.model
+        columns = {model._meta.pk.name}
+        relations = set()
+
+        for name, field in cls().fields.items():
+            if name not in requested:
+                continue
+            if isinstance(field, serializers.HyperlinkedIdentityField):
+                continue  # only needs the primary key
+            if name in cls.sparse_field_sources:
+                sources = cls.sparse_field_sources[name]
+            elif field.source == "*":
+                return queryset
+            else:
+                sources = [field.source.split(".")[0]]
+
+            for source in sources:
+                try:
+                    model_field = model._meta.get_field(source)
+                except FieldDoesNotExist:
+                    return queryset  # a property or method; we can't tell what it reads
+                if model_field.is_relation:
+                    relations.add(source)
+                if model_field.concrete and not model_field.many_to_many:
+                    columns.add(source)
+
+        queryset = queryset.only(*columns)
+
+        # Drop joins and prefetches for relations that are no longer needed, since
+        # Django won't follow a deferred foreign key with select_related.
+        if isinstance(queryset.query.select_related, dict):
+            paths = [
+                path
+                for path in flatten_select_related(queryset.query.select_related)
+                if path.split("__")[0] in relations
+            ]
+            queryset = queryset.select_related(None)
+            if paths:
+                queryset = queryset.select_related(*paths)
+        lookups = [
+            lookup
+            for lookup in queryset._prefetch_related_lookups
+            if getattr(lookup, "prefetch_through", lookup).split("__")[0] in relations
+        ]
+        return queryset.prefetch_related(None).prefetch_related(*lookups)
+
+
+class SparseFieldsetViewSetMixin:
+    """Restrict the queryset to the fields requested with ``?fields=a,b``."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        requested = get_requested_fields(self.request)
+        if requested:
+            queryset = self.get_serializer_class().restrict_queryset(
+                queryset, requested
+            )
+        return queryset
 
 
 class AssociatedObjectsSerializer(serializers.ModelSerializer):
@@ -18,7 +121,7 @@ class AssociatedObjectsSerializer(serializers.ModelSerializer):
         ]
 
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Location
         fields = [
@@ -37,18 +140,23 @@ class LocationSerializer(serializers.ModelSerializer):
         }
 
 
-class LocationViewSet(viewsets.ModelViewSet):
+class LocationViewSet(
+    ConditionalGetMixin, SparseFieldsetViewSetMixin, viewsets.ModelViewSet
+):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
 
 
 class ImageSerializer(serializers.ModelSerializer):
+    thumbnail = serializers.ReadOnlyField()
+    medium = serializers.ReadOnlyField()
+
     class Meta:
         model = Image
-        fields = ["image", "image_caption"]
+        fields = ["image", "image_caption", "thumbnail", "medium"]
 
 
-class PostmarksSerializer(serializers.HyperlinkedModelSerializer):
+class PostmarksSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     latitude = serializers.ReadOnlyField(source="location.latitude")
     longitude = serializers.ReadOnlyField(source="location.longitude")
 
@@ -61,9 +169,12 @@ class PostmarksSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class PostmarkViewSet(viewsets.ModelViewSet):
-    queryset = Postmark.objects.all()
+class PostmarkViewSet(
+    ConditionalGetMixin, SparseFieldsetViewSetMixin, viewsets.ModelViewSet
+):
+    queryset = Postmark.objects.select_related("location")
     serializer_class = PostmarksSerializer
+    last_modified_fields = ("updated_at", "location__updated_at")
 
 
 class CensorSerializer(LocationSerializer, serializers.HyperlinkedModelSerializer):
@@ -82,12 +193,15 @@ class CensorSerializer(LocationSerializer, serializers.HyperlinkedModelSerialize
         return self.get_location(obj)
 
 
-class CensorViewSet(viewsets.ModelViewSet):
-    queryset = Censor.objects.all()
+class CensorViewSet(
+    ConditionalGetMixin, SparseFieldsetViewSetMixin, viewsets.ModelViewSet
+):
+    queryset = Censor.objects.select_related("censor_location")
     serializer_class = CensorSerializer
+    last_modified_fields = ("last_modified", "censor_location__updated_at")
 
 
-class PersonsSerializer(serializers.HyperlinkedModelSerializer):
+class PersonsSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name="person-detail")
     location = LocationSerializer(read_only=True)
     # postal_objects = serializers.SerializerMethodField()
@@ -149,12 +263,28 @@ class PersonsSerializer(serializers.HyperlinkedModelSerializer):
     #     return routes
 
 
-class PersonViewSet(viewsets.ModelViewSet):
-    queryset = Person.objects.all()
+class PersonViewSet(
+    ConditionalGetMixin, SparseFieldsetViewSetMixin, viewsets.ModelViewSet
+):
+    queryset = Person.objects.select_related("location")
     serializer_class = PersonsSerializer
+    last_modified_fields = ("updated_at", "location__updated_at")
+
+
+class PostalObjectListSerializer(serializers.ListSerializer):
+    """Calculate the routes for every object in a list up front so that each
+    object's route doesn't cost its own set of queries."""
 
+    def to_representation(self, data):
+        postal_objects = list(data.all() if hasattr(data, "all") else data)
+        if "route" in self.child.fields:
+            self.context["routes"] = calculate_routes(postal_objects)
+        return super().to_representation(postal_objects)
 
-class PostalObjectSerializer(serializers.HyperlinkedModelSerializer):
+
+class PostalObjectSerializer(
+    SparseFieldsetMixin, serializers.HyperlinkedModelSerializer
+):
     sender_name = PersonsSerializer()
     addressee_name = PersonsSerializer()
     postmark = PostmarksSerializer(many=True)
@@ -167,6 +297,10 @@ class PostalObjectSerializer(serializers.HyperlinkedModelSerializer):
     longitude = serializers.ReadOnlyField(source="sender_name.location.longitude")
     route = serializers.SerializerMethodField()
 
+    sparse_field_sources = {
+        "route": ("sender_name", "addressee_name", "regime_location", "postmark"),
+    }
+
     class Meta:
         model = Object
         fields = (
@@ -182,24 +316,53 @@ class PostalObjectSerializer(serializers.HyperlinkedModelSerializer):
             "longitude",
             "route",
         )
+        list_serializer_class = PostalObjectListSerializer
 
     def get_regime_location(self, obj):
         return self.get_location(obj)
 
     def get_route(self, obj):
+        routes = self.context.get("routes")
+        if routes is not None and obj.pk in routes:
+            return routes[obj.pk]
         return obj.calculate_route()
 
 
-class PostalObjectViewSet(viewsets.ModelViewSet):
-    queryset = Object.objects.all()
+class PostalObjectViewSet(
+    ConditionalGetMixin, SparseFieldsetViewSetMixin, viewsets.ModelViewSet
+):
+    # The search vector is only for filtering, and the largest column.
+    queryset = (
+        Object.objects.defer("search_vector")
+        .select_related(
+            "sender_name__location",
+            "addressee_name__location",
+            "regime_location__censor_location",
+        )
+        .prefetch_related(
+            Prefetch(
+                "postmark",
+                queryset=Postmark.objects.select_related("location").order_by("date"),
+            ),
+            "images",
+        )
+    )
     serializer_class = PostalObjectSerializer
-
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        queryset = queryset.select_related(
-            "sender_name", "addressee_name"
-        ).prefetch_related("images")
-        return queryset
+    last_modified_fields = (
+        "updated_at",
+        "sender_name__updated_at",
+        "sender_name__location__updated_at",
+        "addressee_name__updated_at",
+        "addressee_name__location__updated_at",
+        "regime_location__last_modified",
+        "regime_location__censor_location__updated_at",
+        "postmark__updated_at",
+        "postmark__location__updated_at",
+        "images__updated_at",
+    )
+    count_fields = ("pk", "postmark", "images")
+    # Bumped by changes to objects and every related row above.
+    list_cache_namespaces = ("routes", "tables")
 
 
 router = routers.DefaultRouter()
@@ -0,0 +1,137 @@
+"""Signal handlers that keep cached data in step with the database."""
+
+import logging
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from taggit.models import TaggedItem
+
+from postcards.caching import bump_cache_version
+from postcards.clustering import update_cluster_index
+from postcards.derivatives import try_build_derivatives
+from postcards.details import invalidate_object_pages
+from postcards.models import (
+    Censor,
+    Collection,
+    Image,
+    Location,
+    Object,
+    Person,
+    Postmark,
+    PrimarySource,
+    Transcription,
+)
+from postcards.search import update_related_search_vectors, update_search_vectors
+from postcards.tiles import clear_tile_cache
+
+logger = logging.getLogger(__name__)
+
+# The cache namespaces that need to be invalidated when a given model changes.
+CACHE_DEPENDENCIES = {
+    Object: ("routes", "writers", "facet_counts", "tables"),
+    Person: ("routes", "writers", "tables", "object_pages"),
+    Location: ("routes", "facets", "tables", "object_pages"),
+    Postmark: ("routes", "facets", "tables", "object_pages"),
+    Censor: ("routes", "object_pages"),
+    PrimarySource: ("tables",),
+    Collection: ("tables", "object_pages"),
+    Image: ("tables",),
+    TaggedItem: ("facet_counts", "tables"),
+}
+
+# The vector tile layers drawn from each model.
+TILE_DEPENDENCIES = {
+    Person: ("people",),
+    Postmark: ("postmarks",),
+    Censor: ("censors",),
+    Location: ("people", "postmarks", "censors"),
+}
+
+# The field holding the postal object whose rendered page shows a given row.
+OBJECT_PAGE_DEPENDENCIES = {
+    Object: "pk",
+    Image: "postcard_id",
+    Transcription: "postal_object_id",
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_dependent_caches(sender, instance, **kwargs):
+    namespaces = CACHE_DEPENDENCIES.get(sender)
+    if namespaces:
+        bump_cache_version(*namespaces)
+    layers = TILE_DEPENDENCIES.get(sender)
+    if layers:
+        clear_tile_cache(*layers)
+    object_field = OBJECT_PAGE_DEPENDENCIES.get(sender)
+    if object_field:
+        invalidate_object_pages(getattr(instance, object_field))
+
+
+@receiver(m2m_changed, sender=Object.postmark.through)
+def invalidate_postmark_caches(sender, action, **kwargs):
+    if action.startswith("post_"):
+        bump_cache_version(*CACHE_DEPENDENCIES[Postmark])
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def update_person_clusters(sender, instance, **kwargs):
+    update_cluster_index(person_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Location)
+def update_location_clusters(sender, instance, **kwargs):
+    update_cluster_index(location_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Object)
+def update_object_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_vectors(Object.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Postmark)
+@receiver(post_save, sender=Censor)
+@receiver(post_save, sender=Collection)
+def update_related_search_vector(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_related_search_vectors(instance)
+
+
+@receiver(post_save, sender=Transcription)
+@receiver(post_delete, sender=Transcription)
+def update_transcription_search_vector(sender, instance, raw=False, **kwargs):
+    if instance.postal_object_id and not raw:
+        update_search_vectors(Object.objects.filter(pk=instance.postal_object_id))
+
+
+@receiver(m2m_changed, sender=Object.postmark.through)
+def update_postmark_search_vectors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith("post_"):
+        object_ids = pk_set if reverse else [instance.pk]
+        if object_ids:
+            update_search_vectors(Object.objects.filter(pk__in=object_ids))
+
+
+@receiver(post_save, sender=Image)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or instance.has_derivatives:
+        return
+    derivatives, error = try_build_derivatives(instance.image.name)
+    if error:
+        logger.warning("Couldn't make derivatives of %s: %s", instance.image, error)
+        return
+    instance.derivatives = derivatives
+    instance.updated_at = timezone.now()
+    Image.objects.filter(pk=instance.pk).update(
+        derivatives=derivatives, updated_at=instance.updated_at
+    )
+    # update() doesn't send post_save, and the caches were already invalidated
+    # before the derivatives existed.
+    bump_cache_version(*CACHE_DEPENDENCIES[Image])
+    invalidate_object_pages(instance.postcard_id)
@@ -0,0 +1,123 @@
+"""Streaming rows out of the project spreadsheets for the import commands.
+
+Workbooks are opened with openpyxl in read-only mode, and CSV files with the csv
+module, so rows are parsed as they're read rather than a whole workbook being
+loaded up front. They're handed out in chunks of ``chunk_size`` rows, which keeps
+memory bounded and lets an import start on the first chunk straight away.
+
+Headers are normalized (stripped and lowercased, and for the commands that use
+them, spaces replaced with underscores), and so are cells: text is stripped and
+blank cells are None. Dates and numbers keep the types openpyxl reads them as.
+"""
+
+import csv
+from pathlib import Path
+from typing import NamedTuple
+
+import pandas as pd
+from openpyxl import load_workbook
+
+CHUNK_SIZE = 1000
+
+# Cells holding nothing but whitespace, including non-breaking spaces.
+BLANK = {"", "\xa0"}
+
+
+class Chunk(NamedTuple):
+    """Consecutive rows of one sheet, as tuples ordered like ``columns``."""
+
+    sheet_name: str
+    columns: list
+    rows: list
+    # The spreadsheet row number of the first row, counting the header as 1.
+    first_row: int
+
+    def records(self):
+        """The rows as ``(row number, {column: value})`` pairs."""
+        for number, row in enumerate(self.rows, start=self.first_row):
+            yield number, dict(zip(self.columns, row))
+
+    def frame(self):
+        return pd.DataFrame(self.rows, columns=self.columns, dtype=object)
+
+
+def normalize_header(name, underscores=False):
+    name = str(name).strip().lower()
+    return name.replace(" ", "_") if underscores else name
+
+
+def normalize_cell(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value in BLANK:
+            return None
+    return value
+
+
+def _columns(header, underscores):
+    """Normalized column names, numbered like pandas when they're missing or
+    repeated (``unnamed: 3``, ``notes.1``)."""
+    columns = []
+    seen = {}
+    for i, name in enumerate(header):
+        if name is None or str(name).strip() == "":
+            name = f"unnamed: {i}"
+        name = normalize_header(name, underscores)
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        columns.append(f"{name}.{count}" if count else name)
+    return columns
+
+
+def _chunks(sheet_name, rows, chunk_size, underscores):
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = _columns(header, underscores)
+    width = len(columns)
+    chunk = []
+    first_row = 2
+    for number, row in enumerate(rows, start=2):
+        row = tuple(normalize_cell(value) for value in row[:width])
+        if not any(value is not None for value in row):
+            continue
+        if not chunk:
+            first_row = number
+        # Rows may be shorter than the header when trailing cells are empty.
+        chunk.append(row + (None,) * (width - len(row)))
+        if len(chunk) >= chunk_size:
+            yield Chunk(sheet_name, columns, chunk, first_row)
+            chunk = []
+    if chunk:
+        yield Chunk(sheet_name, columns, chunk, first_row)
+
+
+def read_chunks(path, sheet_name=None, chunk_size=CHUNK_SIZE, underscores=False):
+    """Yield the rows of a workbook's sheet (every sheet if ``sheet_name`` is
+    None), or of a CSV file, as ``Chunk``s of up to ``chunk_size`` rows.
+
+    Rows with no values are skipped.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with path.open(newline="", encoding="utf-8-sig") as f:
+            yield from _chunks(path.stem, csv.reader(f), chunk_size, underscores)
+        return
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet_names = [sheet_name] if sheet_name else workbook.sheetnames
+        for name in sheet_names:
+            rows = workbook[name].iter_rows(values_only=True)
+            yield from _chunks(name, rows, chunk_size, underscores)
+    finally:
+        workbook.close()
+
+
+def read_records(path, sheet_name=None, chunk_size=CHUNK_SIZE, underscores=False):
+    """Yield ``(sheet name, row number, {column: value})`` for each row, reading
+    the file a chunk at a time."""
+    for chunk in read_chunks(path, sheet_name, chunk_size, underscores):
+        for number, record in chunk.records():
+            yield chunk.sheet_name, number, record
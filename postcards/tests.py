@@ -1,7 +1,50 @@
+import csv
+import io
+import json
+import tempfile
+import time
+from datetime import date, datetime
+from io import StringIO
+from pathlib import Path
+
+import pandas as pd
+from django.conf import settings
 from django.contrib.gis.geos import Point
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from openpyxl import Workbook
+from PIL import Image as PILImage
 
-from postcards.models import Object, Postmark
+from postcards.caching import get_cache_version
+from postcards.clustering import ClusterIndex, get_cluster_index
+from postcards.correspondence import get_correspondence
+from postcards.facets import get_facet_counts
+from postcards.filters import ObjectFilter, combine_all_names, parse_date_range
+from postcards.geocoding import GazetteerBackend, backfill, resolve, run_worker
+from postcards.importing import ObjectImporter
+from postcards.ingestion import ImageIngester, object_image_target
+from postcards.models import (
+    Collection,
+    Geocode,
+    Image,
+    Location,
+    Object,
+    Person,
+    Postmark,
+    Transcription,
+)
+from postcards.pagination import KeysetPaginator, get_keyset_ordering
+from postcards.routes import calculate_routes, get_route_features
+from postcards.search import search_objects
+from postcards.serializers import ImageSerializer
+from postcards.spreadsheets import read_chunks, read_records
+from postcards.tables import ItemHtmxTable
+from postcards.tiles import project
 
 
 class ObjectModelTest(TestCase):
@@ -25,3 +68,1186 @@ class PostmarkModelTest(TestCase):
         self.assertEqual(self.postmark.object.name, "Test Object")
         self.assertEqual(self.postmark.location.x, 5)
         self.assertEqual(self.postmark.location.y, 5)
+
+
+class RouteFeaturesTest(TestCase):
+    def setUp(self):
+        self.arnhem = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=51.98, longitude=5.91
+        )
+        self.berlin = Location.objects.create(
+            town_city="Berlin", country="Germany", latitude=52.52, longitude=13.40
+        )
+        sender = Person.objects.create(
+            first_name="Anna", last_name="Jansen", location=self.arnhem
+        )
+        addressee = Person.objects.create(
+            first_name="Karl",
+            last_name="Weber",
+            location=self.berlin,
+            latitude=52.5,
+            longitude=13.4,
+        )
+        self.object = Object.objects.create(
+            sender_name=sender,
+            addressee_name=addressee,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def test_route_runs_through_postmarks(self):
+        postmark = Postmark.objects.create(location=self.berlin)
+        self.object.postmark.add(postmark)
+
+        features = get_route_features()["features"]
+
+        self.assertEqual(len(features), 1)
+        self.assertEqual(
+            features[0]["geometry"]["coordinates"],
+            [[5.91, 51.98], [13.4, 52.52], [13.4, 52.5]],
+        )
+        self.assertEqual(features[0]["properties"]["name"], "Anna Jansen to Karl Weber")
+
+    def test_routes_are_rebuilt_when_objects_change(self):
+        self.assertEqual(len(get_route_features()["features"]), 1)
+        self.object.addressee_name = None
+        self.object.save()
+        self.assertEqual(get_route_features()["features"], [])
+
+
+class PostalObjectRoutesTest(TestCase):
+    def create_object(self, location):
+        person = Person.objects.create(
+            first_name="Anna", location=location, latitude=52.0, longitude=5.9
+        )
+        postal_object = Object.objects.create(
+            sender_name=person,
+            addressee_name=person,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        postal_object.postmark.add(
+            Postmark.objects.create(location=location),
+            Postmark.objects.create(location=location),
+        )
+        return postal_object
+
+    def count_list_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/objects/")
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_listing_objects_costs_a_fixed_number_of_queries(self):
+        location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52.0, longitude=5.9
+        )
+        self.create_object(location)
+        queries_for_one = self.count_list_queries()
+
+        for _ in range(4):
+            self.create_object(location)
+        self.assertEqual(self.count_list_queries(), queries_for_one)
+
+    def test_route_matches_calculate_route(self):
+        location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52.0, longitude=5.9
+        )
+        postal_object = self.create_object(location)
+        routes = calculate_routes([postal_object])
+        cache.clear()
+        self.assertEqual(routes[postal_object.pk], postal_object.calculate_route())
+        self.assertEqual(
+            [stop["type"] for stop in routes[postal_object.pk]],
+            ["person", "postmark", "postmark", "person"],
+        )
+
+
+class SparseFieldsetTest(TestCase):
+    def setUp(self):
+        for town_city in ["Arnhem", "Berlin", "Zurich"]:
+            Location.objects.create(town_city=town_city, latitude=1, longitude=1)
+
+    def test_pages_follow_cursor(self):
+        response = self.client.get("/api/locations/", {"page_size": 2})
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        response = self.client.get(response.json()["next"])
+        self.assertEqual(len(response.json()["results"]), 1)
+        self.assertIsNone(response.json()["next"])
+
+    def test_fields_trim_output_and_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/locations/", {"fields": "town_city"})
+
+        self.assertEqual(response.json()["results"][0], {"town_city": "Arnhem"})
+        self.assertNotIn("country", context.captured_queries[0]["sql"])
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(
+            town_city="Arnhem", latitude=52.0, longitude=5.9
+        )
+
+    def test_unchanged_list_returns_not_modified(self):
+        response = self.client.get("/api/locations/")
+        etag = response.headers["ETag"]
+
+        response = self.client.get("/api/locations/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.location.town_city = "Arnhem (Gelderland)"
+        self.location.save()
+        response = self.client.get("/api/locations/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_object_changes_with_nested_rows(self):
+        sender = Person.objects.create(last_name="Jansen", location=self.location)
+        item = Object.objects.create(
+            sender_name=sender,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        url = f"/api/objects/{item.pk}/"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.location.town_city = "Arnhem (Gelderland)"
+        self.location.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response.headers["ETag"]
+        Image.objects.create(postcard=item)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_object_list_changes_with_nested_rows(self):
+        sender = Person.objects.create(last_name="Jansen", location=self.location)
+        Object.objects.create(
+            sender_name=sender,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        with CaptureQueriesContext(connection) as context:
+            etag = self.client.get("/api/objects/").headers["ETag"]
+        self.assertNotIn("postmark", context.captured_queries[0]["sql"])
+        for query in context.captured_queries:
+            self.assertNotIn("search_vector", query["sql"])
+        response = self.client.get("/api/objects/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.location.town_city = "Arnhem (Gelderland)"
+        self.location.save()
+        response = self.client.get("/api/objects/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_person_page_changes_with_their_objects(self):
+        person = Person.objects.create(last_name="Jansen", location=self.location)
+        item = Object.objects.create(
+            addressee_name=person,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        url = f"/person/{person.pk}/"
+        # The first page sets the CSRF cookie, which pages are validated on.
+        self.client.get(url)
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        item.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/person/0/").status_code, 404)
+
+
+@override_settings(TILE_CACHE_DIR=tempfile.mkdtemp())
+class VectorTileTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(
+            town_city="Arnhem", latitude=51.98, longitude=5.91
+        )
+        self.person = Person.objects.create(
+            last_name="Jansen", location=self.location, latitude=51.98, longitude=5.91
+        )
+        x, y = project(51.98, 5.91)
+        self.x, self.y = int(x * 2**10), int(y * 2**10)
+        self.tile = f"/tiles/people/10/{self.x}/{self.y}.pbf"
+
+    def test_tile_contains_points_in_view(self):
+        response = self.client.get(self.tile)
+        self.assertEqual(
+            response.headers["Content-Type"], "application/vnd.mapbox-vector-tile"
+        )
+        self.assertIn(b"person_id", response.content)
+
+        response = self.client.get("/tiles/people/10/0/0.pbf")
+        self.assertNotIn(b"person_id", response.content)
+
+    def test_tiles_are_cleared_when_people_change(self):
+        self.client.get(self.tile)
+        self.person.delete()
+        response = self.client.get(self.tile)
+        self.assertNotIn(b"person_id", response.content)
+
+    def test_tiles_cached_before_a_change_are_not_read(self):
+        version = get_cache_version("tiles_people")
+        stale = self.client.get(self.tile).content
+        self.person.delete()
+        # A tile rendered before the delete is written after it.
+        path = Path(settings.TILE_CACHE_DIR, "people", str(version), "10")
+        path.joinpath(str(self.x)).mkdir(parents=True, exist_ok=True)
+        path.joinpath(str(self.x), f"{self.y}.pbf").write_bytes(stale)
+
+        response = self.client.get(self.tile)
+        self.assertNotIn(b"person_id", response.content)
+
+    def test_unknown_tiles_are_not_found(self):
+        self.assertEqual(self.client.get("/tiles/routes/0/0/0.pbf").status_code, 404)
+        self.assertEqual(self.client.get("/tiles/people/1/2/0.pbf").status_code, 404)
+
+
+class ClusterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.arnhem = Location.objects.create(
+            town_city="Arnhem", latitude=51.98, longitude=5.91
+        )
+        self.people = [
+            Person.objects.create(
+                last_name=name, location=self.arnhem, latitude=51.98, longitude=5.91
+            )
+            for name in ["Jansen", "de Vries", "Bakker"]
+        ]
+
+    def get_counts(self, zoom):
+        response = self.client.get(
+            "/api/clusters/", {"zoom": zoom, "bbox": "-180,-85,180,85"}
+        )
+        return sorted(f["properties"]["count"] for f in response.json()["features"])
+
+    def test_people_in_one_town_are_clustered(self):
+        self.assertEqual(self.get_counts(5), [3])
+        self.assertEqual(self.client.get("/api/clusters/").status_code, 400)
+
+    def test_index_is_updated_incrementally(self):
+        self.get_counts(5)
+        self.people[0].latitude, self.people[0].longitude = 52.52, 13.40
+        self.people[0].save()
+        self.people[1].delete()
+
+        self.assertEqual(self.get_counts(5), [1, 1])
+
+        def summary(index):
+            return [
+                {cell: (entry[0], entry[3]) for cell, entry in level.items()}
+                for level in index.levels
+            ]
+
+        self.assertEqual(summary(get_cluster_index()), summary(ClusterIndex.build()))
+
+    def test_stale_copies_of_the_index_are_not_read(self):
+        stale = get_cluster_index()
+        version = get_cache_version("clusters")
+        self.people[0].delete()
+        # An update or build that started before the delete stores its copy.
+        cache.set(f"clusters:{version}:index", stale)
+        self.assertEqual(self.get_counts(5), [2])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52.0, longitude=5.9
+        )
+        person = Person.objects.create(
+            first_name="Anna", last_name="Jansen", location=location
+        )
+        self.postal_object = Object.objects.create(
+            sender_name=person,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        self.postal_object.postmark.add(Postmark.objects.create(location=location))
+        self.postal_object.tags.add("red cross", "family")
+
+    def test_ndjson_export(self):
+        response = self.client.get("/export/objects.ndjson")
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["sender"], "Anna Jansen")
+        self.assertEqual(rows[0]["sender_town_city"], "Arnhem")
+        self.assertEqual(sorted(rows[0]["tags"]), ["family", "red cross"])
+        self.assertEqual(len(rows[0]["postmarks"]), 1)
+
+    async def test_export_streams_under_asgi(self):
+        response = await self.async_client.get("/export/objects.csv")
+        content = "".join([chunk.decode() async for chunk in response])
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(rows[0]["id"], str(self.postal_object.pk))
+        self.assertEqual(rows[0]["sender"], "Anna Jansen")
+
+    def test_csv_export_command(self):
+        out = StringIO()
+        call_command("export_objects", "--format", "csv", stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0]["id"], str(self.postal_object.pk))
+        self.assertEqual(rows[0]["addressee"], "")
+        self.assertIn("Postmarked at Arnhem", rows[0]["postmarks"])
+
+
+class ObjectImportTest(TestCase):
+    columns = [
+        "Item Number",
+        "Location in Collection",
+        "Sensitive",
+        "Letter enclosed (yes/no)",
+        "Return to sender",
+        "Date returned to sender",
+        "Date of correspondence",
+        "Reason for return (original language)",
+        "Reason for return (English)",
+        "Translated",
+        "Censor",
+        "Type (postcard/letter/package)",
+        "Other- RC, uberroller, POW",
+        "Notes",
+        "Sender title",
+        "Sender first name",
+        "Sender last name",
+        "Sender house number",
+        "Sender street",
+        "Sender town/city",
+        "Sender province/state",
+        "Sender country",
+        "Entitiy",
+        "Sender correspondence type",
+        "Addressee title",
+        "Addressee first name",
+        "Addressee last name",
+        "Addressee house number",
+        "Addressee street",
+        "Addressee town/city",
+        "Addressee province/state",
+        "Addressee country",
+        "Addressee entity",
+        "Addresse correspondence type",
+        "Postmark 1 date",
+        "Postmark 1 location",
+        "Postmark 2 date",
+        "Postmark 2 location",
+    ]
+
+    def setUp(self):
+        Collection.objects.create(name="Tim Gale")
+        Location.objects.create(
+            town_city="Arnhem",
+            province_state="Gelderland",
+            country="Netherlands",
+            latitude=52,
+            longitude=6,
+        )
+
+    def sheet(self, count):
+        rows = []
+        for i in range(count):
+            row = dict.fromkeys(self.columns)
+            row.update(
+                {
+                    "Item Number": f"AR-{i}",
+                    "Location in Collection": "Box 1",
+                    "Sensitive": "No",
+                    "Return to sender": "No",
+                    "Date of correspondence": "1943-01-05 00:00:00",
+                    "Reason for return (original language)": "NA",
+                    "Translated": "No",
+                    "Censor": "No",
+                    "Type (postcard/letter/package)": "Postcard",
+                    "Sender first name": "Anna",
+                    "Sender last name": "Jansen",
+                    "Sender town/city": "Arnhem",
+                    "Sender province/state": "Gelderland",
+                    "Sender country": "Netherlands",
+                    "Addressee first name": f"Jan {i}",
+                    "Addressee last name": "Bakker",
+                    "Addressee entity": "Stalag" if i == 0 else None,
+                    "Postmark 1 date": "1943-01-09 00:00:00",
+                    "Postmark 1 location": "Arnhem",
+                }
+            )
+            rows.append(row)
+        df = pd.DataFrame(rows, columns=self.columns, dtype=str)
+        df.columns = df.columns.str.lower()
+        return df
+
+    def test_import(self):
+        importer = ObjectImporter()
+        importer.import_frame(self.sheet(3))
+        counts = importer.finish()
+        self.assertEqual(counts["new objects"], 3)
+        self.assertEqual(counts["new people"], 4)
+        self.assertEqual(counts["new postmarks"], 1)
+
+        postal_object = Object.objects.get(item_id="AR-0")
+        self.assertEqual(str(postal_object.sender_name.location), "Arnhem, Netherlands")
+        self.assertEqual(postal_object.addressee_name.entity_name, "Stalag")
+        self.assertEqual(str(postal_object.date_of_correspondence), "1943-01-05")
+        self.assertIsNone(postal_object.reason_for_return_original)
+        self.assertEqual(postal_object.letter_type, "Postcard")
+        self.assertEqual(postal_object.postmark.get().location.town_city, "Arnhem")
+
+    def test_reimport_skips_unchanged_rows(self):
+        ObjectImporter().import_frame(self.sheet(3))
+        importer = ObjectImporter()
+        with CaptureQueriesContext(connection) as queries:
+            importer.import_frame(self.sheet(3))
+        self.assertEqual(importer.counts["unchanged objects"], 3)
+        self.assertEqual(sum(importer.counts.values()), 3)
+        self.assertEqual(queries.captured_queries, [])
+        self.assertEqual(Object.objects.count(), 3)
+        self.assertEqual(Person.objects.count(), 4)
+
+    def test_reimport_updates_edited_rows(self):
+        ObjectImporter().import_frame(self.sheet(3))
+        imported_at = Object.objects.get(item_id="AR-1").updated_at
+        sheet = self.sheet(3)
+        sheet.loc[1, "notes"] = "Written in pencil"
+        sheet.loc[1, "postmark 1 location"] = None
+        importer = ObjectImporter()
+        importer.import_frame(sheet)
+        self.assertEqual(importer.counts["updated objects"], 1)
+        self.assertEqual(importer.counts["unchanged objects"], 2)
+        self.assertEqual(Object.objects.count(), 3)
+
+        postal_object = Object.objects.get(item_id="AR-1")
+        self.assertEqual(postal_object.public_notes, "Written in pencil")
+        self.assertFalse(postal_object.postmark.exists())
+        self.assertGreater(postal_object.updated_at, imported_at)
+
+    def test_reimport_updates_people(self):
+        ObjectImporter().import_frame(self.sheet(3))
+        person = Person.objects.get(first_name="Jan 1")
+        sheet = self.sheet(3)
+        sheet.loc[1, "addressee street"] = "Steenstraat"
+        importer = ObjectImporter()
+        importer.import_frame(sheet)
+        self.assertEqual(importer.counts["updated people"], 1)
+        updated = Person.objects.get(pk=person.pk)
+        self.assertEqual(updated.street, "Steenstraat")
+        self.assertGreater(updated.updated_at, person.updated_at)
+
+    def test_blank_required_cells(self):
+        sheet = self.sheet(2)
+        sheet.loc[1, ["item number", "location in collection", "translated"]] = None
+        sheet.loc[1, "censor"] = None
+        importer = ObjectImporter()
+        importer.import_frame(sheet)
+        self.assertEqual(importer.counts["new objects"], 2)
+        postal_object = Object.objects.get(item_id="")
+        self.assertEqual(postal_object.collection_location, "")
+        self.assertEqual(postal_object.translated, "")
+        self.assertEqual(postal_object.regime_censor, "")
+
+        importer = ObjectImporter()
+        importer.import_frame(sheet)
+        self.assertEqual(importer.counts["unchanged objects"], 2)
+
+    def test_dry_run_reports_changes_without_writing(self):
+        ObjectImporter().import_frame(self.sheet(2))
+        sheet = self.sheet(3)
+        sheet.loc[0, "location in collection"] = "Box 2"
+        importer = ObjectImporter(dry_run=True)
+        importer.import_frame(sheet)
+        importer.finish()
+        self.assertEqual(
+            importer.changes,
+            [("AR-0", {"collection_location": ("Box 1", "Box 2")}), ("AR-2", None)],
+        )
+        self.assertEqual(importer.counts["new people"], 1)
+        self.assertEqual(Object.objects.count(), 2)
+        self.assertEqual(
+            Object.objects.get(item_id="AR-0").collection_location, "Box 1"
+        )
+
+    def test_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as few:
+            ObjectImporter().import_frame(self.sheet(2))
+        Object.objects.all().delete()
+        Person.objects.all().delete()
+        Postmark.objects.all().delete()
+        with CaptureQueriesContext(connection) as many:
+            ObjectImporter().import_frame(self.sheet(20))
+        self.assertEqual(len(few), len(many))
+
+
+class SpreadsheetTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_workbook_rows_stream_in_chunks(self):
+        path = f"{self.directory}/objects.xlsx"
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = "Database ready"
+        sheet.append([" Item Number", "Date of correspondence", "Notes", "Notes"])
+        sheet.append(["AR-1", datetime(1943, 1, 5), "  sent twice ", "\xa0"])
+        sheet.append([None, None, None, None])
+        sheet.append(["AR-2"])
+        sheet.append(["AR-3", None, "", None])
+        workbook.save(path)
+
+        chunks = list(read_chunks(path, chunk_size=2))
+        self.assertEqual([chunk.first_row for chunk in chunks], [2, 5])
+        self.assertEqual(
+            chunks[0].columns,
+            ["item number", "date of correspondence", "notes", "notes.1"],
+        )
+        self.assertEqual(
+            chunks[0].rows,
+            [
+                ("AR-1", datetime(1943, 1, 5), "sent twice", None),
+                ("AR-2", None, None, None),
+            ],
+        )
+        self.assertEqual([number for number, _ in chunks[1].records()], [5])
+
+    def test_csv_rows(self):
+        path = f"{self.directory}/tags.csv"
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows([["Item Number", "Key Words"], ["AR-1", "war"]])
+        self.assertEqual(
+            list(read_records(path, underscores=True)),
+            [("tags", 2, {"item_number": "AR-1", "key_words": "war"})],
+        )
+
+    def test_load_locations(self):
+        path = f"{self.directory}/locations.csv"
+        place = ["Arnhem", "Gelderland", "Netherlands"]
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows(
+                [
+                    ["Addressee town/city", "Addressee province/state"]
+                    + ["Addressee country", "Sender town/city"]
+                    + ["Sender province/state", "Sender country"]
+                    + ["Postmark 1 location", "Postmark 2 location"],
+                    place + place + ["Arnhem", "Arnhem"],
+                ]
+            )
+        out = StringIO()
+        call_command("load_locations", filepath=path, stdout=out)
+        self.assertIn("Successfully loaded data.", out.getvalue())
+        self.assertTrue(
+            Location.objects.filter(town_city="Arnhem", country="Netherlands").exists()
+        )
+
+
+class ImageIngestTest(TestCase):
+    def setUp(self):
+        self.upload = tempfile.mkdtemp()
+        self.media = tempfile.mkdtemp()
+        collection = Collection.objects.create(name="Tim Gale")
+        self.postal_object = Object.objects.create(
+            item_id="AR_12",
+            collection=collection,
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        for color, filename in [("red", "AR_12-Front.jpg"), ("blue", "AR_9-Front.jpg")]:
+            PILImage.new("RGB", (4, 4), color).save(f"{self.upload}/{filename}")
+        with open(f"{self.upload}/AR_12-Reverse.png", "w") as f:
+            f.write("not an image")
+
+    def ingest(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            ingester = ImageIngester("postcard", object_image_target, workers=1)
+            ingester.ingest(self.upload)
+        return ingester
+
+    def test_ingest(self):
+        ingester = self.ingest()
+        self.assertEqual(ingester.counts["images"], 1)
+        self.assertEqual(
+            [filename for filename, _ in ingester.problems],
+            ["AR_9-Front.jpg", "AR_12-Reverse.png"],
+        )
+        image = self.postal_object.images.get()
+        self.assertEqual(image.image_caption, "Front")
+        self.assertEqual(image.image.name, "images/AR_12-Front.jpg")
+        self.assertEqual(len(image.content_hash), 64)
+        self.assertEqual(
+            image.thumbnail,
+            {
+                "webp": "/media/images/AR_12-Front_thumbnail.webp",
+                "jpg": "/media/images/AR_12-Front_thumbnail.jpg",
+            },
+        )
+
+    def test_reingest_skips_files_already_attached(self):
+        self.ingest()
+        ingester = self.ingest()
+        self.assertEqual(ingester.counts["images"], 0)
+        self.assertEqual(ingester.counts["already ingested"], 1)
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_reingest_skips_images_attached_before_hashing(self):
+        Image.objects.create(
+            postcard=self.postal_object, image="images/AR_12-Front.jpg"
+        )
+        ingester = self.ingest()
+        self.assertEqual(ingester.counts["images"], 0)
+        self.assertEqual(ingester.counts["already ingested"], 1)
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_uploaded_images_get_derivatives(self):
+        scan = io.BytesIO()
+        PILImage.new("RGB", (3000, 2000), "red").save(scan, "JPEG")
+        with override_settings(MEDIA_ROOT=self.media):
+            image = Image(postcard=self.postal_object)
+            image.image.save("AR_12-Reverse.jpg", ContentFile(scan.getvalue()))
+            image.refresh_from_db()
+            self.assertTrue(image.has_derivatives)
+            with image.image.storage.open(image.derivatives["medium"]["webp"]) as f:
+                self.assertEqual(PILImage.open(f).size, (1000, 667))
+            self.assertEqual(
+                ImageSerializer(image).data["medium"]["jpg"],
+                "/media/images/AR_12-Reverse_medium.jpg",
+            )
+
+
+class GeocodingTest(TestCase):
+    def setUp(self):
+        path = f"{tempfile.mkdtemp()}/gazetteer.csv"
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows(
+                [
+                    ["address", "latitude", "longitude"],
+                    ["Arnhem, Netherlands", "51.98", "5.91"],
+                    ["Velp, Netherlands", "52", "5.98"],
+                ]
+            )
+        self.backend = GazetteerBackend(path)
+
+    def test_saves_queue_lookups(self):
+        location = Location.objects.create(town_city="Arnhem ", country="Netherlands")
+        self.assertIsNone(location.latitude)
+        self.assertEqual(Geocode.objects.get().address, "arnhem, netherlands")
+        Person.objects.bulk_create(
+            [Person(last_name="Jansen", street="Steenstraat", location=location)]
+        )
+        saved_at = location.updated_at
+
+        self.assertEqual(run_worker(self.backend), 2)
+        location.refresh_from_db()
+        self.assertEqual(str(location.latitude), "51.980000")
+        self.assertGreater(location.updated_at, saved_at)
+        person = Person.objects.get()
+        self.assertEqual(str(person.longitude), "5.910000")
+        self.assertEqual(
+            Geocode.objects.get(address="steenstraat, arnhem, netherlands").status,
+            Geocode.FOUND,
+        )
+
+        # An address looked up before is placed as it's saved.
+        again = Location.objects.create(town_city="arnhem", country="netherlands")
+        self.assertEqual(str(again.latitude), "51.980000")
+
+    def test_unknown_addresses(self):
+        Location.objects.create(town_city="Atlantis")
+        run_worker(self.backend)
+        self.assertEqual(Geocode.objects.get().status, Geocode.NOT_FOUND)
+        self.assertIsNone(Location.objects.get().latitude)
+
+    def test_rate_cannot_exceed_backend_limit(self):
+        self.backend.min_delay = 0.05
+        geocodes = [
+            Geocode.objects.create(address=address)
+            for address in ["arnhem, netherlands", "velp, netherlands", "atlantis"]
+        ]
+        started = time.monotonic()
+        resolve(geocodes, self.backend, workers=3, rate=1000)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_backfill_looks_each_address_up_once(self):
+        lookups = []
+        geocode = self.backend.geocode
+
+        def counted_geocode(address):
+            lookups.append(address)
+            return geocode(address)
+
+        self.backend.geocode = counted_geocode
+        arnhem, velp = Location.objects.bulk_create(
+            [
+                Location(town_city="Arnhem", country="Netherlands"),
+                Location(
+                    town_city="Velp", country="Netherlands", latitude=52, longitude=6
+                ),
+            ]
+        )
+        Person.objects.bulk_create(
+            [
+                Person(last_name="Jansen", location=arnhem),
+                Person(last_name="Bakker", location=arnhem),
+                Person(last_name="Visser", location=velp),
+                Person(last_name="Smit", street="Steenstraat", location=arnhem),
+                Person(last_name="de Vries", street="Steenstraat", location=arnhem),
+            ]
+        )
+
+        geocodes, updated = backfill(self.backend, workers=3)
+        self.assertEqual(
+            sorted(lookups), ["arnhem, netherlands", "steenstraat, arnhem, netherlands"]
+        )
+        self.assertEqual(updated, 6)
+        self.assertEqual(
+            str(Person.objects.get(last_name="Visser").latitude), "52.000000"
+        )
+        self.assertFalse(Person.objects.filter(latitude=None).exists())
+
+        self.assertEqual(backfill(self.backend), ([], 0))
+        self.assertEqual(len(lookups), 2)
+
+
+class KeywordSearchTest(TestCase):
+    def setUp(self):
+        arnhem = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52.0, longitude=5.9
+        )
+        sender = Person.objects.create(
+            first_name="Anna", last_name="Jansen", latitude=52.0, longitude=5.9
+        )
+        self.postal_object = Object.objects.create(
+            sender_name=sender,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        self.postal_object.postmark.add(Postmark.objects.create(location=arnhem))
+        Object.objects.create(
+            collection_location="Box 2",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def search(self, value):
+        return list(search_objects(Object.objects.all(), value))
+
+    def test_search_matches_names_places_and_transcriptions(self):
+        self.assertEqual(self.search("jansen"), [self.postal_object])
+        self.assertEqual(self.search("Arn"), [self.postal_object])
+        self.assertEqual(self.search("zeppelin"), [])
+
+        Transcription.manager.create(
+            postal_object=self.postal_object,
+            transcription="Lieber Zeppelin",
+            language=None,
+        )
+        self.assertEqual(self.search("zeppelin"), [self.postal_object])
+
+    def test_search_follows_renamed_people(self):
+        self.postal_object.sender_name.last_name = "de Vries"
+        self.postal_object.sender_name.save()
+        self.assertEqual(self.search("jansen"), [])
+        self.assertEqual(self.search("vries"), [self.postal_object])
+
+
+class WriterChoicesTest(TestCase):
+    def create_object(self, first_name, last_name):
+        return Object.objects.create(
+            sender_name=Person.objects.create(
+                first_name=first_name, last_name=last_name, latitude=52, longitude=6
+            ),
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def get_choices(self):
+        return [
+            name for name, _ in ObjectFilter().form.fields["correspondence"].choices
+        ]
+
+    def test_choices_are_cached_and_stay_current(self):
+        cache.clear()
+        self.create_object("Anna", "Jansen")
+        self.assertIn("Anna Jansen", self.get_choices())
+        with self.assertNumQueries(0):
+            combine_all_names()
+
+        self.create_object("Piet", "Bakker")
+        self.create_object("Anna", "Jansen")
+        choices = self.get_choices()
+        self.assertIn("Piet Bakker", choices)
+        self.assertEqual(choices.count("Anna Jansen"), 1)
+
+
+class DateFilterTest(TestCase):
+    def setUp(self):
+        location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52, longitude=6
+        )
+        self.objects = {}
+        for written, postmarked in [
+            ("1940-05-10", ["1940-05-12", "1940-05-14"]),
+            ("1940-12-31", []),
+            ("1943-01-05", ["1943-01-09"]),
+        ]:
+            postal_object = Object.objects.create(
+                date_of_correspondence=written,
+                collection_location="Box 1",
+                return_to_sender=False,
+                regime_censor="no",
+                translated="no",
+            )
+            for day in postmarked:
+                postal_object.postmark.add(
+                    Postmark.objects.create(location=location, date=day)
+                )
+            self.objects[written] = postal_object
+
+    def filter(self, **params):
+        return sorted(
+            str(obj.date_of_correspondence)
+            for obj in ObjectFilter(params, queryset=Object.objects.all()).qs
+        )
+
+    def test_parse_date_range(self):
+        self.assertEqual(parse_date_range("1940"), (date(1940, 1, 1), date(1941, 1, 1)))
+        self.assertEqual(
+            parse_date_range("1940-02"), (date(1940, 2, 1), date(1940, 3, 1))
+        )
+        self.assertEqual(
+            parse_date_range("05/12/1940"), (date(1940, 5, 12), date(1940, 5, 13))
+        )
+        self.assertEqual(
+            parse_date_range("May 1940"), (date(1940, 5, 1), date(1940, 6, 1))
+        )
+        self.assertIsNone(parse_date_range("1940-13"))
+        self.assertIsNone(parse_date_range("soon"))
+        self.assertIsNone(parse_date_range("5"))
+        self.assertIsNone(parse_date_range("May 12"))
+
+    def test_partial_dates(self):
+        self.assertEqual(self.filter(date="1940"), ["1940-05-10", "1940-12-31"])
+        self.assertEqual(self.filter(month="1940-05"), ["1940-05-10"])
+        self.assertEqual(self.filter(month="1940"), [])
+        self.assertEqual(self.filter(year="1943"), ["1943-01-05"])
+        self.assertEqual(self.filter(date="someday"), [])
+
+    def test_ranges(self):
+        self.assertEqual(
+            self.filter(date_after="1940-06", date_before="1943-01"),
+            ["1940-12-31", "1943-01-05"],
+        )
+        self.assertEqual(self.filter(date_before="1940"), ["1940-05-10", "1940-12-31"])
+
+    def test_postmark_dates_match_each_object_once(self):
+        self.assertEqual(self.filter(postmarked="1940-05"), ["1940-05-10"])
+        self.assertEqual(
+            self.filter(postmarked_after="1940-05-13"), ["1940-05-10", "1943-01-05"]
+        )
+
+    def test_postmark_ids_and_legacy_labels(self):
+        postmarks = list(Postmark.objects.order_by("date"))
+        self.assertEqual(
+            self.filter(postmark=f"{postmarks[0].pk},{postmarks[1].pk}"),
+            ["1940-05-10"],
+        )
+        self.assertEqual(self.filter(postmark=str(postmarks[2])), ["1943-01-05"])
+        self.assertEqual(
+            self.filter(postmark_location=postmarks[0].location_id),
+            ["1940-05-10", "1943-01-05"],
+        )
+        self.assertEqual(self.filter(postmark="Postmarked at Utrecht"), [])
+
+    def test_ranges_use_plain_comparisons(self):
+        sql = str(
+            ObjectFilter({"date": "1940"}, queryset=Object.objects.all()).qs.query
+        )
+        self.assertIn('"date_of_correspondence" >= 1940-01-01', sql)
+        self.assertNotIn("LIKE", sql)
+
+
+class FacetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.arnhem = Location.objects.create(
+            town_city="Arnhem", province_state="Gelderland", latitude=52, longitude=6
+        )
+        Postmark.objects.create(location=self.arnhem)
+
+    def test_facets_are_cached_and_skipped_for_htmx(self):
+        response = self.client.get("/items/")
+        self.assertEqual(response.context["cities_list"], ["Arnhem"])
+        self.assertEqual(
+            response.context["postmarks"],
+            [(Postmark.objects.get().pk, "Postmarked at Arnhem, dated unknown date")],
+        )
+
+        response = self.client.get("/items/", HTTP_HX_REQUEST="true")
+        self.assertNotIn("postmarks", response.context)
+
+        Postmark.objects.create(location=self.arnhem)
+        response = self.client.get("/items/")
+        self.assertEqual(len(response.context["postmarks"]), 2)
+
+
+class FacetCountTest(TestCase):
+    def create_object(self, letter_type, date):
+        return Object.objects.create(
+            letter_type=letter_type,
+            date_of_correspondence=date,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def test_counts_follow_filters(self):
+        cache.clear()
+        self.create_object("postcard", "1942-05-01").tags.add("family")
+        self.create_object("postcard", "1943-01-12").tags.add("family", "war")
+        self.create_object("letter", "1943-06-30")
+        combine_all_names()
+
+        with CaptureQueriesContext(connection) as context:
+            facets = self.client.get("/api/facets/").json()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(
+            facets["letter_type"],
+            [{"value": "postcard", "count": 2}, {"value": "letter", "count": 1}],
+        )
+        self.assertEqual(facets["tag"][0], {"value": "family", "count": 2})
+
+        facets = self.client.get("/api/facets/", {"date": "1943"}).json()
+        self.assertEqual(facets["year"], [{"value": "1943", "count": 2}])
+
+    def test_counts_for_plain_dict_parameters(self):
+        self.create_object("postcard", "1942-05-01")
+        self.create_object("letter", "1943-06-30")
+        combine_all_names()
+        for data in [{}, {"date": "1943"}]:
+            filterset = ObjectFilter(data, queryset=Object.objects.all())
+            facets = get_facet_counts(filterset)
+            self.assertEqual(
+                sum(item["count"] for item in facets["letter_type"]),
+                filterset.qs.count(),
+            )
+
+
+class ItemTableQueryTest(TestCase):
+    def create_objects(self, count):
+        location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52, longitude=6
+        )
+        for i in range(count):
+            person = Person.objects.create(
+                first_name="Anna", location=location, latitude=52, longitude=6
+            )
+            postal_object = Object.objects.create(
+                sender_name=person,
+                addressee_name=person,
+                collection_location="Box 1",
+                return_to_sender=False,
+                regime_censor="no",
+                translated="no",
+            )
+            postal_object.postmark.add(Postmark.objects.create(location=location))
+            Image.objects.create(postcard=postal_object, image=f"images/{i}.jpg")
+
+    def test_a_page_costs_a_fixed_number_of_queries(self):
+        self.create_objects(10)
+        self.client.get("/items/")
+        # two counts (table and paginator), the page, its postmarks and images
+        with self.assertNumQueries(5):
+            response = self.client.get("/items/", HTTP_HX_REQUEST="true")
+        self.assertContains(response, "images/0.jpg")
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        person = Person.objects.create(last_name="Jansen", latitude=52, longitude=6)
+        self.postal_object = Object.objects.create(
+            sender_name=person,
+            date_of_correspondence="1943-01-01",
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def test_htmx_partials_are_cached_per_filter_combination(self):
+        self.client.get("/items/?sort=sender_name&page=1", HTTP_HX_REQUEST="true")
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/items/?page=1&all_fields=&sort=sender_name", HTTP_HX_REQUEST="true"
+            )
+        self.assertContains(response, "Jansen")
+
+    def test_saving_an_object_invalidates_the_partials(self):
+        self.client.get("/items/", HTTP_HX_REQUEST="true")
+        self.postal_object.date_of_correspondence = "1944-05-06"
+        self.postal_object.save()
+        response = self.client.get("/items/", HTTP_HX_REQUEST="true")
+        self.assertContains(response, "1944")
+
+
+class CorrespondenceTest(TestCase):
+    def setUp(self):
+        self.anna = Person.objects.create(first_name="Anna", latitude=52, longitude=6)
+        self.jan = Person.objects.create(first_name="Jan", latitude=51, longitude=5)
+
+    def create_object(self, sender, addressee, date):
+        return Object.objects.create(
+            sender_name=sender,
+            addressee_name=addressee,
+            date_of_correspondence=date,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+
+    def test_sent_and_received_items_in_date_order(self):
+        received = self.create_object(self.jan, self.anna, "1943-02-01")
+        sent = self.create_object(self.anna, self.jan, "1943-01-01")
+        self.create_object(self.jan, self.jan, "1943-03-01")
+        correspondence = get_correspondence(self.anna)
+        self.assertEqual(list(correspondence), [sent, received])
+        self.assertEqual(
+            [item.direction for item in correspondence], ["sent", "received"]
+        )
+
+    def test_person_page_costs_a_fixed_number_of_queries(self):
+        self.create_object(self.anna, self.jan, "1943-01-01")
+        with CaptureQueriesContext(connection) as one_item:
+            self.client.get(f"/person/{self.anna.pk}/")
+        for day in range(2, 10):
+            self.create_object(self.jan, self.anna, f"1943-01-{day:02}")
+        with self.assertNumQueries(len(one_item)):
+            response = self.client.get(f"/person/{self.anna.pk}/")
+        self.assertContains(response, "sent by Jan to Anna", count=8)
+
+
+class ObjectPageCacheTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(
+            town_city="Arnhem", country="Netherlands", latitude=52, longitude=6
+        )
+        person = Person.objects.create(first_name="Anna", latitude=52, longitude=6)
+        self.postal_object = Object.objects.create(
+            sender_name=person,
+            addressee_name=person,
+            collection_location="Box 1",
+            return_to_sender=False,
+            regime_censor="no",
+            translated="no",
+        )
+        self.postal_object.postmark.add(Postmark.objects.create(location=self.location))
+        self.url = f"/items/{self.postal_object.pk}/"
+
+    def test_rendered_page_is_cached(self):
+        self.client.get(self.url)
+        # only the conditional GET validators are queried
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, "Arnhem, Netherlands")
+
+    def test_edits_invalidate_the_page(self):
+        self.client.get(self.url)
+        Transcription.manager.create(
+            postal_object=self.postal_object, transcription="Lieve Jan", language=None
+        )
+        self.assertContains(self.client.get(self.url), "Lieve Jan")
+        self.location.town_city = "Utrecht"
+        self.location.save()
+        self.assertContains(self.client.get(self.url), "Utrecht, Netherlands")
+
+    def test_missing_object(self):
+        self.assertEqual(self.client.get("/items/0/").status_code, 404)
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        people = [
+            Person.objects.create(last_name=name, latitude=52, longitude=6)
+            for name in ["Bakker", "Jansen", None]
+        ]
+        for i in range(25):
+            Object.objects.create(
+                sender_name=people[i % 3],
+                date_of_correspondence=None if i % 4 == 0 else f"1943-01-{i % 7 + 1}",
+                collection_location="Box 1",
+                return_to_sender=False,
+                regime_censor="no",
+                translated="no",
+            )
+
+    def get_page(self, number, order_by=None):
+        table = ItemHtmxTable(Object.objects.all(), order_by=order_by)
+        table.paginate(KeysetPaginator, per_page=10, page=number)
+        return [row.record.pk for row in table.page.object_list]
+
+    def test_pages_cover_every_row_once(self):
+        for order_by in [None, "sender_name", "-date_of_correspondence"]:
+            cache.clear()
+            pages = [self.get_page(number, order_by) for number in [1, 2, 3]]
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertCountEqual(
+                sum(pages, []), Object.objects.values_list("pk", flat=True)
+            )
+            # Jumping straight to a page lands on the same rows as paging to it.
+            cache.clear()
+            self.assertEqual(self.get_page(3, order_by), pages[2])
+
+    def test_next_page_seeks_instead_of_counting(self):
+        self.get_page(1)
+        with CaptureQueriesContext(connection) as context:
+            self.get_page(2)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn("OFFSET", context.captured_queries[0]["sql"])
+
+    def test_changes_invalidate_counts_and_bookmarks(self):
+        self.assertEqual(len(self.get_page(3)), 5)
+        Object.objects.filter(pk__in=self.get_page(2)).delete()
+        self.assertEqual(len(self.get_page(2)), 5)
+        self.assertEqual(self.get_page(3), self.get_page(2))
+
+    @override_settings(KEYSET_PAGINATED_TABLES=["items"])
+    def test_tables_opt_in(self):
+        self.client.get("/items/")
+        # the page, its postmarks and images; the count is cached
+        with self.assertNumQueries(3):
+            self.client.get("/items/", HTTP_HX_REQUEST="true")
+
+    def test_float_annotations_page_through_ties(self):
+        # Ordered like keyword search results, with every row tied on rank.
+        queryset = Object.objects.annotate(
+            search_rank=Value(0.1, output_field=FloatField())
+        ).order_by("-search_rank", "pk")
+        self.assertIsNone(get_keyset_ordering(queryset))
+        pages = []
+        for number in [1, 2, 3]:
+            table = ItemHtmxTable(queryset)
+            table.paginate(KeysetPaginator, per_page=10, page=number)
+            pages.append([row.record.pk for row in table.page.object_list])
+        self.assertEqual(sum(pages, []), sorted(queryset.values_list("pk", flat=True)))
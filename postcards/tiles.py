@@ -0,0 +1,245 @@
+"""Mapbox Vector Tiles for the point layers on the map.
+
+Rather than sending every person, postmark and censor to the browser, the map
+requests ``/tiles/<layer>/<z>/<x>/<y>.pbf`` and only receives the points in view.
+Our layers only contain points, so we encode the tiles ourselves following the
+Mapbox Vector Tile 2.1 specification instead of pulling in a protobuf library.
+
+Rendered tiles are cached on disk under ``settings.TILE_CACHE_DIR``, in a
+directory for the current cache version of their layer (see
+``postcards.caching``). When rows that feed a layer change its version is bumped
+(see ``postcards.signals``), so tiles are read from a new directory, and those of
+older versions are deleted.
+"""
+
+import math
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from postcards.caching import bump_cache_version, get_cache_version
+from postcards.models import Censor, Person, Postmark
+
+EXTENT = 4096
+# Points just outside a tile are included so markers aren't clipped at its edges.
+BUFFER = 64
+MAX_ZOOM = 22
+
+
+def get_people(bounds):
+    """People, placed at their own coordinates or those of their town."""
+    return (
+        Person.objects.annotate(
+            lat=Coalesce("latitude", "location__latitude"),
+            lon=Coalesce("longitude", "location__longitude"),
+        )
+        .filter(**bounds)
+        .values_list("person_id", "lat", "lon", "person_id")
+    )
+
+
+def get_postmarks(bounds):
+    return (
+        Postmark.objects.annotate(
+            lat=F("location__latitude"), lon=F("location__longitude")
+        )
+        .filter(**bounds)
+        .values_list("postmark_id", "lat", "lon", "location__town_city")
+    )
+
+
+def get_censors(bounds):
+    return (
+        Censor.objects.annotate(
+            lat=F("censor_location__latitude"), lon=F("censor_location__longitude")
+        )
+        .filter(**bounds)
+        .values_list("censor_id", "lat", "lon", "censor_name")
+    )
+
+
+# Each layer maps to a query returning (id, latitude, longitude, property) rows and
+# the name of that property in the tile.
+TILE_LAYERS = {
+    "people": (get_people, "person_id"),
+    "postmarks": (get_postmarks, "name"),
+    "censors": (get_censors, "name"),
+}
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def project(latitude, longitude):
+    """Project to Web Mercator, scaled so the whole world is the unit square."""
+    latitude = max(min(latitude, 85.0511), -85.0511)
+    x = (longitude + 180) / 360
+    sin_lat = math.sin(math.radians(latitude))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def _tile_latitude(y, z):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2**z))))
+
+
+def tile_bounds(z, x, y):
+    """Return the query filters for the points in (or just around) a tile."""
+    margin = BUFFER / EXTENT
+    return {
+        "lon__gte": (x - margin) / 2**z * 360 - 180,
+        "lon__lte": (x + 1 + margin) / 2**z * 360 - 180,
+        "lat__gte": _tile_latitude(y + 1 + margin, z),
+        "lat__lte": _tile_latitude(y - margin, z),
+    }
+
+
+# Protocol buffer encoding --------------------------------------------------
+
+
+def _varint(value):
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _message(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number, values):
+    return _message(number, b"".join(_varint(value) for value in values))
+
+
+def _value(value):
+    """Encode a feature property as a vector tile Value message."""
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, int) and value >= 0:
+        return _field(5, 0) + _varint(value)
+    if isinstance(value, (int, float)):
+        return _field(3, 1) + struct.pack("<d", value)
+    return _message(1, str(value).encode())
+
+
+def encode_layer(name, features):
+    """Encode a layer of ``(id, x, y, properties)`` point features, with x and y
+    already in tile coordinates."""
+    keys, values = {}, {}
+    encoded_features = []
+    for feature_id, x, y, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            key_index = keys.setdefault(key, len(keys))
+            value_index = values.setdefault((type(value), value), len(values))
+            tags.extend([key_index, value_index])
+
+        feature = _field(1, 0) + _varint(feature_id)
+        if tags:
+            feature += _packed(2, tags)
+        feature += _field(3, 0) + _varint(1)  # POINT
+        feature += _packed(4, [9, _zigzag(x), _zigzag(y)])  # MoveTo(1) x y
+        encoded_features.append(_message(2, feature))
+
+    layer = _field(15, 0) + _varint(2) + _message(1, name.encode())
+    layer += b"".join(encoded_features)
+    layer += b"".join(_message(3, key.encode()) for key in keys)
+    layer += b"".join(_message(4, _value(value)) for _, value in values)
+    layer += _field(5, 0) + _varint(EXTENT)
+    return _message(3, layer)
+
+
+# Tiles -----------------------------------------------------------------------
+
+
+def render_tile(layer, z, x, y):
+    """Query the points for one tile of ``layer`` and encode them."""
+    query, property_name = TILE_LAYERS[layer]
+    scale = 2**z
+    features = []
+    for feature_id, latitude, longitude, value in query(tile_bounds(z, x, y)):
+        world_x, world_y = project(float(latitude), float(longitude))
+        features.append(
+            (
+                feature_id,
+                round((world_x * scale - x) * EXTENT),
+                round((world_y * scale - y) * EXTENT),
+                {property_name: value},
+            )
+        )
+    return encode_layer(layer, features)
+
+
+def _layer_dir(layer):
+    return Path(settings.TILE_CACHE_DIR) / layer
+
+
+def _cache_namespace(layer):
+    return f"tiles_{layer}"
+
+
+def get_tile(layer, z, x, y):
+    """Return an encoded tile, from the disk cache when possible.
+
+    The layer's version is read before the tile is rendered, so a tile rendered
+    from rows that change meanwhile is cached under a version no longer read.
+    """
+    version = get_cache_version(_cache_namespace(layer))
+    path = _layer_dir(layer) / str(version) / str(z) / str(x) / f"{y}.pbf"
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    tile = render_tile(layer, z, x, y)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so other requests never read half a
+        # tile.
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            tmp.write(tile)
+        os.replace(tmp.name, path)
+    except FileNotFoundError:
+        # clear_tile_cache deleted this version meanwhile, and the tile may be
+        # out of date, so it isn't cached.
+        pass
+    return tile
+
+
+def clear_tile_cache(*layers):
+    """Move the given layers to a new cache version, and delete the tiles cached
+    under older ones."""
+    for layer in layers:
+        namespace = _cache_namespace(layer)
+        bump_cache_version(namespace)
+        current = str(get_cache_version(namespace))
+        try:
+            directories = list(_layer_dir(layer).iterdir())
+        except FileNotFoundError:
+            continue
+        for directory in directories:
+            if directory.name != current:
+                shutil.rmtree(directory, ignore_errors=True)
@@ -64,5 +64,18 @@ urlpatterns = [
     path("documents/<int:id>/", views.document_details, name="document"),
     path("person/<int:id>/", views.person_details, name="person"),
     path("taggit/", include("taggit_selectize.urls")),
+    path(
+        "tiles/<str:layer>/<int:z>/<int:x>/<int:y>.pbf",
+        views.vector_tile,
+        name="vector_tile",
+    ),
+    path("api/routes/", views.routes, name="routes"),
+    path("api/clusters/", views.clusters, name="clusters"),
+    path("api/facets/", views.facet_counts, name="facet_counts"),
+    path(
+        "export/objects.<str:export_format>",
+        views.export_objects,
+        name="export_objects",
+    ),
     path("api/", include(router.urls)),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
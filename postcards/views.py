@@ -1,12 +1,35 @@
-from django.core.paginator import EmptyPage, Paginator
-from django.http import HttpRequest, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
+from django.utils.safestring import mark_safe
 from django_filters.views import FilterView
 from django_tables2 import SingleTableMixin
 
+from postcards.clustering import get_cluster_features
+from postcards.conditional import (
+    combine_validators,
+    condition_on,
+    get_request_variant,
+    get_validators,
+)
+from postcards.correspondence import get_correspondence, get_correspondent
+from postcards.details import render_object_details
+from postcards.export import EXPORT_FORMATS, aiter_chunks, iter_rows
+from postcards.facets import get_facet_counts, get_location_values, get_postmarks
 from postcards.filters import ObjectFilter, PrimarySourceFilter
-from postcards.models import Location, Object, Person, Postmark, PrimarySource
+from postcards.fragments import FragmentCacheMixin
+from postcards.models import Image, Object, Person, Postmark, PrimarySource
+from postcards.pagination import KeysetPaginationMixin
+from postcards.routes import get_route_features
 from postcards.tables import DocumentsHtmxTable, ItemHtmxTable
+from postcards.tiles import TILE_LAYERS, get_tile, is_valid_tile
 
 
 def filtered_person_data(request):
@@ -136,20 +159,62 @@ def resources(request: HttpRequest):
 
 
 def mapinterface(request: HttpRequest):
-    person = get_object_or_404(Person, pk=id)
-    postal_material = (
-        person.sender_objects.all()
-        .union(person.addressee_objects.all())
-        .order_by("date_of_correspondence")
-    )
     nav_links = get_nav_links("map")
     ctx = {
         "nav_links": nav_links,
-        "postal_material": postal_material,
     }
     return render(request, "postal/map.html", ctx)
 
 
+def routes(request: HttpRequest):
+    """GeoJSON of every postal route, used for the routes layer on the map."""
+    return JsonResponse(get_route_features())
+
+
+def clusters(request: HttpRequest):
+    """GeoJSON of the clustered people within ``?bbox=west,south,east,north`` at
+    ``?zoom=``, used for the people layer on the map."""
+    try:
+        zoom = int(request.GET["zoom"])
+        west, south, east, north = (float(v) for v in request.GET["bbox"].split(","))
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {"error": "Provide ?zoom= and ?bbox=west,south,east,north."}, status=400
+        )
+    return JsonResponse(get_cluster_features(zoom, west, south, east, north))
+
+
+def export_objects(request: HttpRequest, export_format: str):
+    """Stream every postal object as NDJSON or CSV."""
+    if export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export format.")
+    serialize, content_type = EXPORT_FORMATS[export_format]
+    lines = serialize(iter_rows())
+    if isinstance(request, ASGIRequest):
+        lines = aiter_chunks(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response.headers[
+        "Content-Disposition"
+    ] = f'attachment; filename="postal-objects.{export_format}"'
+    return response
+
+
+def facet_counts(request: HttpRequest):
+    """How many objects matching the Browse Items filters in the query string fall
+    under each collection, letter type, censor status, year and tag."""
+    filterset = ObjectFilter(request.GET, queryset=Object.objects.all())
+    return JsonResponse(get_facet_counts(filterset))
+
+
+def vector_tile(request: HttpRequest, layer: str, z: int, x: int, y: int):
+    """A Mapbox Vector Tile of the people, postmark or censor points on the map."""
+    if layer not in TILE_LAYERS or not is_valid_tile(z, x, y):
+        raise Http404("No such tile.")
+    return HttpResponse(
+        get_tile(layer, z, x, y), content_type="application/vnd.mapbox-vector-tile"
+    )
+
+
 def table(request: HttpRequest):
     nav_links = get_nav_links("items")
     ctx = {
@@ -164,16 +229,67 @@ def get_object(request: HttpRequest):
     return postal_object
 
 
+def object_validators(request: HttpRequest, id: int):
+    return get_validators(
+        Object.objects.filter(pk=id),
+        (
+            "updated_at",
+            "sender_name__updated_at",
+            "addressee_name__updated_at",
+            "regime_location__last_modified",
+            "postmark__updated_at",
+            "postmark__location__updated_at",
+            "transcriptions__last_modified",
+            "images__updated_at",
+        ),
+        count_fields=("images", "postmark", "transcriptions"),
+        extra=get_request_variant(request),
+    )
+
+
+def document_validators(request: HttpRequest, id: int):
+    return get_validators(
+        PrimarySource.objects.filter(pk=id),
+        ("updated_at",),
+        count_fields=("images",),
+        extra=get_request_variant(request),
+    )
+
+
+def person_validators(request: HttpRequest, id: int):
+    # Each relation is aggregated on its own, since joining a prolific
+    # correspondent's sent and received objects and sources multiplies them.
+    return combine_validators(
+        get_validators(
+            Person.objects.filter(pk=id),
+            ("updated_at", "location__updated_at"),
+            extra=get_request_variant(request),
+        ),
+        get_validators(
+            Object.objects.filter(sender_name=id),
+            ("updated_at", "addressee_name__updated_at"),
+        ),
+        get_validators(
+            Object.objects.filter(addressee_name=id),
+            ("updated_at", "sender_name__updated_at"),
+        ),
+        get_validators(PrimarySource.objects.filter(person=id), ("updated_at",)),
+    )
+
+
+@condition_on(object_validators)
 def object_details(request: HttpRequest, id: int):
-    postal_object = get_object_or_404(Object, pk=id)
+    page = render_object_details(id)
     nav_links = get_nav_links("")
     ctx = {
-        "object": postal_object,
+        "item_id": page["item_id"],
+        "content": mark_safe(page["content"]),
         "nav_links": nav_links,
     }
     return render(request, "postal/object_details.html", ctx)
 
 
+@condition_on(document_validators)
 def document_details(request: HttpRequest, id: int):
     document = get_object_or_404(PrimarySource, pk=id)
     nav_links = get_nav_links("")
@@ -184,13 +300,10 @@ def document_details(request: HttpRequest, id: int):
     return render(request, "postal/document_details.html", ctx)
 
 
+@condition_on(person_validators)
 def person_details(request: HttpRequest, id: int):
-    person = get_object_or_404(Person, pk=id)
-    postal_material = (
-        person.sender_objects.all()
-        .union(person.addressee_objects.all())
-        .order_by("date_of_correspondence")
-    )
+    person = get_correspondent(id)
+    postal_material = get_correspondence(person)
     nav_links = get_nav_links("")
     ctx = {
         "person": person,
@@ -200,47 +313,39 @@ def person_details(request: HttpRequest, id: int):
     return render(request, "postal/person_details.html", ctx)
 
 
-class CustomPaginator(Paginator):
-    def validate_number(self, number):
-        try:
-            return super().validate_number(number)
-        except EmptyPage:
-            if int(number) > 1:
-                # return the last page
-                return self.num_pages
-            elif int(number) < 1:
-                # return the first page
-                return 1
-            else:
-                raise
+def first_image_prefetch():
+    """Prefetch just the first image of each row into ``first_images``, for the
+    table thumbnails."""
+    return Prefetch(
+        "images", queryset=Image.objects.order_by("pk")[:1], to_attr="first_images"
+    )
 
 
 # this will render the table
-class ItemHtmxTableView(SingleTableMixin, FilterView):
+class ItemHtmxTableView(
+    FragmentCacheMixin, KeysetPaginationMixin, SingleTableMixin, FilterView
+):
     table_class = ItemHtmxTable
-    queryset = Object.objects.all()
+    queryset = (
+        Object.objects.defer("search_vector")
+        .select_related("sender_name__location", "addressee_name", "collection")
+        .prefetch_related(
+            Prefetch("postmark", Postmark.objects.select_related("location")),
+            first_image_prefetch(),
+        )
+    )
     filterset_class = ObjectFilter
     paginate_by = 10
-    paginator_class = CustomPaginator
-
-    def get_postmarks(self):
-        postmarks = [str(postmark) for postmark in Postmark.objects.all()]
-        return postmarks
-
-    def get_location_data(self, field_name):
-        location_data = list(
-            Location.objects.exclude(**{field_name: None})
-            .values_list(field_name, flat=True)
-            .distinct()
-        )
-        return sorted(location_data)
+    keyset_table = "items"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["is_database_page"] = True
-        context["postmarks"] = self.get_postmarks()
-        context["cities_list"] = self.get_location_data("town_city")
-        context["states_list"] = self.get_location_data("province_state")
+        # The filter dropdowns aren't part of the partial htmx re-renders.
+        if not self.request.htmx:
+            context["postmarks"] = get_postmarks()
+            context["cities_list"] = get_location_values("town_city")
+            context["states_list"] = get_location_values("province_state")
         return context
 
     # adjust the template depending on whether an htmx request was made
@@ -253,12 +358,16 @@ class ItemHtmxTableView(SingleTableMixin, FilterView):
         return template_name
 
 
-class DocumentsHtmxTableView(SingleTableMixin, FilterView):
+class DocumentsHtmxTableView(
+    FragmentCacheMixin, KeysetPaginationMixin, SingleTableMixin, FilterView
+):
     table_class = DocumentsHtmxTable
-    queryset = PrimarySource.objects.all()
+    queryset = PrimarySource.objects.select_related("collection").prefetch_related(
+        first_image_prefetch()
+    )
     filterset_class = PrimarySourceFilter
     paginate_by = 10
-    paginator_class = CustomPaginator
+    keyset_table = "documents"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
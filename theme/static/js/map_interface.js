@@ -20,200 +20,132 @@ map.flyTo({
 const progressIndicator = document.querySelector(".spinner-border");
 progressIndicator.style.display = "block";
 
-// fetch our people data
-fetch("/api/people/")
-  .then((response) => response.json())
-  .then((data) => {
-    const features = data.map(function (person) {
-      return {
-        type: "Feature",
-        geometry: {
-          type: "Point",
-          coordinates: [person.longitude, person.latitude],
-        },
-        properties: {
-          person_id: person.person_id,
-          point_type: "person",
-        },
-      };
-    });
-
-    const geojson = {
-      type: "FeatureCollection",
-      features: features,
-    };
-
-    map.addLayer({
-      id: "circles",
-      type: "circle",
-      source: {
-        type: "geojson",
-        data: geojson,
-      },
-      paint: {
-        "circle-radius": 7,
-        "circle-color": "blue",
-        "circle-opacity": 0.75,
-      },
-    });
-
-    // When a user clicks on a Person circle on the map, we tell Alpine to set isOpen to true
-    map.on("click", function (e) {
-      // Use queryRenderedFeatures to check if a circle was clicked
-      const features = map.queryRenderedFeatures(e.point, {
-        layers: ["circles"],
-      });
-
-      const personId = features[0].properties.person_id;
-      fetch(`/api/people/${personId}`)
-        .then((response) => response.json())
-        .then((data) => {
-          window.sidebarComponent.$nextTick(() => {
-            window.sidebarComponent.personSelected = data;
-            window.sidebarComponent.open = true;
-          });
-        })
-        .catch((error) => console.error(error));
-    });
-  })
-  .catch((error) => {
-    console.error(error);
-    progressIndicator.style.display = "none";
+// Postmarks and censors are served as vector tiles, so the map only loads the
+// points in view.
+function tileSource(layer) {
+  return {
+    type: "vector",
+    tiles: [`${window.location.origin}/tiles/${layer}/{z}/{x}/{y}.pbf`],
+    maxzoom: 14,
+  };
+}
+
+// People are clustered on the server for the current view and zoom level.
+function updateClusters() {
+  const bounds = map.getBounds().toArray().flat().join(",");
+  const zoom = Math.floor(map.getZoom());
+  fetch(`/api/clusters/?bbox=${bounds}&zoom=${zoom}`)
+    .then((response) => response.json())
+    .then((geojson) => map.getSource("people").setData(geojson))
+    .catch((error) => console.error(error));
+}
+
+map.on("load", function () {
+  map.addSource("people", {
+    type: "geojson",
+    data: { type: "FeatureCollection", features: [] },
+  });
+  map.addLayer({
+    id: "circles",
+    type: "circle",
+    source: "people",
+    paint: {
+      "circle-radius": [
+        "interpolate",
+        ["linear"],
+        ["get", "count"],
+        1,
+        7,
+        100,
+        20,
+      ],
+      "circle-color": "blue",
+      "circle-opacity": 0.75,
+    },
+  });
+  map.addLayer({
+    id: "cluster-counts",
+    type: "symbol",
+    source: "people",
+    filter: [">", ["get", "count"], 1],
+    layout: {
+      "text-field": ["get", "count"],
+      "text-size": 12,
+    },
+    paint: {
+      "text-color": "white",
+    },
+  });
+  updateClusters();
+
+  map.addLayer({
+    id: "postmarks",
+    type: "circle",
+    source: tileSource("postmarks"),
+    "source-layer": "postmarks",
+    paint: {
+      "circle-radius": 7,
+      "circle-color": "red",
+      "circle-opacity": 0.75,
+    },
   });
 
-// add the Postmarks
-fetch("/api/postmarks/")
-  .then((response) => response.json())
-  .then((data) => {
-    // filter null values
-    data = data.filter(function (postmark) {
-      return postmark.latitude && postmark.longitude;
-    });
-    const features = data.map(function (postmark) {
-      return {
-        type: "Feature",
-        geometry: {
-          type: "Point",
-          coordinates: [postmark.longitude, postmark.latitude],
-        },
-        properties: {
-          name: postmark.postmark,
-        },
-      };
-    });
-    const geojson = {
-      type: "FeatureCollection",
-      features: features,
-    };
-    map.addLayer({
-      id: "postmarks",
-      type: "circle",
-      source: {
-        type: "geojson",
-        data: geojson,
-      },
-      paint: {
-        "circle-radius": 7,
-        "circle-color": "red",
-        "circle-opacity": 0.75,
-      },
-    });
-
-    // map.on("click", "postmarks", function (e) {
-    //   new mapboxgl.Popup()
-    //     .setLngLat(e.features[0].geometry.coordinates)
-    //     .setHTML(e.features[0].properties.name)
-    //     .addTo(map);
-    // });
-  })
-  .catch((error) => {
-    console.error(error);
-    progressIndicator.style.display = "none";
+  map.addLayer({
+    id: "censors",
+    type: "circle",
+    source: tileSource("censors"),
+    "source-layer": "censors",
+    paint: {
+      "circle-radius": 15,
+      "circle-color": "lime",
+      "circle-opacity": 0.75,
+    },
   });
+});
 
-// add the Censors
+map.on("moveend", updateClusters);
 
-fetch("/api/censors/")
-  .then((response) => response.json())
-  .then((data) => {
-    //filter null lat/lon values
-    data = data.filter(function (censor) {
-      return censor.latitude && censor.longitude;
-    });
-    const features = data.map(function (censor) {
-      return {
-        type: "Feature",
-        geometry: {
-          type: "Point",
-          coordinates: [censor.longitude, censor.latitude],
-        },
-        properties: {
-          name: censor.censor,
-        },
-      };
-    });
-    const geojson = {
-      type: "FeatureCollection",
-      features: features,
-    };
-    map.addLayer({
-      id: "censors",
-      type: "circle",
-      source: {
-        type: "geojson",
-        data: geojson,
-      },
-      paint: {
-        "circle-radius": 15,
-        "circle-color": "lime",
-        "circle-opacity": 0.75,
-      },
+// When a user clicks on a Person circle on the map, we tell Alpine to set isOpen to true.
+// Clicking a cluster of several people zooms in on it instead.
+map.on("click", "circles", function (e) {
+  const cluster = e.features[0];
+  if (cluster.properties.count > 1) {
+    map.easeTo({
+      center: cluster.geometry.coordinates,
+      zoom: map.getZoom() + 2,
     });
+    return;
+  }
+  const personId = JSON.parse(cluster.properties.person_ids)[0];
+  fetch(`/api/people/${personId}`)
+    .then((response) => response.json())
+    .then((data) => {
+      window.sidebarComponent.$nextTick(() => {
+        window.sidebarComponent.personSelected = data;
+        window.sidebarComponent.open = true;
+      });
+    })
+    .catch((error) => console.error(error));
+});
 
-    map.on("click", "censors", function (e) {
-      new mapboxgl.Popup()
-        .setLngLat(e.features[0].geometry.coordinates)
-        .setHTML(e.features[0].properties.name)
-        .addTo(map);
-    });
-  })
-  .catch((error) => {
-    console.error(error);
-    progressIndicator.style.display = "none";
-  });
+// map.on("click", "postmarks", function (e) {
+//   new mapboxgl.Popup()
+//     .setLngLat(e.features[0].geometry.coordinates)
+//     .setHTML(e.features[0].properties.name)
+//     .addTo(map);
+// });
+
+map.on("click", "censors", function (e) {
+  new mapboxgl.Popup()
+    .setLngLat(e.features[0].geometry.coordinates)
+    .setHTML(e.features[0].properties.name)
+    .addTo(map);
+});
 
 // draw the routes
-fetch("/api/objects/")
+fetch("/api/routes/")
   .then((response) => response.json())
-  .then((data) => {
-    // filter null lat/lon values
-    data = data.filter(function (route) {
-      return (
-        route.sender_name.latitude &&
-        route.sender_name.longitude &&
-        route.addressee_name.latitude &&
-        route.addressee_name.longitude
-      );
-    });
-    const features = data.map(function (route) {
-      return {
-        type: "Feature",
-        geometry: {
-          type: "LineString",
-          coordinates: [
-            [route.sender_name.longitude, route.sender_name.latitude],
-            [route.addressee_name.longitude, route.addressee_name.latitude],
-          ],
-        },
-        properties: {
-          name: route.sender_name + " to " + route.addressee_name,
-        },
-      };
-    });
-    const geojson = {
-      type: "FeatureCollection",
-      features: features,
-    };
+  .then((geojson) => {
     map.addLayer({
       id: "routes",
       type: "line",